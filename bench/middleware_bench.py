@@ -0,0 +1,161 @@
+"""
+Per-request overhead of the request pipeline middleware (see middleware.py).
+
+Drives three in-process ASGI stacks over the same Starlette routes, with no
+sockets or server involved, so only the framework and middleware cost is
+measured:
+
+  bare      routes only, auth checked in the handler
+  legacy    the former BaseHTTPMiddleware path normalizer, auth in the handler
+  pipeline  RequestPipelineMiddleware (normalize, request id, auth, timing)
+
+Routes: a small JSON response, and a streamed response of --chunks chunks
+(where BaseHTTPMiddleware proxies every chunk through an extra task and
+memory stream).
+
+Example:
+  python bench/middleware_bench.py --requests 20000 --repeat 5
+
+Prints one JSON report: microseconds per request (best of --repeat) for each
+stack and route, and the pipeline's saving relative to legacy.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from middleware import RequestPipelineMiddleware  # noqa: E402
+
+KEY = "bench-user-key"
+EXPECTED = f"Bearer {KEY}"
+
+
+class LegacyNormalizePathMiddleware(BaseHTTPMiddleware):
+    """The middleware main.py used before the pure ASGI pipeline."""
+
+    async def dispatch(self, request: Request, call_next):
+        path = request.scope.get("path", "")
+        normalized = re.sub(r"/{2,}", "/", path)
+        if normalized != path:
+            request.scope["path"] = normalized
+        return await call_next(request)
+
+
+def _check(request: Request) -> None:
+    if request.scope.get("state", {}).get("principal") == "user":
+        return
+    if request.headers.get("Authorization") != EXPECTED:
+        raise RuntimeError("auth failed")
+
+
+def build_app(chunks: int, middleware: List[Middleware]) -> Starlette:
+    async def small(request: Request) -> Response:
+        _check(request)
+        return Response(b'{"status":"success","rows":1,"results":[{"id":1}]}', media_type="application/json")
+
+    async def stream(request: Request) -> Response:
+        _check(request)
+
+        async def body():
+            for _ in range(chunks):
+                yield b'{"id":1,"name":"x"}\n'
+
+        return StreamingResponse(body(), media_type="application/x-ndjson")
+
+    routes = [Route("/user/query", small, methods=["POST"]), Route("/user/stream", stream, methods=["POST"])]
+    return Starlette(routes=routes, middleware=middleware)
+
+
+def stacks(chunks: int) -> Dict[str, Any]:
+    authenticate = lambda role, header: role if header == EXPECTED.encode() else None  # noqa: E731
+    return {
+        "bare": build_app(chunks, []),
+        "legacy": build_app(chunks, [Middleware(LegacyNormalizePathMiddleware)]),
+        "pipeline": build_app(chunks, [Middleware(
+            RequestPipelineMiddleware, authenticate=authenticate, protected=(("/user/", "user"),),
+        )]),
+    }
+
+
+async def _one(app: Callable, path: str) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench"), (b"authorization", EXPECTED.encode()),
+                    (b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    sent = False
+
+    async def receive() -> Dict[str, Any]:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"{}", "more_body": False}
+        await asyncio.sleep(3600)  # client stays connected
+        return {"type": "http.disconnect"}
+
+    status = 0
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def measure(app: Callable, path: str, requests: int, repeat: int) -> float:
+    if await _one(app, path) != 200:
+        raise SystemExit(f"{path}: unexpected status")
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(requests):
+            await _one(app, path)
+        best = min(best, time.perf_counter() - start)
+    return best / requests * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000, help="requests per timed run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--chunks", type=int, default=100, help="body chunks per streamed response")
+    args = parser.parse_args()
+
+    async def run() -> Dict[str, Dict[str, float]]:
+        results: Dict[str, Dict[str, float]] = {}
+        for name, app in stacks(args.chunks).items():
+            results[name] = {
+                route: round(await measure(app, path, args.requests, args.repeat), 2)
+                for route, path in (("small_us", "/user/query"), ("stream_us", "/user/stream"))
+            }
+        return results
+
+    results = asyncio.run(run())
+    legacy = results["legacy"]
+    saving = {
+        route: round((1 - results["pipeline"][route] / legacy[route]) * 100, 1) if legacy[route] else 0.0
+        for route in legacy
+    }
+    print(json.dumps({"requests": args.requests, "repeat": args.repeat, "chunks": args.chunks,
+                      "us_per_request": results, "pipeline_saving_vs_legacy_pct": saving}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Per-row cost of result typecasting profiles (see db/typecasts.py).
+
+Fetches the same rows from a finance table once per profile and times the
+two costs a query pays per row: fetchall() (psycopg2 typecasting) and
+encoding the rows to JSON (db.encoding.encode). Each profile uses a fresh
+connection with the profile's casters registered, exactly as the pool's
+configure hook does.
+
+Example:
+  python bench/typecast_bench.py --spawn-postgres --rows 20000 --repeat 5
+  python bench/typecast_bench.py --pg-dsn postgresql://... --table finance.payroll
+
+Prints one JSON report: microseconds per row (best of --repeat) for each
+profile, and the saving relative to the psycopg2 defaults.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from db.config import RoleTypecasts  # noqa: E402
+from db.encoding import encode  # noqa: E402
+from db.typecasts import typecast_setup  # noqa: E402
+from load_test import _given, seed, spawned_postgres  # noqa: E402
+
+PROFILES = {
+    "default": RoleTypecasts(),
+    "numeric_float": RoleTypecasts(numeric="float"),
+    "numeric_text": RoleTypecasts(numeric="text"),
+    "all_text": RoleTypecasts(numeric="text", temporal="text"),
+    "float_temporal_text": RoleTypecasts(numeric="float", temporal="text"),
+}
+
+
+def measure(dsn: str, table: str, limit: int, profile: RoleTypecasts, repeat: int) -> Dict[str, Any]:
+    conn = psycopg2.connect(dsn)
+    try:
+        register = typecast_setup(profile)
+        if register is not None:
+            register(conn)
+        fetch_best = encode_best = float("inf")
+        rows: List[tuple] = []
+        for _ in range(repeat):
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT * FROM {table} LIMIT %s", (limit,))
+                start = time.perf_counter()
+                rows = cur.fetchall()
+                fetch_best = min(fetch_best, time.perf_counter() - start)
+                columns = [d[0] for d in cur.description]
+            start = time.perf_counter()
+            encode([dict(zip(columns, row)) for row in rows])
+            encode_best = min(encode_best, time.perf_counter() - start)
+            conn.rollback()
+    finally:
+        conn.close()
+    n = max(1, len(rows))
+    return {
+        "rows": len(rows),
+        "fetch_us_per_row": round(fetch_best / n * 1e6, 3),
+        "encode_us_per_row": round(encode_best / n * 1e6, 3),
+        "total_us_per_row": round((fetch_best + encode_best) / n * 1e6, 3),
+        "sample": [str(v) for v in rows[0]] if rows else [],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    db = parser.add_mutually_exclusive_group(required=True)
+    db.add_argument("--pg-dsn", help="DSN of an existing Postgres (used as-is unless --seed)")
+    db.add_argument("--spawn-postgres", action="store_true", help="run a throwaway cluster via initdb/pg_ctl")
+    parser.add_argument("--seed", action="store_true", help="(re)create the bench company/finance schemas")
+    parser.add_argument("--table", default="finance.payroll")
+    parser.add_argument("--rows", type=int, default=20000, help="rows fetched per run")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with (spawned_postgres() if args.spawn_postgres else _given(args.pg_dsn)) as dsn:
+        if args.spawn_postgres or args.seed:
+            # payroll holds 12 rows per employee
+            seed(dsn, max(1, args.rows // 12 + 1))
+        results = {name: measure(dsn, args.table, args.rows, profile, args.repeat)
+                   for name, profile in PROFILES.items()}
+
+    baseline = results["default"]["total_us_per_row"]
+    for result in results.values():
+        result["saving_vs_default_pct"] = (
+            round((1 - result["total_us_per_row"] / baseline) * 100, 1) if baseline else 0.0
+        )
+    print(json.dumps({"table": args.table, "repeat": args.repeat, "profiles": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Per-key admission control: a token bucket plus a cap on in-flight queries,
+shared by every worker process on the host.
+
+Excess requests are rejected immediately (the API answers 429 with
+Retry-After) instead of queueing, so one client stuck in a retry loop cannot
+occupy every worker and pooled connection.
+
+State lives in a memory-mapped file of fixed-size slots, one per active key
+(open addressing on the key digest). Each slot holds the bucket (tokens,
+last refill) and a small table of in-flight lease expiry times. A slot is
+updated under an fcntl record lock on its own byte range, so workers only
+contend when they serve the same key. admit() runs on the event loop, so it
+never blocks on a lock: it retries a locked slot with a short backoff (about
+a millisecond in all) and, if the slot is still locked, admits the request
+without accounting it (fail open, counted in api_admission_contended_total)
+rather than rejecting a client that is within its limits. A release that
+finds its slot locked is finished by a background thread. The state file is
+created and mapped once per worker at startup (open_admission()).
+
+A lease that is never released (worker killed mid-request) stops counting
+once it expires. Leases last at least the role's statement_timeout plus a
+minute, and the middleware renews them while a response is being sent, so a
+long stream or export keeps counting against max_in_flight.
+
+Limits come from the key's `limits` in mcp_config.yaml (see db/api_keys.py);
+keys without limits fall back to the defaults below, and a key with no
+effective limit skips admission entirely (no file access).
+
+Config:
+  ADMISSION_RATE_PER_SECOND   default sustained requests/second per key (default 0: unlimited)
+  ADMISSION_BURST             default bucket size (default: rate rounded up, at least 1)
+  ADMISSION_MAX_IN_FLIGHT     default concurrent queries per key (default 0: unlimited; max 32)
+  ADMISSION_LEASE_TIMEOUT     seconds after which an unrenewed lease expires (default 300; at
+                              least the role's statement_timeout + 60)
+  ADMISSION_STATE_PATH        state file (default: api_admission.state in the temp dir)
+  ADMISSION_SLOTS             keys tracked at once (default 1024)
+"""
+import fcntl
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional, Tuple
+
+from db import metrics
+from db.api_keys import ApiKey
+from db.config import role_limits
+
+_HEADER = struct.Struct("<8sII")  # magic, slots, slot size
+_MAGIC = b"ADMIT001"
+MAX_LEASES = 32
+_SLOT = struct.Struct("<16sdd%dd" % MAX_LEASES)  # key id, tokens, refilled at, lease expiries
+_PROBES = 8
+_LOCK_BACKOFF = (0.0, 0.0001, 0.0002, 0.0003, 0.0004)  # seconds slept before each lock attempt
+
+DEFAULT_RATE = float(os.getenv("ADMISSION_RATE_PER_SECOND", "0"))
+DEFAULT_BURST = int(os.getenv("ADMISSION_BURST", "0"))
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "0"))
+LEASE_TIMEOUT = float(os.getenv("ADMISSION_LEASE_TIMEOUT", "300"))
+
+
+class Rejection(NamedTuple):
+    reason: str          # "rate" | "concurrency" | "capacity"
+    retry_after: float   # seconds
+
+
+class _Busy(Exception):
+    """A slot stayed locked by another process through every retry."""
+
+
+class Lease:
+    """
+    One admitted request; release() frees its in-flight slot (idempotent) and
+    renew() pushes its expiry back once half the timeout has passed.
+    """
+
+    __slots__ = ("_table", "_slot", "_key_id", "_index", "_expiry", "_timeout", "_renew_at")
+
+    def __init__(self, table: Optional["AdmissionTable"], slot: int, key_id: bytes, index: int, expiry: float,
+                 timeout: float = 0.0):
+        self._table = table
+        self._slot = slot
+        self._key_id = key_id
+        self._index = index
+        self._expiry = expiry
+        self._timeout = timeout
+        self._renew_at = expiry - timeout / 2
+
+    def renew(self) -> None:
+        table = self._table
+        if table is None or self._index < 0:
+            return
+        now = time.monotonic()
+        if now < self._renew_at:
+            return
+        expiry = now + self._timeout
+        if table.renew(self._slot, self._key_id, self._index, self._expiry, expiry):
+            self._expiry = expiry
+            self._renew_at = now + self._timeout / 2
+
+    def release(self) -> None:
+        table, self._table = self._table, None
+        if table is not None and self._index >= 0:
+            table.release(self._slot, self._key_id, self._index, self._expiry)
+
+
+_UNTRACKED = Lease(None, -1, b"", -1, 0.0)
+
+
+def effective_limits(key: ApiKey) -> Tuple[float, int, int]:
+    """(rate per second, burst, max in flight) for a key; 0 means unlimited."""
+    rate = float(key.limits.rate_per_second or DEFAULT_RATE)
+    burst = key.limits.burst or DEFAULT_BURST or max(1, math.ceil(rate))
+    max_in_flight = min(key.limits.max_in_flight or DEFAULT_MAX_IN_FLIGHT, MAX_LEASES)
+    return rate, burst, max_in_flight
+
+
+class AdmissionTable:
+    """Fixed-size slot table in a shared file, safe across processes and threads."""
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.slots = max(1, slots)
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+        self._pid: Optional[int] = None
+        self._releaser: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def _size(self) -> int:
+        return _HEADER.size + self.slots * _SLOT.size
+
+    def _offset(self, slot: int) -> int:
+        return _HEADER.size + slot * _SLOT.size
+
+    def _open(self) -> mmap.mmap:
+        # fcntl record locks belong to the process: reopen after a fork.
+        if self._map is None or self._pid != os.getpid():
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.lockf(fd, fcntl.LOCK_EX, _HEADER.size, 0)
+            try:
+                raw = os.pread(fd, _HEADER.size, 0)
+                if (os.fstat(fd).st_size != self._size or len(raw) != _HEADER.size
+                        or _HEADER.unpack(raw) != (_MAGIC, self.slots, _SLOT.size)):
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self._size)
+                    os.pwrite(fd, _HEADER.pack(_MAGIC, self.slots, _SLOT.size), 0)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, _HEADER.size, 0)
+            self._fd = fd
+            self._map = mmap.mmap(fd, self._size)
+            self._pid = os.getpid()
+        return self._map
+
+    def open(self) -> None:
+        """Create (or validate) and map the state file now rather than on the first request."""
+        with self._lock:
+            self._open()
+
+    def _try_lock(self, slot: int, backoff: Tuple[float, ...] = _LOCK_BACKOFF) -> bool:
+        """Lock a slot, never blocking: retry after each backoff delay; False if it stays locked."""
+        for delay in backoff:
+            if delay:
+                time.sleep(delay)
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, _SLOT.size, self._offset(slot))
+                return True
+            except OSError:  # EACCES or EAGAIN, depending on the platform
+                continue
+        return False
+
+    def _unlock(self, slot: int) -> None:
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, _SLOT.size, self._offset(slot))
+
+    def acquire(self, key_id: bytes, rate: float, burst: int, max_in_flight: int,
+                timeout: float = 0.0) -> "Lease | Rejection":
+        """Admit one request; raises _Busy if a slot it must read stays locked."""
+        timeout = timeout or LEASE_TIMEOUT
+        now = time.monotonic()
+        start = int.from_bytes(key_id[:8], "little") % self.slots
+        with self._lock:
+            view = self._open()
+            fallback = None
+            for probe in range(min(_PROBES, self.slots)):
+                slot = (start + probe) % self.slots
+                if not self._try_lock(slot):
+                    raise _Busy()
+                try:
+                    fields = list(_SLOT.unpack_from(view, self._offset(slot)))
+                    owner, leases = fields[0], fields[3:]
+                    idle = not any(expiry > now for expiry in leases)
+                    if owner == key_id or owner == bytes(16):
+                        return self._admit(view, slot, key_id, fields, now, rate, burst, max_in_flight, timeout)
+                finally:
+                    self._unlock(slot)
+                if idle and (fallback is None or fields[2] < fallback[1]):
+                    fallback = (slot, fields[2])
+            if fallback is None:
+                return Rejection("capacity", 1.0)
+            # Table crowded: take over the least recently refilled idle slot.
+            slot = fallback[0]
+            if not self._try_lock(slot):
+                raise _Busy()
+            try:
+                fields = [key_id, 0.0, 0.0] + [0.0] * MAX_LEASES
+                return self._admit(view, slot, key_id, fields, now, rate, burst, max_in_flight, timeout)
+            finally:
+                self._unlock(slot)
+
+    def _admit(self, view: mmap.mmap, slot: int, key_id: bytes, fields: list, now: float,
+               rate: float, burst: int, max_in_flight: int, timeout: float) -> "Lease | Rejection":
+        tokens, refilled = fields[1], fields[2]
+        if fields[0] != key_id or refilled <= 0.0 or refilled > now:
+            # New key, or state from before a reboot (monotonic clock restarted).
+            fields = [key_id, float(burst), now] + [0.0] * MAX_LEASES
+            tokens, refilled = fields[1], now
+        leases = fields[3:]
+        index = -1
+        if max_in_flight:
+            live = [i for i, expiry in enumerate(leases) if expiry > now]
+            if len(live) >= max_in_flight:
+                return Rejection("concurrency", 1.0)
+            index = next(i for i, expiry in enumerate(leases) if expiry <= now)
+        if rate:
+            tokens = min(float(burst), tokens + (now - refilled) * rate)
+            if tokens < 1.0:
+                return Rejection("rate", (1.0 - tokens) / rate)
+            tokens -= 1.0
+        expiry = now + timeout
+        if index >= 0:
+            leases[index] = expiry
+        _SLOT.pack_into(view, self._offset(slot), key_id, tokens, now, *leases)
+        return Lease(self, slot, key_id, index, expiry, timeout)
+
+    def renew(self, slot: int, key_id: bytes, index: int, expiry: float, new_expiry: float) -> bool:
+        """Move a live lease's expiry; False if the slot is busy or the lease is gone."""
+        offset = self._offset(slot) + struct.calcsize("<16sdd") + index * 8
+        with self._lock:
+            view = self._open()
+            if not self._try_lock(slot, backoff=(0.0,)):
+                return False
+            try:
+                if view[self._offset(slot):self._offset(slot) + 16] != key_id \
+                        or struct.unpack_from("<d", view, offset)[0] != expiry:
+                    return False
+                struct.pack_into("<d", view, offset, new_expiry)
+                return True
+            finally:
+                self._unlock(slot)
+
+    def release(self, slot: int, key_id: bytes, index: int, expiry: float) -> None:
+        if not self._try_release(slot, key_id, index, expiry):
+            with self._lock:
+                if self._releaser is None:
+                    self._releaser = ThreadPoolExecutor(max_workers=1, thread_name_prefix="admission")
+                releaser = self._releaser
+            releaser.submit(self._release_later, slot, key_id, index, expiry)
+
+    def _try_release(self, slot: int, key_id: bytes, index: int, expiry: float) -> bool:
+        offset = self._offset(slot) + struct.calcsize("<16sdd") + index * 8
+        with self._lock:
+            view = self._open()
+            if not self._try_lock(slot, backoff=(0.0,)):
+                return False
+            try:
+                if view[self._offset(slot):self._offset(slot) + 16] == key_id \
+                        and struct.unpack_from("<d", view, offset)[0] == expiry:
+                    struct.pack_into("<d", view, offset, 0.0)
+            finally:
+                self._unlock(slot)
+            return True
+
+    def _release_later(self, slot: int, key_id: bytes, index: int, expiry: float) -> None:
+        # Retry until the slot is free; the lease expires on its own if this never succeeds.
+        while time.monotonic() < expiry and not self._try_release(slot, key_id, index, expiry):
+            time.sleep(0.001)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._map is not None and self._pid == os.getpid():
+                self._map.close()
+                os.close(self._fd)
+            self._map = None
+            self._fd = None
+
+
+admission_table = AdmissionTable(
+    path=os.getenv("ADMISSION_STATE_PATH", os.path.join(tempfile.gettempdir(), "api_admission.state")),
+    slots=int(os.getenv("ADMISSION_SLOTS", "1024")),
+)
+
+
+def open_admission() -> None:
+    """Map the shared state file; call once per worker process at startup."""
+    admission_table.open()
+
+
+def lease_timeout(key: ApiKey) -> float:
+    """Seconds a lease lasts without renewal: LEASE_TIMEOUT, or the role's statement_timeout + 60 if longer."""
+    statement_timeout_ms = role_limits(key.role).statement_timeout_ms
+    return max(LEASE_TIMEOUT, statement_timeout_ms / 1000.0 + 60.0 if statement_timeout_ms else 0.0)
+
+
+def admit(key: ApiKey) -> "Lease | Rejection":
+    """Admit one request for `key`: a Lease to release when it finishes, or a Rejection."""
+    rate, burst, max_in_flight = effective_limits(key)
+    if not rate and not max_in_flight:
+        return _UNTRACKED
+    try:
+        return admission_table.acquire(key.digest[:16], rate, burst, max_in_flight, lease_timeout(key))
+    except _Busy:
+        # Fail open: a slot locked for over a millisecond is rare, and the
+        # client may well be within its limits.
+        metrics.ADMISSION_CONTENDED.inc(key.name)
+        return _UNTRACKED
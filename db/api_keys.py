@@ -0,0 +1,161 @@
+"""
+API key registry: many keys, each with an API role, optional schema scopes
+and optional admission limits.
+
+Keys are never stored in clear. The `api_keys` section of mcp_config.yaml
+lists the sha256 hex digest of each key; a presented key is hashed once and
+looked up in a dict keyed by digest (O(1) however many keys exist), then the
+digests are compared with hmac.compare_digest. Because only digests are
+compared, response timing reveals nothing about the keys themselves.
+
+    api_keys:
+      - name: reporting-agent
+        role: user                 # user | admin
+        sha256: 9f86d081...        # python -c "import hashlib,sys; print(hashlib.sha256(sys.argv[1].encode()).hexdigest())" KEY
+        schemas: [company]         # optional; must be a subset of the role's schemas
+        limits:                    # optional; enforced by admission control
+          rate_per_second: 5
+          burst: 10
+          max_in_flight: 4
+
+USER_API_KEY / ADMIN_API_KEY, when set, are registered too (as "env:user" /
+"env:admin", unscoped), so single-key deployments keep working unchanged.
+
+reload_api_keys() re-reads and validates the config file, then swaps in the
+new config and registry; a config that fails to load or validate leaves the
+current config and registry active.
+The API calls it on SIGHUP, so `kill -HUP <worker pids>` rotates keys without
+restarting gunicorn workers (SIGHUP to the gunicorn master also works, but
+restarts the workers).
+
+Config:
+  USER_API_KEY / ADMIN_API_KEY   legacy single keys (optional)
+  MCP_CONFIG_PATH                config file holding `api_keys` (see db/config.py)
+"""
+import hashlib
+import hmac
+import logging
+import os
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from db.catalog import ROLE_SCHEMAS
+from db.config import install_config, load_config, read_config, validate_config
+
+logger = logging.getLogger(__name__)
+
+
+class KeyLimits(NamedTuple):
+    rate_per_second: Optional[float] = None
+    burst: Optional[int] = None
+    max_in_flight: Optional[int] = None
+
+
+class ApiKey(NamedTuple):
+    name: str
+    role: str
+    digest: bytes
+    schemas: Optional[Tuple[str, ...]] = None   # None: everything the role may query
+    limits: KeyLimits = KeyLimits()
+
+
+def _digest(token: bytes) -> bytes:
+    return hashlib.sha256(token).digest()
+
+
+def _parse_limits(name: str, raw: Any) -> KeyLimits:
+    if raw is None:
+        return KeyLimits()
+    if not isinstance(raw, dict):
+        raise ValueError(f"mcp_config.yaml: api_keys[{name}].limits must be a mapping")
+    unknown = set(raw) - set(KeyLimits._fields)
+    if unknown:
+        raise ValueError(f"mcp_config.yaml: api_keys[{name}].limits has unknown entries: " + ", ".join(sorted(unknown)))
+    values = {}
+    for field, value in raw.items():
+        if value is None:
+            continue
+        numeric = (int, float) if field == "rate_per_second" else (int,)
+        if isinstance(value, bool) or not isinstance(value, numeric) or value <= 0:
+            raise ValueError(f"mcp_config.yaml: api_keys[{name}].limits.{field} must be a positive number")
+        values[field] = value
+    return KeyLimits(**values)
+
+
+def _parse_entry(entry: Any, index: int) -> ApiKey:
+    if not isinstance(entry, dict):
+        raise ValueError(f"mcp_config.yaml: api_keys[{index}] must be a mapping")
+    name = str(entry.get("name") or f"#{index}")
+    role = entry.get("role")
+    if role not in ROLE_SCHEMAS:
+        raise ValueError(f"mcp_config.yaml: api_keys[{name}].role must be one of: " + ", ".join(ROLE_SCHEMAS))
+    try:
+        digest = bytes.fromhex(str(entry.get("sha256", "")))
+    except ValueError:
+        digest = b""
+    if len(digest) != hashlib.sha256().digest_size:
+        raise ValueError(f"mcp_config.yaml: api_keys[{name}].sha256 must be a 64-character hex digest")
+    schemas = entry.get("schemas")
+    if schemas is not None:
+        if not isinstance(schemas, list) or not schemas or not set(schemas) <= set(ROLE_SCHEMAS[role]):
+            raise ValueError(
+                f"mcp_config.yaml: api_keys[{name}].schemas must be a non-empty subset of: "
+                + ", ".join(ROLE_SCHEMAS[role])
+            )
+        schemas = tuple(sorted(set(schemas)))
+    return ApiKey(name, role, digest, schemas, _parse_limits(name, entry.get("limits")))
+
+
+def _build_registry(config: Dict[str, Any]) -> Dict[bytes, ApiKey]:
+    registry: Dict[bytes, ApiKey] = {}
+    for role, env in (("user", "USER_API_KEY"), ("admin", "ADMIN_API_KEY")):
+        token = os.getenv(env)
+        if token:
+            digest = _digest(token.encode("utf-8"))
+            registry[digest] = ApiKey(f"env:{role}", role, digest)
+    for index, entry in enumerate(config.get("api_keys") or []):
+        key = _parse_entry(entry, index)
+        if key.digest in registry:
+            raise ValueError(f"mcp_config.yaml: api_keys[{key.name}] duplicates the key of {registry[key.digest].name}")
+        registry[key.digest] = key
+    return registry
+
+
+_registry: Optional[Dict[bytes, ApiKey]] = None
+
+
+def _current() -> Dict[bytes, ApiKey]:
+    global _registry
+    registry = _registry
+    if registry is None:
+        registry = _registry = _build_registry(load_config())
+    return registry
+
+
+def lookup(authorization: Optional[bytes]) -> Optional[ApiKey]:
+    """The key presented in an `Authorization: Bearer <key>` header value, or None."""
+    if not authorization or not authorization.startswith(b"Bearer "):
+        return None
+    digest = _digest(authorization[7:])
+    key = _current().get(digest)
+    if key is None or not hmac.compare_digest(key.digest, digest):
+        return None
+    return key
+
+
+def reload_api_keys() -> bool:
+    """
+    Re-read the config and swap in the new config and registry; returns False
+    on error, keeping the current config and keys active.
+    """
+    global _registry
+    try:
+        config = read_config()
+        validate_config(config)
+        registry = _build_registry(config)
+    except Exception:
+        logger.exception("Config reload failed; keeping the current config and keys")
+        return False
+    install_config(config)
+    _registry = registry
+    logger.info("Loaded %d API keys", len(registry))
+    return True
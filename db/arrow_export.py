@@ -0,0 +1,145 @@
+"""
+Apache Arrow IPC stream and Parquet encoders for streamed query results.
+
+Each server-side cursor batch becomes one Arrow record batch (one row group
+for Parquet), so memory stays bounded by the batch size and the client gets
+typed columnar buffers instead of per-row JSON objects. The schema comes from
+the cursor description (Postgres type OIDs) and the role's typecasting
+profile, so every batch has the same schema even when the first one is
+empty or all-NULL. Types without a natural Arrow counterpart (json, arrays,
+ranges, ...) travel as strings.
+
+pyarrow is listed in requirements.txt but imported optionally: without it
+ARROW_AVAILABLE is False and the API answers these formats with 501.
+"""
+from decimal import Decimal
+from typing import Any, Callable, List, Optional, Sequence
+
+from db.config import RoleTypecasts
+from db.encoding import dumps, json_default
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+    pq = None
+
+ARROW_AVAILABLE = pa is not None
+
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+_INT_TYPES = {20: "int64", 21: "int16", 23: "int32", 26: "int64"}  # int8, int2, int4, oid
+_FLOAT_TYPES = {700: "float32", 701: "float64"}
+_TEXT_OIDS = {18, 19, 25, 1042, 1043}  # char, name, text, bpchar, varchar
+_NUMERIC = 1700
+_TEMPORAL = {1082: "date", 1083: "time", 1114: "timestamp", 1184: "timestamptz", 1186: "interval"}
+
+
+def _as_text(value: Any) -> Any:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (list, dict, tuple)):
+        return dumps(value)
+    if isinstance(value, Decimal):
+        return str(value)  # exact, scale kept ("1234.50")
+    return str(json_default(value))
+
+
+def _as_bytes(value: Any) -> Any:
+    return None if value is None else bytes(value)
+
+
+def _column_type(type_code: int, profile: RoleTypecasts) -> "tuple[Any, Optional[Callable[[Any], Any]]]":
+    """(arrow type, per-value converter or None) for a Postgres result column."""
+    if type_code == 16:
+        return pa.bool_(), None
+    if type_code in _INT_TYPES:
+        return getattr(pa, _INT_TYPES[type_code])(), None
+    if type_code in _FLOAT_TYPES:
+        return getattr(pa, _FLOAT_TYPES[type_code])(), None
+    if type_code == _NUMERIC:
+        # Decimal scale varies per value, so only the float profile maps to a numeric Arrow type.
+        return (pa.float64(), None) if profile.numeric == "float" else (pa.string(), _as_text)
+    if type_code == 17:
+        return pa.binary(), _as_bytes
+    if type_code in _TEMPORAL and profile.temporal == "native":
+        kind = _TEMPORAL[type_code]
+        if kind == "date":
+            return pa.date32(), None
+        if kind == "time":
+            return pa.time64("us"), None
+        if kind == "timestamp":
+            return pa.timestamp("us"), None
+        if kind == "timestamptz":
+            return pa.timestamp("us", tz="UTC"), None
+        return pa.duration("us"), None
+    if type_code in _TEXT_OIDS:
+        return pa.string(), None
+    return pa.string(), _as_text
+
+
+class _Sink:
+    """Write-only file object that collects what pyarrow writes, drained after every batch."""
+
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+        self.closed = False
+
+    def write(self, data: Any) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+class ArrowEncoder:
+    """
+    Incremental encoder: encode(batch) -> bytes for each row-tuple batch, then
+    finish() -> the trailing bytes (end-of-stream marker / Parquet footer).
+    """
+
+    def __init__(self, fmt: str, columns: Sequence[str], type_codes: Sequence[int], profile: RoleTypecasts):
+        if not ARROW_AVAILABLE:
+            raise RuntimeError("pyarrow is not installed")
+        if fmt not in MEDIA_TYPES:
+            raise ValueError(f"Unknown columnar format: {fmt!r}")
+        typed = [_column_type(code, profile) for code in type_codes]
+        self.schema = pa.schema([pa.field(name, arrow_type) for name, (arrow_type, _) in zip(columns, typed)])
+        self._converters = [convert for _, convert in typed]
+        self._sink = _Sink()
+        if fmt == "arrow":
+            self._writer = pa.ipc.new_stream(self._sink, self.schema)
+        else:
+            self._writer = pq.ParquetWriter(self._sink, self.schema, compression="zstd")
+        self._fmt = fmt
+
+    def encode(self, batch: Sequence[Sequence[Any]]) -> bytes:
+        if batch:
+            arrays = []
+            for values, field, convert in zip(zip(*batch), self.schema, self._converters):
+                if convert is not None:
+                    values = [convert(v) for v in values]
+                arrays.append(pa.array(values, type=field.type))
+            record_batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+            if self._fmt == "arrow":
+                self._writer.write_batch(record_batch)
+            else:
+                self._writer.write_table(pa.Table.from_batches([record_batch]))
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
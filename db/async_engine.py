@@ -0,0 +1,121 @@
+"""
+Async execution engine for the blocking psycopg2 query helpers.
+
+The FastAPI handlers are `async def`, so calling psycopg2 directly would freeze
+the worker's event loop for the whole duration of a query. Instead, blocking DB
+work is handed to a bounded thread pool and awaited; the loop stays free to
+accept and progress other requests while queries are in flight.
+
+Config:
+  DB_ASYNC_WORKERS  max concurrent blocking DB calls per process (default 20)
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the process-wide DB executor, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(os.getenv("DB_ASYNC_WORKERS", "20"))
+            _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="db-worker")
+        return _executor
+
+
+async def run_sync(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking callable on the DB executor and await its result."""
+    loop = asyncio.get_running_loop()
+    # Carry contextvars (request-scoped state) over to the worker thread.
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, fn, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
+
+
+def shutdown_executor(wait: bool = True) -> None:
+    """Stop the DB executor (e.g. on application shutdown)."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+class ConsumerGone(Exception):
+    """Raised inside a producer thread when the async consumer stopped reading."""
+
+
+class _End:
+    __slots__ = ("error",)
+
+    def __init__(self, error: Optional[BaseException]):
+        self.error = error
+
+
+async def iterate_in_thread(produce: Callable[[Callable[[Any], None]], None], maxsize: int = 8) -> AsyncIterator[Any]:
+    """
+    Run the blocking `produce(emit)` on a dedicated thread and yield what it emits.
+
+    emit() blocks while `maxsize` items are waiting, so a slow consumer slows the
+    producer down instead of letting items pile up in memory. An exception raised
+    by produce is re-raised here. If the consumer stops early (client disconnect),
+    the producer's next emit() raises ConsumerGone so it can unwind.
+
+    A dedicated thread (not the DB executor) is used because the producer may
+    block for as long as the consumer takes; holding executor threads for that
+    long could starve the consumers that need them.
+    """
+    loop = asyncio.get_running_loop()
+    queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize)
+    stopped = threading.Event()
+
+    def emit(item: Any) -> None:
+        if stopped.is_set():
+            raise ConsumerGone()
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                future.result(timeout=0.25)
+                return
+            except concurrent.futures.TimeoutError:
+                if stopped.is_set():
+                    future.cancel()
+                    raise ConsumerGone()
+
+    def run() -> None:
+        try:
+            produce(emit)
+            end = _End(None)
+        except ConsumerGone:
+            return
+        except BaseException as e:
+            end = _End(e)
+        try:
+            emit(end)
+        except (ConsumerGone, RuntimeError):
+            # Consumer gone or event loop closed: nobody is left to tell.
+            pass
+
+    ctx = contextvars.copy_context()
+    threading.Thread(target=ctx.run, args=(run,), name="db-producer", daemon=True).start()
+    try:
+        while True:
+            item = await queue.get()
+            if isinstance(item, _End):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+    finally:
+        stopped.set()
@@ -0,0 +1,148 @@
+"""
+In-process catalog of the schemas the API exposes.
+
+Holds tables, columns (name + type) and planner row estimates for the
+'company' and 'finance' schemas, per pool role, so error suggestions and
+other metadata lookups never need an information_schema scan on the hot path.
+
+The catalog loads lazily on first use, then a daemon thread refreshes it every
+SCHEMA_CATALOG_REFRESH_SECONDS (default 300; 0 disables background refresh).
+If a refresh fails the previous snapshot is kept.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from db.connection import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Which schemas each API role can see.
+ROLE_SCHEMAS: Dict[str, Tuple[str, ...]] = {
+    "user": ("company",),
+    "admin": ("company", "finance"),
+}
+
+_CATALOG_QUERY = """
+    SELECT n.nspname,
+           cl.relname,
+           GREATEST(cl.reltuples, 0)::bigint,
+           a.attname,
+           format_type(a.atttypid, a.atttypmod)
+    FROM pg_catalog.pg_class cl
+    JOIN pg_catalog.pg_namespace n ON n.oid = cl.relnamespace
+    LEFT JOIN pg_catalog.pg_attribute a
+           ON a.attrelid = cl.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE n.nspname = ANY(%s)
+      AND cl.relkind IN ('r', 'v', 'm', 'p', 'f')
+      AND has_table_privilege(cl.oid, 'SELECT')
+    ORDER BY n.nspname, cl.relname, a.attnum;
+"""
+
+Snapshot = Dict[str, Dict[str, Dict[str, Any]]]
+
+
+class SchemaCatalog:
+    """
+    Cached view of tables/columns for a set of schemas, as seen by one pool role.
+
+    snapshot() shape: {schema: {table: {"columns": [{"name", "type"}], "row_estimate": int}}}
+    """
+
+    def __init__(self, role: str, schemas: Sequence[str], refresh_interval: float = 300.0):
+        self.role = role
+        self.schemas = tuple(schemas)
+        self.refresh_interval = refresh_interval
+        self.loaded_at: Optional[float] = None
+        self._snapshot: Snapshot = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _load(self) -> Snapshot:
+        snapshot: Snapshot = {s: {} for s in self.schemas}
+        with get_connection(self.role) as conn:
+            with conn.cursor() as cur:
+                cur.execute(_CATALOG_QUERY, (list(self.schemas),))
+                for schema, table, estimate, column, col_type in cur.fetchall():
+                    entry = snapshot[schema].setdefault(table, {"columns": [], "row_estimate": estimate})
+                    if column is not None:
+                        entry["columns"].append({"name": column, "type": col_type})
+        return snapshot
+
+    def refresh(self) -> None:
+        """Reload from the database and swap the snapshot in atomically."""
+        snapshot = self._load()
+        with self._lock:
+            self._snapshot = snapshot
+            self.loaded_at = time.time()
+
+    def snapshot(self) -> Snapshot:
+        """Current snapshot, loading it on first access."""
+        if self.loaded_at is None:
+            with self._load_lock:
+                if self.loaded_at is None:
+                    self.refresh()
+                    self.start_background_refresh()
+        return self._snapshot
+
+    def tables(self, schema: str) -> List[str]:
+        """Sorted table names in `schema` (empty if the schema is not cataloged)."""
+        return sorted(self.snapshot().get(schema, {}))
+
+    def table(self, schema: str, table: str) -> Optional[Dict[str, Any]]:
+        """Columns and row estimate for one table, or None if unknown."""
+        return self.snapshot().get(schema, {}).get(table)
+
+    def start_background_refresh(self) -> None:
+        if self.refresh_interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._refresh_loop, name=f"catalog-refresh-{self.role}", daemon=True
+            )
+            self._thread.start()
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Schema catalog refresh failed for role %s; keeping previous snapshot", self.role)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+_catalogs: Dict[str, SchemaCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(role: str) -> SchemaCatalog:
+    """Process-wide catalog for an API role ("user" or "admin")."""
+    with _catalogs_lock:
+        catalog = _catalogs.get(role)
+        if catalog is None:
+            if role not in ROLE_SCHEMAS:
+                raise ValueError(f"Unknown role: {role!r}")
+            catalog = SchemaCatalog(
+                role,
+                ROLE_SCHEMAS[role],
+                refresh_interval=float(os.getenv("SCHEMA_CATALOG_REFRESH_SECONDS", "300")),
+            )
+            _catalogs[role] = catalog
+        return catalog
+
+
+def stop_catalogs() -> None:
+    """Stop background refresh threads (e.g. on application shutdown)."""
+    with _catalogs_lock:
+        catalogs = list(_catalogs.values())
+    for catalog in catalogs:
+        catalog.stop()
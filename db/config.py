@@ -0,0 +1,120 @@
+"""
+Loader for mcp_config.yaml, the connector's declarative config.
+
+Only the parts the API needs at runtime are exposed: the per-role resource
+limits under `permissions[].limits` and result typecasting profiles under
+`permissions[].typecasts`. API roles map onto config roles as
+user -> company_user and admin -> admin_user.
+
+Config:
+  MCP_CONFIG_PATH  path to the YAML file (default: mcp_config.yaml at the repo root)
+"""
+import os
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional
+
+import yaml
+
+API_ROLE_TO_CONFIG_ROLE = {
+    "user": "company_user",
+    "admin": "admin_user",
+}
+
+_DEFAULT_PATH = Path(__file__).resolve().parent.parent / "mcp_config.yaml"
+
+
+class RoleLimits(NamedTuple):
+    max_rows: Optional[int] = None
+    max_response_bytes: Optional[int] = None
+    statement_timeout_ms: Optional[int] = None
+    idle_in_transaction_session_timeout_ms: Optional[int] = None
+
+
+class RoleTypecasts(NamedTuple):
+    numeric: str = "decimal"   # decimal | float | text
+    temporal: str = "native"   # native | text
+    uuid: str = "text"         # text | native
+
+
+_TYPECAST_CHOICES = {
+    "numeric": ("decimal", "float", "text"),
+    "temporal": ("native", "text"),
+    "uuid": ("text", "native"),
+}
+
+
+def config_path() -> Path:
+    return Path(os.getenv("MCP_CONFIG_PATH", str(_DEFAULT_PATH)))
+
+
+def read_config() -> Dict[str, Any]:
+    """Parse the config file (uncached); a missing file means an empty config."""
+    path = config_path()
+    if not path.exists():
+        return {}
+    with path.open("r", encoding="utf-8") as fh:
+        config = yaml.safe_load(fh) or {}
+    if not isinstance(config, dict):
+        raise ValueError("mcp_config.yaml must be a mapping")
+    return config
+
+
+_config: Optional[Dict[str, Any]] = None
+
+
+def load_config() -> Dict[str, Any]:
+    """The active config, parsed once per process (see install_config)."""
+    global _config
+    config = _config
+    if config is None:
+        config = _config = read_config()
+    return config
+
+
+def validate_config(config: Dict[str, Any]) -> None:
+    """Raise ValueError if `config` has invalid limits or typecasts for any API role."""
+    for role in API_ROLE_TO_CONFIG_ROLE:
+        role_limits(role, config)
+        role_typecasts(role, config)
+
+
+def install_config(config: Dict[str, Any]) -> None:
+    """Make an already validated config the active one."""
+    global _config
+    _config = config
+
+
+def _permission(role: str, config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    config_role = API_ROLE_TO_CONFIG_ROLE.get(role, role)
+    for entry in (load_config() if config is None else config).get("permissions") or []:
+        if entry.get("role") == config_role:
+            return entry
+    return {}
+
+
+def _positive_int(value: Any, name: str) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise ValueError(f"mcp_config.yaml: limits.{name} must be a positive integer")
+    return value
+
+
+def role_limits(role: str, config: Optional[Dict[str, Any]] = None) -> RoleLimits:
+    """Resource limits for an API role ("user"/"admin"); unset limits are None."""
+    limits = _permission(role, config).get("limits") or {}
+    return RoleLimits(**{name: _positive_int(limits.get(name), name) for name in RoleLimits._fields})
+
+
+def role_typecasts(role: str, config: Optional[Dict[str, Any]] = None) -> RoleTypecasts:
+    """How result values are converted for an API role; unset entries keep psycopg2's defaults."""
+    casts = _permission(role, config).get("typecasts") or {}
+    values = {}
+    for name, choices in _TYPECAST_CHOICES.items():
+        value = casts.get(name)
+        if value is None:
+            continue
+        if value not in choices:
+            raise ValueError(f"mcp_config.yaml: typecasts.{name} must be one of: " + ", ".join(choices))
+        values[name] = value
+    return RoleTypecasts(**values)
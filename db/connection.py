@@ -1,26 +1,40 @@
 import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Optional
 import psycopg2
+from psycopg2 import extensions
 from urllib.parse import quote_plus
 
+
+class PoolTimeout(RuntimeError):
+    """Raised when no pooled connection became available within the checkout timeout."""
+
+
 def _build_dsn(host: str, port: str, dbname: str, user: str, password: str, sslmode: str) -> str:
     """Build a safe libpq DSN from parts (URL‑quote user/password)."""
     user_q = quote_plus(user) if user is not None else ""
     pw_q = quote_plus(password) if password is not None else ""
     return f"postgresql://{user_q}:{pw_q}@{host}:{port}/{dbname}?sslmode={sslmode}"
 
-def get_connection():
-    """
-    Connect using SUPABASE_DB_* environment variables only.
 
-    Required env vars:
-      SUPABASE_DB_HOST
-      SUPABASE_DB_NAME
-      SUPABASE_DB_USER
-      SUPABASE_DB_PASSWORD
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
 
-    Optional:
-      SUPABASE_DB_PORT (defaults to 5432)
-      SUPABASE_SSLMODE (defaults to 'require')
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _dsn_for_role(role: Optional[str] = None) -> str:
+    """
+    Resolve the DSN for a pool role from SUPABASE_DB_* environment variables.
+
+    A role may override the credentials with SUPABASE_<ROLE>_DB_USER and
+    SUPABASE_<ROLE>_DB_PASSWORD; everything else is shared.
     """
     host = os.getenv("SUPABASE_DB_HOST")
     port = os.getenv("SUPABASE_DB_PORT", "5432")
@@ -29,6 +43,11 @@ def get_connection():
     password = os.getenv("SUPABASE_DB_PASSWORD")
     sslmode = os.getenv("SUPABASE_SSLMODE", "require")
 
+    if role:
+        prefix = f"SUPABASE_{role.upper()}_DB_"
+        user = os.getenv(prefix + "USER", user)
+        password = os.getenv(prefix + "PASSWORD", password)
+
     missing = [k for k, v in (
         ("SUPABASE_DB_HOST", host),
         ("SUPABASE_DB_NAME", dbname),
@@ -41,6 +60,413 @@ def get_connection():
             ". Set SUPABASE_DB_* config vars."
         )
 
-    dsn = _build_dsn(host, port, dbname, user, password, sslmode)
-    # psycopg2 accepts the DSN string; it will honor sslmode in the query string.
-    return psycopg2.connect(dsn)
+    return _build_dsn(host, port, dbname, user, password, sslmode)
+
+
+class _Slot:
+    """Bookkeeping for one physical connection owned by a pool."""
+    __slots__ = ("raw", "created_at", "last_used", "prepared")
+
+    def __init__(self, raw: Any):
+        now = time.monotonic()
+        self.raw = raw
+        self.created_at = now
+        self.last_used = now
+        # SQL text -> server-side prepared statement name (see db.prepared);
+        # lives and dies with the physical connection.
+        self.prepared: "OrderedDict[str, Optional[str]]" = OrderedDict()
+
+
+class PooledConnection:
+    """
+    Proxy around a psycopg2 connection checked out of a ConnectionPool.
+
+    Behaves like the underlying connection (cursor(), commit(), ...), but close()
+    hands it back to the pool instead of closing the socket. Used as a context
+    manager it keeps psycopg2's commit/rollback semantics and then returns itself
+    to the pool.
+    """
+    __slots__ = ("_pool", "_slot", "_discard")
+
+    def __init__(self, pool: "ConnectionPool", slot: _Slot):
+        self._pool = pool
+        self._slot = slot
+        self._discard = False
+
+    @property
+    def raw(self) -> Any:
+        """The underlying psycopg2 connection (for APIs that need the real object)."""
+        if self._slot is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return self._slot.raw
+
+    @property
+    def prepared(self) -> "OrderedDict[str, Optional[str]]":
+        """Per-connection prepared-statement LRU, owned by db.prepared."""
+        if self._slot is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return self._slot.prepared
+
+    @property
+    def closed(self) -> int:
+        return 1 if self._slot is None else self._slot.raw.closed
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.raw, name)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if self._slot is not None and not self._slot.raw.closed:
+                if exc_type is None:
+                    self._slot.raw.commit()
+                else:
+                    self._slot.raw.rollback()
+        finally:
+            self.close()
+
+    def discard(self) -> None:
+        """Mark the connection as unusable so close() drops it instead of reusing it."""
+        self._discard = True
+
+    def close(self) -> None:
+        slot, self._slot = self._slot, None
+        if slot is not None:
+            self._pool._release(slot, discard=self._discard)
+
+    def __del__(self):
+        # Safety net for callers that forget to close: never leak a pool slot.
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of psycopg2 connections for a single DSN.
+
+    - at most max_size physical connections exist at once; callers beyond that
+      wait up to `timeout` seconds and then get PoolTimeout
+    - idle connections older than idle_timeout are closed (down to min_size)
+    - connections older than max_lifetime are recycled on checkout/return
+    - on checkout, a connection idle for longer than ping_after is pinged with
+      SELECT 1 and transparently replaced if it is dead
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 1,
+        max_size: int = 10,
+        idle_timeout: float = 300.0,
+        max_lifetime: float = 3600.0,
+        timeout: float = 30.0,
+        ping_after: float = 30.0,
+        name: str = "default",
+        configure: Optional[Callable[[Any], None]] = None,
+        connect_timeout: Optional[int] = None,
+    ):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1.")
+        if min_size < 0 or min_size > max_size:
+            raise ValueError("min_size must be between 0 and max_size.")
+        self.dsn = dsn
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.configure = configure
+        self.connect_timeout = connect_timeout
+
+        self._idle: Deque[_Slot] = deque()
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        for _ in range(min_size):
+            slot = self._connect()
+            with self._cond:
+                self._size += 1
+                self._idle.append(slot)
+
+    def _connect(self) -> _Slot:
+        # psycopg2 accepts the DSN string; it will honor sslmode in the query string.
+        if self.connect_timeout:
+            raw = psycopg2.connect(self.dsn, connect_timeout=self.connect_timeout)
+        else:
+            raw = psycopg2.connect(self.dsn)
+        if self.configure is not None:
+            try:
+                self.configure(raw)
+            except Exception:
+                raw.close()
+                raise
+        return _Slot(raw)
+
+    @staticmethod
+    def _close_raw(slot: _Slot) -> None:
+        try:
+            slot.raw.close()
+        except Exception:
+            pass
+
+    def _expired(self, slot: _Slot, now: float) -> bool:
+        return self.max_lifetime > 0 and now - slot.created_at > self.max_lifetime
+
+    def _alive(self, slot: _Slot, now: float) -> bool:
+        raw = slot.raw
+        if raw.closed:
+            return False
+        if raw.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if now - slot.last_used < self.ping_after:
+            return True
+        try:
+            with raw.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            raw.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _sweep_idle(self, now: float) -> list:
+        """Pop idle slots past idle_timeout/max_lifetime. Caller holds the lock."""
+        stale = []
+        keep: Deque[_Slot] = deque()
+        while self._idle:
+            slot = self._idle.popleft()
+            idle_too_long = self.idle_timeout > 0 and now - slot.last_used > self.idle_timeout
+            if self._expired(slot, now) or (idle_too_long and self._size - len(stale) > self.min_size):
+                stale.append(slot)
+            else:
+                keep.append(slot)
+        self._idle = keep
+        self._size -= len(stale)
+        return stale
+
+    def getconn(self, timeout: Optional[float] = None) -> PooledConnection:
+        """Check out a live connection, opening a new one if below max_size."""
+        wait = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + wait
+        while True:
+            slot = None
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise psycopg2.InterfaceError(f"connection pool '{self.name}' is closed")
+                stale = self._sweep_idle(time.monotonic())
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            f"Timed out after {wait:.1f}s waiting for a '{self.name}' DB connection "
+                            f"(max_size={self.max_size})."
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                    if self._closed:
+                        raise psycopg2.InterfaceError(f"connection pool '{self.name}' is closed")
+                if self._idle:
+                    slot = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+            for s in stale:
+                self._close_raw(s)
+
+            if create:
+                try:
+                    slot = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                return PooledConnection(self, slot)
+
+            if self._alive(slot, time.monotonic()):
+                slot.last_used = time.monotonic()
+                return PooledConnection(self, slot)
+            # Dead or dirty connection: drop it and try again.
+            self._drop(slot)
+
+    def _drop(self, slot: _Slot) -> None:
+        self._close_raw(slot)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _release(self, slot: _Slot, discard: bool = False) -> None:
+        raw = slot.raw
+        now = time.monotonic()
+        if not discard and not raw.closed:
+            try:
+                if raw.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    raw.rollback()
+            except Exception:
+                discard = True
+        if discard or raw.closed or self._closed or self._expired(slot, now):
+            self._drop(slot)
+            return
+        slot.last_used = now
+        with self._cond:
+            self._idle.append(slot)
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of pool occupancy (size, idle, in_use, waiting, max_size)."""
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                "waiting": self._waiting,
+                "max_size": self.max_size,
+            }
+
+    def close(self) -> None:
+        """Close idle connections and refuse new checkouts; in-use ones close on return."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for slot in idle:
+            self._close_raw(slot)
+
+
+def _session_setup(role: Optional[str]) -> Optional[Callable[[Any], None]]:
+    """
+    Per-connection setup for a role, from mcp_config.yaml: session settings from
+    `limits` and result typecasters from `typecasts` (see db.typecasts).
+    """
+    if not role:
+        return None
+    from db.config import role_limits, role_typecasts
+    from db.typecasts import typecast_setup
+
+    limits = role_limits(role)
+    settings = [
+        ("statement_timeout", limits.statement_timeout_ms),
+        ("idle_in_transaction_session_timeout", limits.idle_in_transaction_session_timeout_ms),
+    ]
+    settings = [(name, value) for name, value in settings if value is not None]
+    register_typecasts = typecast_setup(role_typecasts(role))
+    if not settings and register_typecasts is None:
+        return None
+
+    def configure(raw: Any) -> None:
+        if register_typecasts is not None:
+            register_typecasts(raw)
+        if settings:
+            with raw.cursor() as cur:
+                for name, value in settings:
+                    # Names come from the fixed list above; values are validated ints.
+                    cur.execute(f"SET {name} = %s", (value,))
+            raw.commit()
+
+    return configure
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def get_pool(role: Optional[str] = None) -> ConnectionPool:
+    """
+    Return the process-wide pool for `role`, creating it on first use.
+
+    Pool sizing comes from environment variables:
+      DB_POOL_MIN_SIZE      (default 1)
+      DB_POOL_MAX_SIZE      (default 10)
+      DB_POOL_IDLE_TIMEOUT  seconds an idle connection is kept (default 300)
+      DB_POOL_MAX_LIFETIME  seconds before a connection is recycled (default 3600)
+      DB_POOL_TIMEOUT       seconds to wait for a free connection (default 30)
+      DB_POOL_PING_AFTER    idle seconds after which checkout pings first (default 30)
+      DB_CONNECT_TIMEOUT    seconds libpq waits to establish a connection (default 10; 0: no limit)
+
+    The pool (and its min_size connections) is built outside the registry
+    lock, so a slow or unreachable database never blocks pool_stats() or
+    other roles; if two callers race, the first pool registered wins.
+    """
+    global _pools_pid
+    key = role or "default"
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Forked (e.g. gunicorn worker): never share sockets with the parent.
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+    if pool is not None:
+        return pool
+    pool = ConnectionPool(
+        _dsn_for_role(role),
+        min_size=_env_int("DB_POOL_MIN_SIZE", 1),
+        max_size=_env_int("DB_POOL_MAX_SIZE", 10),
+        idle_timeout=_env_float("DB_POOL_IDLE_TIMEOUT", 300.0),
+        max_lifetime=_env_float("DB_POOL_MAX_LIFETIME", 3600.0),
+        timeout=_env_float("DB_POOL_TIMEOUT", 30.0),
+        ping_after=_env_float("DB_POOL_PING_AFTER", 30.0),
+        name=key,
+        configure=_session_setup(role),
+        connect_timeout=_env_int("DB_CONNECT_TIMEOUT", 10),
+    )
+    with _pools_lock:
+        winner = _pools.setdefault(key, pool)
+    if winner is not pool:
+        pool.close()
+    return winner
+
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Occupancy of every pool created in this process, keyed by role. Reads a
+    snapshot of the registry without its lock (called on the event loop).
+    """
+    pools = list(_pools.items())
+    return {name: pool.stats() for name, pool in pools}
+
+
+def close_pools() -> None:
+    """Close every pool in this process (e.g. on application shutdown)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def get_connection(role: Optional[str] = None) -> PooledConnection:
+    """
+    Check out a pooled connection using SUPABASE_DB_* environment variables.
+
+    Required env vars:
+      SUPABASE_DB_HOST
+      SUPABASE_DB_NAME
+      SUPABASE_DB_USER
+      SUPABASE_DB_PASSWORD
+
+    Optional:
+      SUPABASE_DB_PORT (defaults to 5432)
+      SUPABASE_SSLMODE (defaults to 'require')
+      SUPABASE_<ROLE>_DB_USER / SUPABASE_<ROLE>_DB_PASSWORD (per-role credentials)
+
+    The returned connection goes back to the pool on close() or when a
+    `with get_connection() as conn:` block exits (after commit/rollback).
+    """
+    return get_pool(role).getconn()
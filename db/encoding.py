@@ -0,0 +1,89 @@
+"""
+JSON encoding helpers for query results.
+
+psycopg2 hands back Decimal, datetime, UUID, memoryview, ... which the stdlib
+json module cannot serialize on its own; json_default maps them to the same
+representations FastAPI's jsonable_encoder would produce.
+
+encode() turns a whole response body (row tuples and lists included) into
+bytes in one pass. It uses orjson when it is installed (an optional
+dependency, several times faster on wide results) and the stdlib C encoder
+otherwise; both produce the same JSON for the types psycopg2 returns.
+"""
+import datetime
+import decimal
+import json
+import uuid
+from typing import Any, Iterable, Sequence
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+def json_default(value: Any) -> Any:
+    """`default=` hook for json.dumps covering the types psycopg2 returns."""
+    if isinstance(value, decimal.Decimal):
+        # As FastAPI's decimal_encoder: integral values (sum(bigint), numeric(p,0)) stay exact ints.
+        exponent = value.as_tuple().exponent
+        if isinstance(exponent, int) and exponent >= 0:
+            return int(value)
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, memoryview):
+        value = value.tobytes()
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).decode("utf-8", errors="replace")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def dumps(value: Any) -> str:
+    """Compact json.dumps with the psycopg2-aware default."""
+    return json.dumps(value, default=json_default, separators=(",", ":"), ensure_ascii=False)
+
+
+if orjson is not None:
+    def encode(value: Any) -> bytes:
+        """Compact UTF-8 JSON bytes for a response body."""
+        try:
+            return orjson.dumps(value, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            # orjson rejects integers beyond 64 bits (e.g. numeric(30,0) values).
+            return dumps(value).encode("utf-8")
+else:
+    def encode(value: Any) -> bytes:
+        """Compact UTF-8 JSON bytes for a response body."""
+        return dumps(value).encode("utf-8")
+
+
+def ndjson_lines(columns: Sequence[str], batch: Iterable[Sequence[Any]]) -> bytes:
+    """Encode a batch of row tuples as newline-delimited JSON objects."""
+    body = b"\n".join([encode(dict(zip(columns, row))) for row in batch])
+    return body + b"\n" if body else b""
+
+
+def json_array_items(columns: Sequence[str], batch: Iterable[Sequence[Any]], first: bool) -> bytes:
+    """
+    Encode a batch of row tuples as comma-separated JSON objects, for splicing
+    into a JSON array that is being written out incrementally.
+    """
+    body = b",".join([encode(dict(zip(columns, row))) for row in batch])
+    if not body:
+        return b""
+    return body if first else b"," + body
+
+
+def json_array_rows(batch: Iterable[Sequence[Any]], first: bool) -> bytes:
+    """Like json_array_items, but each row is a JSON array (columnar format)."""
+    body = b",".join([encode(row) for row in batch])
+    if not body:
+        return b""
+    return body if first else b"," + body
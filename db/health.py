@@ -0,0 +1,152 @@
+"""
+Background DB health prober behind /health and /ready.
+
+A daemon thread checks the database every HEALTH_PROBE_INTERVAL seconds: it
+checks out a connection from the probed role's pool (the same pool requests
+use, waiting at most HEALTH_PROBE_TIMEOUT), times a `SELECT 1` round trip,
+and records pool saturation for every pool in the process. Handlers only
+read the cached result, so a load balancer probing several times a second
+costs no connections and no blocking work.
+
+Readiness fails when the last probe failed, when the cached state is older
+than three probe intervals (prober stuck), or when any pool is more than
+HEALTH_READY_MAX_SATURATION busy (in use + waiting over max size).
+
+Config:
+  HEALTH_PROBE_INTERVAL         seconds between probes (default 5)
+  HEALTH_PROBE_TIMEOUT          seconds to wait for a pooled connection (default 2)
+  HEALTH_PROBE_ROLE             pool role to probe (default user)
+  HEALTH_READY_MAX_SATURATION   pool busy fraction above which /ready fails (default 0.9)
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from db.connection import PoolTimeout, get_pool, pool_stats
+
+logger = logging.getLogger(__name__)
+
+
+class HealthProber:
+    def __init__(self, role: str, interval: float, timeout: float, max_saturation: float):
+        self.role = role
+        self.interval = interval
+        self.timeout = timeout
+        self.max_saturation = max_saturation
+        self._state: Dict[str, Any] = {"reachable": False, "checked_at": None, "error": "not probed yet"}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def probe(self) -> Dict[str, Any]:
+        """Run one probe now and publish its result."""
+        state: Dict[str, Any] = {"reachable": False, "latency_ms": None, "error": None}
+        start = time.perf_counter()
+        try:
+            conn = get_pool(self.role).getconn(timeout=self.timeout)
+            try:
+                checked_out = time.perf_counter()
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                    cur.fetchone()
+                state["latency_ms"] = round((time.perf_counter() - checked_out) * 1000.0, 3)
+                conn.rollback()
+            except Exception:
+                conn.discard()
+                raise
+            finally:
+                conn.close()
+            state["reachable"] = True
+            state["checkout_ms"] = round((checked_out - start) * 1000.0, 3)
+        except PoolTimeout:
+            # The database may be fine; every connection is busy.
+            state["pool_exhausted"] = True
+            state["error"] = "no pooled connection available within %.1fs" % self.timeout
+        except Exception as e:
+            # Short first line only: never leak DSNs or credentials.
+            state["error"] = str(e).splitlines()[0][:200] if str(e) else type(e).__name__
+
+        pools: Dict[str, Dict[str, Any]] = {}
+        saturation = 0.0
+        for name, stats in pool_stats().items():
+            busy = (stats["in_use"] + stats["waiting"]) / stats["max_size"] if stats["max_size"] else 0.0
+            saturation = max(saturation, busy)
+            pools[name or "default"] = dict(stats, saturation=round(busy, 3))
+        state.update(pools=pools, saturation=round(saturation, 3), checked_at=time.time())
+        with self._lock:
+            previous = self._state
+            state["consecutive_failures"] = 0 if state["reachable"] else previous.get("consecutive_failures", 0) + 1
+            self._state = state
+        if not state["reachable"] and previous.get("reachable", True):
+            logger.warning("Database health probe failed: %s", state["error"])
+        return state
+
+    def state(self) -> Dict[str, Any]:
+        """The last published probe result (a shared dict: do not mutate)."""
+        return self._state
+
+    def readiness(self) -> Tuple[bool, str]:
+        state = self._state
+        checked_at = state.get("checked_at")
+        if checked_at is None:
+            return False, "not probed yet"
+        if time.time() - checked_at > 3 * self.interval:
+            return False, "health state is stale"
+        if state.get("pool_exhausted") or state["saturation"] > self.max_saturation:
+            return False, "connection pool saturated"
+        if not state["reachable"]:
+            return False, "database unreachable"
+        return True, "ok"
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="health-prober", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.probe()
+            except Exception:
+                logger.exception("Health probe crashed")
+            if self._stop.wait(self.interval):
+                return
+
+    def alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+_prober: Optional[HealthProber] = None
+_prober_lock = threading.Lock()
+
+
+def get_prober() -> HealthProber:
+    """Process-wide prober (started on first use)."""
+    global _prober
+    with _prober_lock:
+        if _prober is None:
+            _prober = HealthProber(
+                role=os.getenv("HEALTH_PROBE_ROLE", "user"),
+                interval=float(os.getenv("HEALTH_PROBE_INTERVAL", "5")),
+                timeout=float(os.getenv("HEALTH_PROBE_TIMEOUT", "2")),
+                max_saturation=float(os.getenv("HEALTH_READY_MAX_SATURATION", "0.9")),
+            )
+        prober = _prober
+    prober.start()
+    return prober
+
+
+def stop_prober() -> None:
+    """Stop the probe thread (e.g. on application shutdown)."""
+    with _prober_lock:
+        prober = _prober
+    if prober is not None:
+        prober.stop()
@@ -0,0 +1,229 @@
+"""
+Minimal Prometheus-style metrics (text exposition format 0.0.4).
+
+Counters and histograms are plain dicts keyed by label values and guarded by
+one lock each; an observation is a bisect plus two additions, cheap enough
+to leave on in production. Gauges are computed at scrape time from
+callbacks (pool occupancy, cache stats), so they cost nothing per request.
+
+Metrics are per process: under gunicorn each worker exposes its own numbers
+(a `pid` label is attached by render()), so scrape every worker or aggregate
+by summing over pid.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        with self._lock:
+            return self._values.get(labelvalues, 0.0)
+
+    def render(self, pid: str) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for values, v in items:
+            yield f"{self.name}{_labels(self.labelnames, values, pid)} {v}"
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0.0] * (len(self.buckets) + 2)
+            series[idx] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def render(self, pid: str) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for values, series in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s",%s' % (bound, pid)
+                yield f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}"
+            cumulative += series[len(self.buckets)]
+            le = 'le="+Inf",%s' % pid
+            yield f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, values, pid)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labelnames, values, pid)} {cumulative}"
+
+
+class Gauge:
+    """Gauge whose samples are produced by a callback at scrape time."""
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str], collect: Callable[[], Iterable[Tuple[LabelValues, float]]]):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self, pid: str) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} gauge"
+        for values, v in self.collect():
+            yield f"{self.name}{_labels(self.labelnames, values, pid)} {v}"
+
+
+_registry: List[object] = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    """All registered metrics in Prometheus text format."""
+    pid = f'pid="{os.getpid()}"'
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render(pid))  # type: ignore[attr-defined]
+    lines.append("")
+    return "\n".join(lines)
+
+
+def _pool_samples() -> Iterable[Tuple[LabelValues, float]]:
+    from db.connection import pool_stats
+
+    for pool, stats in pool_stats().items():
+        for state, value in stats.items():
+            yield (pool, state), value
+
+
+def _cache_samples() -> Iterable[Tuple[LabelValues, float]]:
+    from db.result_cache import result_cache
+
+    for name, value in result_cache.stats().items():
+        yield (name,), value
+
+
+STAGE_SECONDS = register(Histogram(
+    "api_stage_duration_seconds",
+    "Latency of each request stage (request, auth, parse, validate, normalize, connect, execute, fetch, serialize, total).",
+    ("stage", "role"),
+))
+RESULT_ROWS = register(Histogram(
+    "api_result_rows", "Rows returned per query.", ("role",), buckets=ROW_BUCKETS,
+))
+RESPONSE_BYTES = register(Histogram(
+    "api_response_bytes", "Serialized response payload size.", ("role",), buckets=BYTE_BUCKETS,
+))
+ERRORS = register(Counter(
+    "api_errors_total", "Failed requests by role and error class.", ("role", "error"),
+))
+POOL_CONNECTIONS = register(Gauge(
+    "db_pool_connections", "Connection pool occupancy by pool and state.", ("pool", "state"), _pool_samples,
+))
+PREPARED_STATEMENTS = register(Counter(
+    "db_prepared_statements_total",
+    "Prepared-statement cache lookups (hit, miss, unpreparable) and evictions.",
+    ("role", "result"),
+))
+COALESCED_QUERIES = register(Counter(
+    "db_coalesced_queries_total",
+    "Queries answered by joining an identical in-flight execution (buffered, json, stream).",
+    ("role", "mode"),
+))
+QUERY_SECONDS = register(Histogram(
+    "db_query_duration_seconds",
+    "Execute+fetch latency per query shape (fingerprint of the literal-free SQL).",
+    ("role", "fingerprint"),
+))
+ADMISSION_REJECTIONS = register(Counter(
+    "api_admission_rejected_total", "Requests rejected with 429 by API key and limit.", ("key", "reason"),
+))
+ADMISSION_CONTENDED = register(Counter(
+    "api_admission_contended_total",
+    "Requests admitted without accounting because the key's admission slot stayed locked.", ("key",),
+))
+RESULT_CACHE = register(Gauge(
+    "result_cache_stat", "Result cache statistics (entries, bytes, hits, misses, evictions).", ("stat",), _cache_samples,
+))
+
+
+# Fingerprints are unbounded in principle; past this many distinct shapes per
+# process, new ones are reported under fingerprint="other".
+MAX_QUERY_FINGERPRINTS = int(os.getenv("METRICS_MAX_QUERY_FINGERPRINTS", "500"))
+_fingerprints: set = set()
+_fingerprints_lock = threading.Lock()
+
+
+def observe_query(role: str, fingerprint: str, seconds: float) -> None:
+    if fingerprint not in _fingerprints:
+        with _fingerprints_lock:
+            if len(_fingerprints) < MAX_QUERY_FINGERPRINTS:
+                _fingerprints.add(fingerprint)
+            else:
+                fingerprint = "other"
+    QUERY_SECONDS.observe(seconds, role, fingerprint)
+
+
+def observe_stage(stage: str, role: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage, role)
+
+
+@contextmanager
+def stage(name: str, role: str) -> Iterator[None]:
+    """Time a block as one request stage: `with stage("execute", role): ...`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, name, role)
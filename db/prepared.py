@@ -0,0 +1,101 @@
+"""
+Per-connection cache of server-side prepared statements.
+
+Hot query shapes are PREPAREd once per physical connection and afterwards run
+with `EXECUTE name(args)`, so Postgres skips parsing and (after its generic
+plan kicks in) planning. The cache is an LRU keyed by the bind_params() text
+and stored on the pool slot, so it is dropped together with the connection;
+evicted entries are DEALLOCATEd on the spot.
+
+Statements Postgres refuses to prepare (e.g. a parameter whose type cannot be
+inferred) are remembered as unpreparable and run the plain way from then on.
+
+Config:
+  DB_PREPARED_STATEMENTS      set to 0 to disable, e.g. behind a transaction-mode
+                              pgbouncer/Supavisor, which does not keep them (default 1)
+  DB_PREPARED_CACHE_SIZE      statements kept per connection (default 128)
+"""
+import itertools
+import os
+from typing import Any, List, Optional
+
+from psycopg2 import errors
+
+from db.metrics import PREPARED_STATEMENTS
+from db.sql_validator import to_dollar_params
+
+PREPARED_ENABLED = os.getenv("DB_PREPARED_STATEMENTS", "1") not in ("0", "false", "False", "")
+PREPARED_CACHE_SIZE = int(os.getenv("DB_PREPARED_CACHE_SIZE", "128"))
+
+_names = itertools.count(1)
+
+
+def run_plain(cur: Any, text: str, args: List[Any]) -> None:
+    """Execute a bind_params() text without preparing it."""
+    if args:
+        cur.execute(text, args)
+    else:
+        # Without args psycopg2 does no %-processing, so undo the escaping.
+        cur.execute(text.replace("%%", "%"))
+
+
+def _execute(cur: Any, name: str, args: List[Any]) -> None:
+    if args:
+        cur.execute(f"EXECUTE {name} (" + ", ".join(["%s"] * len(args)) + ")", args)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+def _prepare(conn: Any, cur: Any, text: str, role: str) -> Optional[str]:
+    cache = conn.prepared
+    name = f"_ps{os.getpid()}_{next(_names)}"
+    try:
+        cur.execute(f"PREPARE {name} AS {to_dollar_params(text)}")
+    except (errors.IndeterminateDatatype, errors.AmbiguousParameter):
+        conn.rollback()
+        cache[text] = None
+        PREPARED_STATEMENTS.inc(role, "unpreparable")
+        return None
+    cache[text] = name
+    while len(cache) > PREPARED_CACHE_SIZE:
+        _, old = cache.popitem(last=False)
+        if old is not None:
+            cur.execute(f"DEALLOCATE {old}")
+            PREPARED_STATEMENTS.inc(role, "evicted")
+    return name
+
+
+def run_prepared(conn: Any, cur: Any, text: str, args: List[Any], role: str) -> None:
+    """
+    Execute a bind_params() text through the connection's prepared-statement cache.
+
+    Must be the first statement of the transaction: a refused PREPARE is rolled
+    back before falling back to a plain execute.
+    """
+    if not PREPARED_ENABLED or PREPARED_CACHE_SIZE <= 0:
+        run_plain(cur, text, args)
+        return
+    cache = conn.prepared
+    if text in cache:
+        cache.move_to_end(text)
+        name = cache[text]
+        if name is None:
+            run_plain(cur, text, args)
+            return
+        PREPARED_STATEMENTS.inc(role, "hit")
+        try:
+            _execute(cur, name, args)
+            return
+        except errors.FeatureNotSupported:
+            # "cached plan must not change result type": a table behind a
+            # SELECT * changed shape. Re-prepare once against the new schema.
+            conn.rollback()
+            del cache[text]
+            cur.execute(f"DEALLOCATE {name}")
+    else:
+        PREPARED_STATEMENTS.inc(role, "miss")
+    name = _prepare(conn, cur, text, role)
+    if name is None:
+        run_plain(cur, text, args)
+    else:
+        _execute(cur, name, args)
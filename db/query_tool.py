@@ -8,98 +8,1264 @@ Fixed:
 - preserved existing behavior: validate SELECT-only, restrict schemas,
   provide available table suggestions when a table is missing.
 """
-from typing import Any, Dict, List
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import psycopg2
-from psycopg2 import errors
-from db.connection import get_connection
+from psycopg2 import errors, sql
+from db.async_engine import run_sync
+from db.catalog import ROLE_SCHEMAS, get_catalog
+from db.config import RoleLimits, role_limits
+from db.connection import PoolTimeout, get_connection, get_pool
+from db.metrics import COALESCED_QUERIES, observe_query, stage
+from db.prepared import run_plain, run_prepared
+from db.result_cache import CACHE_ENABLED, estimate_size, normalize_sql, result_cache
+from db.slow_log import record_query
+from db.sql_validator import bind_params, parameterize, query_fingerprint, validate_select
 
 
-def _list_tables(schema: str) -> List[Dict[str, str]]:
-    """Helper to list available tables for a given schema."""
-    query = """
-        SELECT table_name
-        FROM information_schema.tables
-        WHERE table_schema = %s
-        ORDER BY table_name;
+def _list_tables(schema: str, role: str = "admin") -> List[Dict[str, str]]:
+    """Helper to list available tables for a given schema (served from the schema catalog)."""
+    return [{"table_name": name} for name in get_catalog(role).tables(schema)]
+
+
+def _validate_company_sql(sql_query: str) -> Tuple[str, List[str]]:
+    """Validate a user query; returns the cleaned SQL and the schemas it targets."""
+    analysis = validate_select(sql_query, ROLE_SCHEMAS["user"], "Only queries on the 'company' schema are permitted.")
+    return analysis.sql, sorted(analysis.schemas)
+
+
+def _validate_admin_sql(sql_query: str) -> Tuple[str, List[str]]:
+    """Validate an admin query; returns the cleaned SQL and the schemas it targets."""
+    analysis = validate_select(
+        sql_query, ROLE_SCHEMAS["admin"], "Admins may only query 'company' or 'finance' schemas."
+    )
+    return analysis.sql, sorted(analysis.schemas)
+
+
+def _missing_table_error(role: str, schemas: List[str]) -> ValueError:
+    """Build the ValueError payload listing available tables for the targeted schema(s)."""
+    if role == "user":
+        available = _list_tables("company", "user")
+        # Raise ValueError with a payload (caller can format/inspect). This retains the
+        # previous intent of providing available tables to the caller.
+        return ValueError({
+            "error": "The specified table does not exist in the 'company' schema.",
+            "available_tables": [t["table_name"] for t in available],
+        })
+    # Determine which schema(s) the query was targeting
+    fallback_schemas = schemas or ["company", "finance"]
+    available_by_schema = {s: [t["table_name"] for t in _list_tables(s, "admin")] for s in fallback_schemas}
+    return ValueError({
+        "error": "The specified table does not exist in one of the allowed schemas.",
+        "available_tables": available_by_schema,
+    })
+
+
+class QueryResult:
+    """
+    Columns plus raw cursor row tuples for one executed query.
+
+    Rows stay as the tuples psycopg2 returns; as_dicts() builds the classic
+    list-of-dicts shape only when a caller needs it.
     """
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(query, (schema,))
-            return [{"table_name": r[0]} for r in cur.fetchall()]
+    __slots__ = ("columns", "rows", "truncated")
+
+    def __init__(self, columns: List[str], rows: List[tuple], truncated: bool = False):
+        self.columns = columns
+        self.rows = rows
+        # True when a role's max_rows / max_response_bytes limit cut the result short.
+        self.truncated = truncated
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def as_dicts(self) -> List[Dict[str, Any]]:
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.rows]
+
+
+_FETCH_CHUNK = 1000
+
 
+def _capped_sql(text: str, args: List[Any], limits: RoleLimits) -> Tuple[str, List[Any]]:
+    """Wrap a bind_params() query in LIMIT max_rows+1 so Postgres stops producing rows early."""
+    if limits.max_rows is None:
+        return text, args
+    return "SELECT * FROM (" + text + ") AS _capped LIMIT %s", [*args, limits.max_rows + 1]
 
-def query_company_db(sql_query: str) -> List[Dict[str, Any]]:
+
+def _take_within_limits(cur, limits: RoleLimits) -> Tuple[List[tuple], bool]:
     """
-    Executes a safe SELECT query on the 'company' schema only.
-    Automatically provides suggestions if the target table doesn't exist.
+    Fetch rows chunk by chunk, stopping at max_rows or once the approximate
+    encoded size (repr length) would exceed max_response_bytes.
     """
-    if not isinstance(sql_query, str):
-        raise ValueError("SQL query must be a string.")
+    max_rows = limits.max_rows
+    max_bytes = limits.max_response_bytes
+    if max_rows is None and max_bytes is None:
+        return cur.fetchall(), False
+    rows: List[tuple] = []
+    size = 0
+    while True:
+        chunk = cur.fetchmany(_FETCH_CHUNK)
+        if not chunk:
+            return rows, False
+        if max_bytes is not None:
+            chunk_size = len(repr(chunk))
+            if size + chunk_size > max_bytes:
+                for row in chunk:
+                    size += len(repr(row)) + 2
+                    if size > max_bytes:
+                        return rows, True
+                    rows.append(row)
+            else:
+                size += chunk_size
+                rows.extend(chunk)
+        else:
+            rows.extend(chunk)
+        if max_rows is not None and len(rows) > max_rows:
+            return rows[:max_rows], True
 
-    sql_clean = sql_query.strip().rstrip(";")
-    sql_upper = sql_clean.upper()
-    if not sql_upper.startswith("SELECT"):
-        raise ValueError("Only SELECT statements are allowed.")
-    if "company." not in sql_clean.lower():
-        raise ValueError("Only queries on the 'company' schema are permitted.")
 
+def _fetch(role: str, text: str, args: List[Any], schemas: List[str], fingerprint: str) -> QueryResult:
+    """Run an already-validated query and return its columns and row tuples, within role limits."""
+    limits = role_limits(role)
+    stmt, stmt_args = _capped_sql(text, args, limits)
     try:
-        with get_connection() as conn:
+        t0 = time.perf_counter()
+        with stage("connect", role):
+            conn = get_connection(role)
+        with conn:
             with conn.cursor() as cur:
-                cur.execute(sql_clean)
-                columns = [desc[0] for desc in cur.description] if cur.description else []
-                rows = [dict(zip(columns, row)) for row in cur.fetchall()]
-        return rows
+                t1 = time.perf_counter()
+                with stage("execute", role):
+                    run_prepared(conn, cur, stmt, stmt_args, role)
+                t2 = time.perf_counter()
+                with stage("fetch", role):
+                    columns = [desc[0] for desc in cur.description] if cur.description else []
+                    rows, truncated = _take_within_limits(cur, limits) if cur.description else ([], False)
+                t3 = time.perf_counter()
+        observe_query(role, fingerprint, t3 - t1)
+        record_query(role, fingerprint, stmt, stmt_args,
+                     {"connect": t1 - t0, "execute": t2 - t1, "fetch": t3 - t2, "total": t3 - t0}, len(rows))
+        return QueryResult(columns, rows, truncated)
     except errors.UndefinedTable:
-        available = _list_tables("company")
-        # Raise ValueError with a payload (caller can format/inspect). This retains the
-        # previous intent of providing available tables to the caller.
-        raise ValueError({
-            "error": "The specified table does not exist in the 'company' schema.",
-            "available_tables": [t["table_name"] for t in available],
-        })
+        raise _missing_table_error(role, schemas)
     except Exception as e:
         # Wrap DB/other errors in ValueError to keep error type consistent for the app.
         raise ValueError(f"Database error: {str(e)}")
 
 
-def query_admin_db(sql_query: str) -> List[Dict[str, Any]]:
+_VALIDATORS = {
+    "user": _validate_company_sql,
+    "admin": _validate_admin_sql,
+}
+
+
+AUTO_PARAMETERIZE = os.getenv("DB_AUTO_PARAMETERIZE", "1") not in ("0", "false", "False", "")
+
+
+def _prepare_query(role: str, sql_query: str, params: Any = None) -> Tuple[str, List[Any], List[str], str]:
+    """
+    Validate a query for `role`, bind its params and lift its literals.
+
+    Returns (text, args, schemas, fingerprint) with text in psycopg2's positional
+    form (see sql_validator.bind_params), ready to be wrapped and executed with
+    args. Unless DB_AUTO_PARAMETERIZE=0, literals that can safely become bind
+    parameters are lifted out (sql_validator.parameterize), so queries differing
+    only in literal values share one prepared statement and one fingerprint.
+    """
+    validate = _VALIDATORS.get(role)
+    if validate is None:
+        raise ValueError(f"Unknown role: {role!r}")
+    with stage("validate", role):
+        sql_clean, schemas = validate(sql_query)
+        text, args = bind_params(sql_clean, params)
+    with stage("normalize", role):
+        if AUTO_PARAMETERIZE:
+            text, args, fingerprint = parameterize(text, args)
+        else:
+            fingerprint = query_fingerprint(text)
+    return text, args, schemas, fingerprint
+
+
+def _params_key(args: List[Any]) -> str:
+    """Hashable, type-preserving form of bound args for cache keys and fingerprints."""
+    return json.dumps(args, default=str, separators=(",", ":")) if args else ""
+
+
+# --- request coalescing ----------------------------------------------------
+
+# Concurrent identical queries (same role, normalized SQL and params) share
+# one database execution: the first caller runs it, later callers wait for
+# and return the same result (or raise the same error). Waiting callers hold
+# an executor thread but no connection, and would otherwise be running the
+# query themselves.
+COALESCE_ENABLED = os.getenv("DB_COALESCE", "1") not in ("0", "false", "False", "")
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+_flights: Dict[Tuple[Any, ...], _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def _single_flight(key: Tuple[Any, ...], fn: Callable[[], Any], mode: str = "buffered") -> Tuple[Any, bool]:
+    """Run fn() once per key among concurrent callers; returns (result, shared)."""
+    if not COALESCE_ENABLED:
+        return fn(), False
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+        else:
+            flight.waiters += 1
+    if not leader:
+        flight.done.wait()
+        COALESCED_QUERIES.inc(key[0], mode)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, True
+    try:
+        flight.result = fn()
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+    return flight.result, False
+
+
+def execute_query(
+    role: str,
+    sql_query: str,
+    params: Any = None,
+    use_cache: bool = True,
+    cache_ttl: Optional[float] = None,
+) -> Tuple[QueryResult, str]:
+    """
+    Validate and run a query for `role` ("user" or "admin") through the result cache.
+
+    `params` binds `%s` placeholders (list) or `%(name)s` placeholders (dict),
+    psycopg2-style; literal '%' must then be written '%%'. Queries run as
+    server-side prepared statements cached per connection (see db.prepared).
+
+    Concurrent identical calls share one execution (see _single_flight).
+
+    Returns (result, cache_status) where cache_status is "HIT", "MISS",
+    "BYPASS" or "COALESCED" (result of an identical query already in flight).
+    """
+    text, args, schemas, fingerprint = _prepare_query(role, sql_query, params)
+    key = (role, normalize_sql(text), _params_key(args))
+
+    if not (use_cache and CACHE_ENABLED):
+        result, shared = _single_flight(key, lambda: _fetch(role, text, args, schemas, fingerprint))
+        return result, "COALESCED" if shared else "BYPASS"
+
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached, "HIT"
+
+    def fetch_and_cache() -> QueryResult:
+        result = _fetch(role, text, args, schemas, fingerprint)
+        result_cache.put(key, result, estimate_size(result.rows), schemas=schemas, ttl=cache_ttl)
+        return result
+
+    result, shared = _single_flight(key, fetch_and_cache)
+    return result, "COALESCED" if shared else "MISS"
+
+
+def query_company_db(sql_query: str, params: Any = None, use_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Executes a safe SELECT query on the 'company' schema only.
+    Automatically provides suggestions if the target table doesn't exist.
+    `params` binds %s / %(name)s placeholders (list / dict), psycopg2-style.
+    Repeated queries are answered from the result cache unless use_cache=False.
+    """
+    return execute_query("user", sql_query, params, use_cache)[0].as_dicts()
+
+
+def query_admin_db(sql_query: str, params: Any = None, use_cache: bool = True) -> List[Dict[str, Any]]:
     """
     Executes a safe SELECT query for admins.
     Admins may query 'company' and 'finance' schemas only.
     Automatically lists available tables if the target is missing.
+    `params` binds %s / %(name)s placeholders (list / dict), psycopg2-style.
+    Repeated queries are answered from the result cache unless use_cache=False.
+    """
+    return execute_query("admin", sql_query, params, use_cache)[0].as_dicts()
+
+
+async def execute_query_async(
+    role: str,
+    sql_query: str,
+    params: Any = None,
+    use_cache: bool = True,
+    cache_ttl: Optional[float] = None,
+) -> Tuple[QueryResult, str]:
+    """Async variant of execute_query; runs on the bounded DB executor."""
+    return await run_sync(execute_query, role, sql_query, params, use_cache, cache_ttl)
+
+
+async def query_company_db_async(sql_query: str, params: Any = None, use_cache: bool = True) -> List[Dict[str, Any]]:
+    """Async variant of query_company_db; runs on the bounded DB executor."""
+    return await run_sync(query_company_db, sql_query, params, use_cache)
+
+
+async def query_admin_db_async(sql_query: str, params: Any = None, use_cache: bool = True) -> List[Dict[str, Any]]:
+    """Async variant of query_admin_db; runs on the bounded DB executor."""
+    return await run_sync(query_admin_db, sql_query, params, use_cache)
+
+
+# --- pagination ------------------------------------------------------------
+
+MAX_PAGE_SIZE = int(os.getenv("DB_MAX_PAGE_SIZE", "10000"))
+
+
+class PaginationError(ValueError):
+    """Bad order_by or page_token (a client error, unlike database failures)."""
+
+
+# Built-in types without a btree ordering: json, xml and the geometric types.
+# They are left out of the default keyset; naming one in order_by is a 400.
+_UNORDERED_TYPES = frozenset({114, 142, 600, 601, 602, 603, 604, 628, 718})
+
+
+def _query_fingerprint(role: str, text: str, args: List[Any]) -> str:
+    key = f"{role}:{normalize_sql(text)}:{_params_key(args)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _encode_page_token(fingerprint: str, keys: List[str], values: List[Any]) -> str:
+    payload = json.dumps({"f": fingerprint, "k": keys, "v": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_page_token(token: str, fingerprint: str) -> Tuple[List[str], List[Any]]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        keys, values = payload["k"], payload["v"]
+        if payload["f"] != fingerprint or len(keys) != len(values) or not keys:
+            raise ValueError
+    except Exception:
+        raise PaginationError("Invalid page_token for this query.")
+    return keys, values
+
+
+def _after_keys(keys: List[str], values: List[Any]) -> Tuple[sql.Composable, List[Any]]:
     """
-    if not isinstance(sql_query, str):
-        raise ValueError("SQL query must be a string.")
+    NULL-safe `(keys) > (values)` for `ORDER BY k1 NULLS LAST, k2 NULLS LAST, ...`:
+        (k1 > v1 OR k1 IS NULL)
+     OR (k1 IS NOT DISTINCT FROM v1 AND (k2 > v2 OR k2 IS NULL))
+     OR ...
+    A plain row comparison is NULL (so false) as soon as a key is NULL, which
+    would skip rows. Nothing sorts after a NULL key, so NULL values only ever
+    appear in the equality prefix.
+    """
+    terms: List[sql.Composable] = []
+    term_args: List[Any] = []
+    prefix: List[sql.Composable] = []
+    prefix_args: List[Any] = []
+    for key, value in zip(keys, values):
+        column = sql.Identifier("_page", key)
+        if value is not None:
+            terms.append(sql.SQL("({})").format(sql.SQL(" AND ").join(
+                prefix + [sql.SQL("({} > %s OR {} IS NULL)").format(column, column)]
+            )))
+            term_args.extend(prefix_args + [value])
+            prefix.append(sql.SQL("{} IS NOT DISTINCT FROM %s").format(column))
+            prefix_args.append(value)
+        else:
+            prefix.append(sql.SQL("{} IS NULL").format(column))
+    if not terms:
+        return sql.SQL("false"), []
+    return sql.SQL(" OR ").join(terms), term_args
+
 
-    sql_clean = sql_query.strip().rstrip(";")
-    sql_upper = sql_clean.upper()
-    if not sql_upper.startswith("SELECT"):
-        raise ValueError("Only SELECT statements are allowed.")
+def execute_page(
+    role: str,
+    sql_query: str,
+    limit: int,
+    page_token: Optional[str] = None,
+    order_by: Optional[List[str]] = None,
+    params: Any = None,
+) -> Tuple[QueryResult, Optional[str]]:
+    """
+    Serve one page of a validated query straight from Postgres using keyset pagination.
+
+    The query is wrapped as
+        SELECT * FROM (<query>) AS _page [WHERE <after last key>] ORDER BY k1 NULLS LAST, ... LIMIT n+1
+    where the keys are `order_by` (output column names) or, by default, every output
+    column of an orderable type. NULL keys are allowed (see _after_keys). Pass a
+    unique key in `order_by` for exact pagination over results with duplicate rows.
+    The token carries the last row's keys in Postgres text form (`k::text`), which
+    the column's type reads back exactly whatever it is (numeric, timestamptz,
+    arrays, jsonb, bytea, ...). Pages are cut short at max_response_bytes, like
+    execute_query results, and the token then continues after the last row sent.
+    Returns (page, next_page_token); the token is None on the last page and is
+    bound to this role + query text + params. Raises PaginationError for a bad
+    order_by or page_token, or a key column that cannot be ordered.
+    """
+    text, args, schemas, fingerprint = _prepare_query(role, sql_query, params)
+    limits = role_limits(role)
+    limit = min(max(1, limit), MAX_PAGE_SIZE, limits.max_rows or MAX_PAGE_SIZE)
+    token_fingerprint = _query_fingerprint(role, text, args)
+    inner = sql.SQL(text)
 
-    lower_sql = sql_clean.lower()
-    allowed_schemas: List[str] = []
-    if "company." in lower_sql:
-        allowed_schemas.append("company")
-    if "finance." in lower_sql:
-        allowed_schemas.append("finance")
-    if not allowed_schemas:
-        raise ValueError("Admins may only query 'company' or 'finance' schemas.")
+    after: List[Any] = []
+    keys: List[str] = list(order_by or [])
+    if page_token:
+        keys, after = _decode_page_token(page_token, token_fingerprint)
 
     try:
-        with get_connection() as conn:
+        t0 = time.perf_counter()
+        with stage("connect", role):
+            conn = get_connection(role)
+        with conn:
             with conn.cursor() as cur:
-                cur.execute(sql_clean)
-                columns = [desc[0] for desc in cur.description] if cur.description else []
-                rows = [dict(zip(columns, row)) for row in cur.fetchall()]
-        return rows
+                t1 = time.perf_counter()
+                if not page_token:
+                    # Plan-only probe for the output columns (keys from a token were checked when issued).
+                    cur.execute(sql.SQL("SELECT * FROM ({}) AS _page LIMIT %s").format(inner), [*args, 0])
+                    types = {desc[0]: desc[1] for desc in cur.description}
+                    unknown = [k for k in keys if k not in types]
+                    if unknown:
+                        raise PaginationError("order_by must name output columns of the query: " + ", ".join(unknown))
+                    unordered = [k for k in keys if types[k] in _UNORDERED_TYPES]
+                    if unordered:
+                        raise PaginationError("order_by columns must be orderable: " + ", ".join(unordered))
+                    keys = keys or [k for k, code in types.items() if code not in _UNORDERED_TYPES]
+                    if not keys:
+                        raise PaginationError("No orderable output column to paginate on; pass order_by.")
+                order = sql.SQL(", ").join(sql.SQL("{} NULLS LAST").format(sql.Identifier("_page", k)) for k in keys)
+                key_text = sql.SQL(", ").join(sql.SQL("{}::text").format(sql.Identifier("_page", k)) for k in keys)
+                where, where_args = sql.SQL(""), []
+                if page_token:
+                    predicate, where_args = _after_keys(keys, after)
+                    where = sql.SQL(" WHERE ") + predicate
+                stmt = sql.SQL("SELECT _page.*, {} FROM ({}) AS _page{} ORDER BY {} LIMIT %s").format(
+                    key_text, inner, where, order
+                )
+                stmt_args = [*args, *where_args, limit + 1]
+                with stage("execute", role):
+                    try:
+                        cur.execute(stmt, stmt_args)
+                    except errors.UndefinedFunction as e:
+                        if "ordering operator" not in str(e):
+                            raise
+                        raise PaginationError("order_by columns must be orderable: " + str(e).splitlines()[0])
+                t2 = time.perf_counter()
+                with stage("fetch", role):
+                    width = len(cur.description) - len(keys)
+                    columns = [desc[0] for desc in cur.description[:width]]
+                    rows, cut = _take_within_limits(cur, limits._replace(max_rows=None))
+                t3 = time.perf_counter()
+                stmt_text = stmt.as_string(cur)
+        observe_query(role, fingerprint, t3 - t1)
+        record_query(role, fingerprint, stmt_text, stmt_args,
+                     {"connect": t1 - t0, "execute": t2 - t1, "fetch": t3 - t2, "total": t3 - t0}, len(rows))
+    except PaginationError:
+        raise
     except errors.UndefinedTable:
-        # Determine which schema(s) the query was targeting
-        fallback_schemas = allowed_schemas or ["company", "finance"]
-        available = {s: [t["table_name"] for t in _list_tables(s)] for s in fallback_schemas}
-        raise ValueError({
-            "error": "The specified table does not exist in one of the allowed schemas.",
-            "available_tables": available,
-        })
+        raise _missing_table_error(role, schemas)
     except Exception as e:
         raise ValueError(f"Database error: {str(e)}")
+
+    next_token = None
+    if (len(rows) > limit or cut) and rows:
+        rows = rows[:limit]
+        next_token = _encode_page_token(token_fingerprint, keys, list(rows[-1][width:]))
+    page = QueryResult(columns, [row[:width] for row in rows], truncated=cut and not rows)
+    return page, next_token
+
+
+async def execute_page_async(
+    role: str,
+    sql_query: str,
+    limit: int,
+    page_token: Optional[str] = None,
+    order_by: Optional[List[str]] = None,
+    params: Any = None,
+) -> Tuple[QueryResult, Optional[str]]:
+    """Async variant of execute_page; runs on the bounded DB executor."""
+    return await run_sync(execute_page, role, sql_query, limit, page_token, order_by, params)
+
+
+# --- streaming -------------------------------------------------------------
+
+DEFAULT_STREAM_BATCH_SIZE = int(os.getenv("DB_STREAM_BATCH_SIZE", "1000"))
+MAX_STREAM_BATCH_SIZE = 50000
+
+
+class QueryStream:
+    """
+    A validated SELECT running on a server-side (named) cursor.
+
+    Rows are pulled from Postgres `batch_size` at a time, so memory stays flat
+    regardless of result size. The first batch is fetched on open so that SQL
+    errors surface before any response bytes are sent. Always close() the
+    stream; it holds a pooled connection until then. The role's max_rows and
+    max_response_bytes limits end the stream early with `truncated` set.
+    """
+
+    def __init__(
+        self,
+        role: str,
+        text: str,
+        args: List[Any],
+        schemas: List[str],
+        batch_size: Optional[int] = None,
+    ):
+        self.role = role
+        self.batch_size = min(max(1, batch_size or DEFAULT_STREAM_BATCH_SIZE), MAX_STREAM_BATCH_SIZE)
+        self.columns: List[str] = []
+        self.type_codes: List[int] = []
+        self.row_count = 0
+        self.truncated = False
+        self.limits = role_limits(role)
+        self._bytes = 0
+        self._first: Optional[List[tuple]] = None
+        self._done = False
+        with stage("connect", role):
+            self._conn = get_connection(role)
+        try:
+            self._cur = self._conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+            self._cur.itersize = self.batch_size
+            with stage("execute", role):
+                # Declaring the cursor is cheap; the first FETCH does the real work.
+                run_plain(self._cur, text, args)
+                self._first = self._cur.fetchmany(self.batch_size)
+            description = self._cur.description or []
+            self.columns = [desc[0] for desc in description]
+            # Postgres type OIDs, for encoders that need typed columns (db.arrow_export).
+            self.type_codes = [desc[1] for desc in description]
+        except errors.UndefinedTable:
+            self.close()
+            raise _missing_table_error(role, schemas)
+        except Exception as e:
+            self.close()
+            raise ValueError(f"Database error: {str(e)}")
+
+    def fetch_batch(self) -> List[tuple]:
+        """Next batch of row tuples; an empty list means the result is exhausted."""
+        if self._first is not None:
+            batch, self._first = self._first, None
+        elif self._done:
+            return []
+        else:
+            batch = self._cur.fetchmany(self.batch_size)
+        if len(batch) < self.batch_size:
+            self._done = True
+        batch = self._apply_limits(batch)
+        self.row_count += len(batch)
+        return batch
+
+    def _apply_limits(self, batch: List[tuple]) -> List[tuple]:
+        max_rows = self.limits.max_rows
+        if max_rows is not None and self.row_count + len(batch) > max_rows:
+            batch = batch[:max_rows - self.row_count]
+            self.truncated = self._done = True
+        max_bytes = self.limits.max_response_bytes
+        if max_bytes is not None:
+            size = len(repr(batch))
+            if self._bytes + size > max_bytes:
+                kept = 0
+                for row in batch:
+                    self._bytes += len(repr(row)) + 2
+                    if self._bytes > max_bytes:
+                        break
+                    kept += 1
+                batch = batch[:kept]
+                self.truncated = self._done = True
+            else:
+                self._bytes += size
+        return batch
+
+    def close(self) -> None:
+        conn, self._conn = getattr(self, "_conn", None), None
+        if conn is None:
+            return
+        cur = getattr(self, "_cur", None)
+        try:
+            if cur is not None and not cur.closed:
+                cur.close()
+        except Exception:
+            conn.discard()
+        conn.close()
+
+
+# A coalesced stream keeps at most this many fetched batches for subscribers
+# that have not read them yet. When the fastest subscriber needs another
+# batch and the buffer is full, it waits up to DB_COALESCE_LAG_TIMEOUT
+# seconds for the slowest ones to catch up, then drops them: their next
+# fetch fails instead of holding the whole result in memory.
+COALESCE_MAX_BATCHES = max(1, int(os.getenv("DB_COALESCE_MAX_BATCHES", "8")))
+COALESCE_LAG_TIMEOUT = float(os.getenv("DB_COALESCE_LAG_TIMEOUT", "2"))
+
+
+class _SharedStream:
+    """
+    One QueryStream fanned out to several subscribers. Fetched batches are kept
+    until every subscriber has read them, but never more than
+    COALESCE_MAX_BATCHES of them: a subscriber that lags further behind is
+    dropped. New subscribers are accepted only until the first batch is
+    handed out, so every subscriber sees the whole result.
+    """
+
+    def __init__(self, key: Tuple[Any, ...]):
+        self.key = key
+        self.cond = threading.Condition()
+        self.stream: Optional[QueryStream] = None
+        self.error: Optional[BaseException] = None
+        self.started = False
+        self.batches: List[List[tuple]] = []
+        self.base = 0                        # index of batches[0]
+        self.positions: Dict[int, int] = {}  # subscriber id -> next batch index
+        self.dropped: set = set()            # subscribers that fell too far behind
+        self.fetching = False
+        self.exhausted = False
+        self._ids = 0
+
+    def subscribe(self) -> Optional[int]:
+        with self.cond:
+            if self.started or self.error is not None:
+                return None
+            self._ids += 1
+            self.positions[self._ids] = 0
+            return self._ids
+
+    def open(self, role: str, text: str, args: List[Any], schemas: List[str], batch_size: Optional[int]) -> None:
+        try:
+            stream = QueryStream(role, text, args, schemas, batch_size)
+        except BaseException as e:
+            with self.cond:
+                self.error = e
+                self.cond.notify_all()
+            _forget_stream(self)
+            raise
+        with self.cond:
+            self.stream = stream
+            self.cond.notify_all()
+
+    def wait_open(self) -> QueryStream:
+        with self.cond:
+            while self.stream is None and self.error is None:
+                self.cond.wait()
+            if self.error is not None:
+                raise self.error
+            return self.stream
+
+    def fetch(self, sid: int) -> List[tuple]:
+        forget = False
+        deadline = None
+        with self.cond:
+            while True:
+                if sid in self.dropped:
+                    raise ValueError("Stream dropped: the client read too slowly behind an identical query")
+                position = self.positions[sid]
+                if position - self.base < len(self.batches):
+                    batch = self.batches[position - self.base]
+                    self.positions[sid] = position + 1
+                    self._trim()
+                    if not self.started:
+                        self.started = forget = True
+                    break
+                if self.exhausted:
+                    return []
+                if self.error is not None:
+                    raise self.error
+                if not self.fetching and len(self.batches) >= COALESCE_MAX_BATCHES:
+                    if deadline is None:
+                        deadline = time.monotonic() + COALESCE_LAG_TIMEOUT
+                    remaining = deadline - time.monotonic()
+                    if remaining > 0:
+                        self.cond.wait(remaining)
+                    else:
+                        self._drop_laggards()
+                    continue
+                if not self.fetching:
+                    self.fetching = True
+                    self.cond.release()
+                    try:
+                        batch = self.stream.fetch_batch()
+                    except BaseException as e:
+                        self.cond.acquire()
+                        self.fetching = False
+                        self.error = e
+                        self.cond.notify_all()
+                        raise
+                    self.cond.acquire()
+                    self.fetching = False
+                    if batch:
+                        self.batches.append(batch)
+                    else:
+                        self.exhausted = True
+                    self.cond.notify_all()
+                    continue
+                self.cond.wait()
+        if forget:
+            _forget_stream(self)
+        return batch
+
+    def _trim(self) -> None:
+        low = min(self.positions.values(), default=self.base + len(self.batches))
+        if low > self.base:
+            del self.batches[:low - self.base]
+            self.base = low
+            self.cond.notify_all()
+
+    def _drop_laggards(self) -> None:
+        for sid, position in list(self.positions.items()):
+            if position == self.base:
+                del self.positions[sid]
+                self.dropped.add(sid)
+        self._trim()
+
+    def unsubscribe(self, sid: int) -> None:
+        with self.cond:
+            self.positions.pop(sid, None)
+            self.dropped.discard(sid)
+            self._trim()
+            last = not self.positions
+            if last:
+                # Nobody left to read it: close, even if a new caller was about to join.
+                self.started = True
+            stream = self.stream
+        if last:
+            _forget_stream(self)
+            if stream is not None:
+                stream.close()
+
+
+class CoalescedStream:
+    """A subscriber's view of a _SharedStream, with QueryStream's interface."""
+
+    def __init__(self, shared: _SharedStream, sid: int, stream: QueryStream):
+        self._shared = shared
+        self._sid: Optional[int] = sid
+        self._stream = stream
+        self.role = stream.role
+        self.batch_size = stream.batch_size
+        self.columns = stream.columns
+        self.type_codes = stream.type_codes
+        self.limits = stream.limits
+        self.row_count = 0
+
+    @property
+    def truncated(self) -> bool:
+        return self._stream.truncated
+
+    def fetch_batch(self) -> List[tuple]:
+        if self._sid is None:
+            return []
+        batch = self._shared.fetch(self._sid)
+        self.row_count += len(batch)
+        return batch
+
+    def close(self) -> None:
+        sid, self._sid = self._sid, None
+        if sid is not None:
+            self._shared.unsubscribe(sid)
+
+
+_streams: Dict[Tuple[Any, ...], _SharedStream] = {}
+_streams_lock = threading.Lock()
+
+
+def _forget_stream(shared: _SharedStream) -> None:
+    with _streams_lock:
+        if _streams.get(shared.key) is shared:
+            del _streams[shared.key]
+
+
+def _open_stream(
+    role: str, text: str, args: List[Any], schemas: List[str], batch_size: Optional[int]
+) -> "QueryStream | CoalescedStream":
+    """
+    Open a stream, joining an identical one (same role, normalized SQL, params
+    and batch size) that is still opening or has not yet handed out a batch.
+    """
+    if not COALESCE_ENABLED:
+        return QueryStream(role, text, args, schemas, batch_size)
+    key = (role, normalize_sql(text), _params_key(args), batch_size)
+    with _streams_lock:
+        shared = _streams.get(key)
+        sid = shared.subscribe() if shared is not None else None
+        leader = sid is None
+        if leader:
+            shared = _streams[key] = _SharedStream(key)
+            sid = shared.subscribe()
+    if leader:
+        shared.open(role, text, args, schemas, batch_size)
+        return CoalescedStream(shared, sid, shared.stream)
+    try:
+        stream = shared.wait_open()
+    except BaseException:
+        shared.unsubscribe(sid)
+        raise
+    COALESCED_QUERIES.inc(role, "stream")
+    return CoalescedStream(shared, sid, stream)
+
+
+def stream_company_db(
+    sql_query: str, batch_size: Optional[int] = None, params: Any = None
+) -> "QueryStream | CoalescedStream":
+    """Streaming variant of query_company_db (same validation, server-side cursor, coalesced)."""
+    text, args, schemas, _ = _prepare_query("user", sql_query, params)
+    return _open_stream("user", text, args, schemas, batch_size)
+
+
+def stream_admin_db(
+    sql_query: str, batch_size: Optional[int] = None, params: Any = None
+) -> "QueryStream | CoalescedStream":
+    """Streaming variant of query_admin_db (same validation, server-side cursor, coalesced)."""
+    text, args, schemas, _ = _prepare_query("admin", sql_query, params)
+    return _open_stream("admin", text, args, schemas, batch_size)
+
+
+# --- batch -----------------------------------------------------------------
+
+MAX_BATCH_STATEMENTS = int(os.getenv("DB_BATCH_MAX_STATEMENTS", "50"))
+BATCH_PARALLELISM = int(os.getenv("DB_BATCH_PARALLELISM", "4"))
+
+_batch_executor: Optional[ThreadPoolExecutor] = None
+_batch_executor_lock = threading.Lock()
+
+
+def _get_batch_executor() -> ThreadPoolExecutor:
+    # Separate from the async engine's executor: batch fan-out runs *inside* one of
+    # its threads, and waiting on the same bounded pool could deadlock it.
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(max_workers=max(1, BATCH_PARALLELISM * 4),
+                                                 thread_name_prefix="db-batch")
+        return _batch_executor
+
+
+_SNAPSHOT_TXN = "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY"
+
+
+class BatchLimitError(ValueError):
+    """A batch statement skipped because earlier ones used up the batch's row/byte budget."""
+
+
+class _BatchBudget:
+    """
+    The role's max_rows/max_response_bytes, shared by all statements of one
+    batch (across connections), so a batch response is no larger than a single
+    query's. Rows are charged chunk by chunk with _take_within_limits' size
+    estimate; the statement that crosses the budget is truncated and later
+    ones are not run.
+    """
+
+    def __init__(self, limits: RoleLimits):
+        self.rows = limits.max_rows
+        self.bytes = limits.max_response_bytes
+        self.exhausted = False
+        self._lock = threading.Lock()
+
+    def _take(self, chunk: List[tuple]) -> Tuple[List[tuple], bool]:
+        with self._lock:
+            kept = chunk
+            if self.rows is not None and len(kept) > self.rows:
+                kept = kept[:self.rows]
+            if self.bytes is not None and len(repr(kept)) > self.bytes:
+                used = count = 0
+                for row in kept:
+                    used += len(repr(row)) + 2
+                    if used > self.bytes:
+                        break
+                    count += 1
+                kept = kept[:count]
+            if self.rows is not None:
+                self.rows -= len(kept)
+            if self.bytes is not None:
+                self.bytes -= len(repr(kept))
+            if len(kept) < len(chunk):
+                self.exhausted = True
+                return kept, True
+            return kept, False
+
+    def fetch(self, cur) -> Tuple[List[tuple], bool]:
+        """All rows of the current result that fit, and whether some were cut."""
+        rows: List[tuple] = []
+        while True:
+            chunk = cur.fetchmany(_FETCH_CHUNK)
+            if not chunk:
+                return rows, False
+            kept, cut = self._take(chunk)
+            rows.extend(kept)
+            if cut:
+                return rows, True
+
+
+def _run_statements(
+    conn, role: str, items: List[Tuple[int, str, List[Any], List[str]]], budget: _BatchBudget
+) -> Dict[int, Any]:
+    """
+    Run validated statements on one connection, each under a savepoint so that a
+    failing statement does not abort the rest of the snapshot transaction.
+    Returns {index: QueryResult | ValueError}.
+    """
+    limits = role_limits(role)
+    out: Dict[int, Any] = {}
+    with conn.cursor() as cur:
+        for index, text, args, schemas in items:
+            if budget.exhausted:
+                out[index] = BatchLimitError("Batch response limit reached; statement not run.")
+                continue
+            cur.execute("SAVEPOINT batch_stmt")
+            try:
+                stmt, stmt_args = _capped_sql(text, args, limits)
+                with stage("execute", role):
+                    run_plain(cur, stmt, stmt_args)
+                with stage("fetch", role):
+                    columns = [desc[0] for desc in cur.description] if cur.description else []
+                    rows, truncated = budget.fetch(cur) if cur.description else ([], False)
+                cur.execute("RELEASE SAVEPOINT batch_stmt")
+                out[index] = QueryResult(columns, rows, truncated)
+            except errors.UndefinedTable:
+                cur.execute("ROLLBACK TO SAVEPOINT batch_stmt")
+                out[index] = _missing_table_error(role, schemas)
+            except psycopg2.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT batch_stmt")
+                out[index] = ValueError(f"Database error: {str(e)}")
+    return out
+
+
+def execute_batch(
+    role: str,
+    sql_queries: List[str],
+    parallel: bool = False,
+    params: Optional[List[Any]] = None,
+) -> List[Any]:
+    """
+    Validate and run many SELECTs in one consistent read-only snapshot.
+
+    Statements run on a single pooled connection inside one REPEATABLE READ READ ONLY
+    transaction. With parallel=True the snapshot is exported (pg_export_snapshot) and
+    imported by up to DB_BATCH_PARALLELISM - 1 extra pooled connections, taken only
+    if free right now, which split the statements between them; every statement
+    still sees the same snapshot. The role's max_rows/max_response_bytes apply to
+    the batch as a whole (see _BatchBudget). Returns, in input order, a QueryResult
+    or the ValueError that statement failed with (validation or database error,
+    or BatchLimitError). `params`, if given, holds one params value (or None) per
+    statement.
+    """
+    if role not in _VALIDATORS:
+        raise ValueError(f"Unknown role: {role!r}")
+    if len(sql_queries) > MAX_BATCH_STATEMENTS:
+        raise ValueError(f"A batch may contain at most {MAX_BATCH_STATEMENTS} statements.")
+    if params is not None and len(params) != len(sql_queries):
+        raise ValueError("params must hold one entry per statement.")
+
+    results: List[Any] = [None] * len(sql_queries)
+    pending: List[Tuple[int, str, List[Any], List[str]]] = []
+    for index, sql_query in enumerate(sql_queries):
+        try:
+            text, args, schemas, _ = _prepare_query(role, sql_query, params[index] if params else None)
+            pending.append((index, text, args, schemas))
+        except ValueError as e:
+            results[index] = e
+    if not pending:
+        return results
+    budget = _BatchBudget(role_limits(role))
+
+    with stage("connect", role):
+        leader = get_connection(role)
+    extra: List[Any] = []
+    futures: List[Future] = []
+    try:
+        with leader:
+            with leader.cursor() as cur:
+                cur.execute(_SNAPSHOT_TXN)
+                snapshot_id = None
+                if parallel and len(pending) > 1 and BATCH_PARALLELISM > 1:
+                    cur.execute("SELECT pg_export_snapshot()")
+                    snapshot_id = cur.fetchone()[0]
+            if snapshot_id is not None:
+                pool = get_pool(role)
+                for _ in range(min(BATCH_PARALLELISM, len(pending)) - 1):
+                    try:
+                        conn = pool.getconn(timeout=0)
+                    except PoolTimeout:
+                        break
+                    try:
+                        with conn.cursor() as cur:
+                            cur.execute(_SNAPSHOT_TXN)
+                            cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+                    except psycopg2.Error:
+                        # Could not join the snapshot: run with the connections we have.
+                        conn.close()
+                        break
+                    extra.append(conn)
+
+            conns = [leader, *extra]
+            shares = [pending[i::len(conns)] for i in range(len(conns))]
+            if len(conns) == 1:
+                outcomes = [_run_statements(leader, role, pending, budget)]
+            else:
+                executor = _get_batch_executor()
+                for conn, share in zip(conns[1:], shares[1:]):
+                    futures.append(executor.submit(_run_statements, conn, role, share, budget))
+                # The leader keeps the exported snapshot alive while it works its own share.
+                outcomes = [_run_statements(leader, role, shares[0], budget)]
+                outcomes.extend(f.result() for f in futures)
+    except psycopg2.Error as e:
+        raise ValueError(f"Database error: {str(e)}")
+    finally:
+        # On failure (e.g. the leader's savepoint rollback hit a dropped connection)
+        # futures may still be running on their connections: stop or await them
+        # before those connections go back to the pool.
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        for conn in extra:
+            conn.close()
+
+    for outcome in outcomes:
+        for index, value in outcome.items():
+            results[index] = value
+    return results
+
+
+async def execute_batch_async(
+    role: str,
+    sql_queries: List[str],
+    parallel: bool = False,
+    params: Optional[List[Any]] = None,
+) -> List[Any]:
+    """Async variant of execute_batch; runs on the bounded DB executor."""
+    return await run_sync(execute_batch, role, sql_queries, parallel, params)
+
+
+# --- Postgres-side JSON ------------------------------------------------------
+
+class JsonResult:
+    """A result set rendered to a JSON array of objects by Postgres (json_agg)."""
+    __slots__ = ("text", "rows", "truncated")
+
+    def __init__(self, text: str, rows: int, truncated: bool = False):
+        self.text = text
+        self.rows = rows
+        self.truncated = truncated
+
+    def __len__(self) -> int:
+        return self.rows
+
+
+def _json_agg_sql(text: str, args: List[Any], limits: RoleLimits) -> Tuple[str, List[Any]]:
+    """
+    Wrap a bind_params() query so Postgres returns (json array text, row count).
+    With a max_rows limit, max_rows+1 rows are read so truncation is detectable,
+    and only the first max_rows go into the array. With a max_response_bytes
+    limit the size is checked server-side (octet_length) and an array over it
+    comes back as NULL, so it never crosses the wire.
+    """
+    if limits.max_rows is None:
+        stmt = "SELECT coalesce(json_agg(_t), '[]'::json)::text AS _j, count(*) AS _c FROM (" + text + ") AS _t"
+        stmt_args = args
+    else:
+        capped, capped_args = _capped_sql(text, args, limits)
+        stmt = (
+            "SELECT coalesce(json_agg(_s._t) FILTER (WHERE _s._n <= %s), '[]'::json)::text AS _j, count(*) AS _c "
+            "FROM (SELECT _t, row_number() OVER () AS _n FROM (" + capped + ") AS _t) AS _s"
+        )
+        stmt_args = [limits.max_rows, *capped_args]
+    if limits.max_response_bytes is None:
+        return stmt, stmt_args
+    return (
+        "SELECT CASE WHEN octet_length(_a._j) <= %s THEN _a._j END, _a._c FROM (" + stmt + ") AS _a",
+        [limits.max_response_bytes, *stmt_args],
+    )
+
+
+def execute_json(
+    role: str,
+    sql_query: str,
+    params: Any = None,
+    use_cache: bool = True,
+    cache_ttl: Optional[float] = None,
+) -> Tuple[Optional[JsonResult], str]:
+    """
+    Validate and run a query with Postgres building the JSON itself:
+    `SELECT json_agg(t) FROM (<query>) t`. The array text is handed back as-is
+    for the caller to splice into its response, with no per-row Python work.
+
+    Values use Postgres' JSON rendering (exact numerics, bytea as \\x hex,
+    intervals as text), which differs from execute_query for some types.
+    Returns (None, "BYPASS") when the rendered array exceeds the role's
+    max_response_bytes, which Postgres-side rendering cannot cut short, or
+    when the role has neither max_rows nor max_response_bytes, as nothing would
+    bound the array; the caller should fall back to execute_query. Otherwise
+    (result, cache_status).
+    """
+    text, args, schemas, fingerprint = _prepare_query(role, sql_query, params)
+    limits = role_limits(role)
+    if limits.max_rows is None and limits.max_response_bytes is None:
+        return None, "BYPASS"
+    key = (role, "json_agg", normalize_sql(text), _params_key(args))
+    caching = use_cache and CACHE_ENABLED
+    if caching:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached, "HIT"
+
+    def run() -> Tuple[Optional[JsonResult], str]:
+        stmt, stmt_args = _json_agg_sql(text, args, limits)
+        try:
+            t0 = time.perf_counter()
+            with stage("connect", role):
+                conn = get_connection(role)
+            with conn:
+                with conn.cursor() as cur:
+                    t1 = time.perf_counter()
+                    with stage("execute", role):
+                        run_prepared(conn, cur, stmt, stmt_args, role)
+                    t2 = time.perf_counter()
+                    with stage("fetch", role):
+                        body, count = cur.fetchone()
+                    t3 = time.perf_counter()
+        except errors.UndefinedTable:
+            raise _missing_table_error(role, schemas)
+        except Exception as e:
+            raise ValueError(f"Database error: {str(e)}")
+        observe_query(role, fingerprint, t3 - t1)
+        truncated = limits.max_rows is not None and count > limits.max_rows
+        rows = min(count, limits.max_rows) if truncated else count
+        record_query(role, fingerprint, stmt, stmt_args,
+                     {"connect": t1 - t0, "execute": t2 - t1, "fetch": t3 - t2, "total": t3 - t0}, rows)
+
+        if body is None:
+            return None, "BYPASS"  # over max_response_bytes (see _json_agg_sql)
+        result = JsonResult(body, rows, truncated)
+        if not caching:
+            return result, "BYPASS"
+        result_cache.put(key, result, len(body) + 100, schemas=schemas, ttl=cache_ttl)
+        return result, "MISS"
+
+    (result, status), shared = _single_flight(key, run, "json")
+    return result, "COALESCED" if shared and result is not None else status
+
+
+async def execute_json_async(
+    role: str,
+    sql_query: str,
+    params: Any = None,
+    use_cache: bool = True,
+    cache_ttl: Optional[float] = None,
+) -> Tuple[Optional[JsonResult], str]:
+    """Async variant of execute_json; runs on the bounded DB executor."""
+    return await run_sync(execute_json, role, sql_query, params, use_cache, cache_ttl)
+
+
+# --- CSV export ----------------------------------------------------------------
+
+CSV_CHUNK_BYTES = 64 * 1024
+
+
+class _CsvTooLarge(Exception):
+    pass
+
+
+class _ChunkWriter:
+    """
+    File object for copy_expert: psycopg2 writes one CSV row per call; rows are
+    gathered into ~CSV_CHUNK_BYTES chunks and handed to `emit`. Stops the COPY
+    (by raising) before a row would take the output past `max_bytes`.
+    """
+
+    def __init__(self, emit: Callable[[bytes], None], max_bytes: Optional[int]):
+        self._emit = emit
+        self._max_bytes = max_bytes
+        self._parts: List[bytes] = []
+        self._pending = 0
+        self.written = 0
+
+    def write(self, data: Any) -> int:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if self._max_bytes is not None and self.written + len(data) > self._max_bytes:
+            raise _CsvTooLarge()
+        self._parts.append(data)
+        self._pending += len(data)
+        self.written += len(data)
+        if self._pending >= CSV_CHUNK_BYTES:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if self._parts:
+            chunk, self._parts, self._pending = b"".join(self._parts), [], 0
+            self._emit(chunk)
+
+
+def export_csv(role: str, sql_query: str, params: Any = None) -> Callable[[Callable[[bytes], None]], None]:
+    """
+    Validate a query (as query_company_db / query_admin_db do) and return the
+    blocking producer `produce(emit)` that runs
+        COPY (<query>) TO STDOUT WITH (FORMAT csv, HEADER true)
+    through cursor.copy_expert and emits the CSV in ~64 KiB chunks as Postgres
+    sends it; nothing is materialized beyond one chunk. Meant to be driven by
+    async_engine.iterate_in_thread, whose blocking emit gives backpressure.
+
+    COPY cannot take bind parameters, so params are interpolated client-side
+    (cursor.mogrify). The role's max_rows becomes a LIMIT; max_response_bytes
+    ends the export at the last whole row that fits.
+    """
+    text, args, schemas, fingerprint = _prepare_query(role, sql_query, params)
+    limits = role_limits(role)
+
+    def produce(emit: Callable[[bytes], None]) -> None:
+        writer = _ChunkWriter(emit, limits.max_response_bytes)
+        start = time.perf_counter()
+        with stage("connect", role):
+            conn = get_connection(role)
+        try:
+            with conn.cursor() as cur:
+                select = cur.mogrify(text, args) if args else cur.mogrify(text.replace("%%", "%"))
+                if limits.max_rows is not None:
+                    select = b"SELECT * FROM (" + select + b") AS _capped LIMIT %d" % limits.max_rows
+                with stage("execute", role):
+                    try:
+                        cur.copy_expert(b"COPY (" + select + b") TO STDOUT WITH (FORMAT csv, HEADER true)", writer)
+                    except _CsvTooLarge:
+                        # The COPY was abandoned midway; the connection is not reusable.
+                        conn.discard()
+                    else:
+                        conn.rollback()
+            writer.flush()
+        except errors.UndefinedTable:
+            conn.discard()
+            raise _missing_table_error(role, schemas)
+        except psycopg2.Error as e:
+            conn.discard()
+            raise ValueError(f"Database error: {str(e)}")
+        except BaseException:
+            # Typically the consumer went away mid-COPY.
+            conn.discard()
+            raise
+        finally:
+            conn.close()
+        observe_query(role, fingerprint, time.perf_counter() - start)
+
+    return produce
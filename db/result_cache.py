@@ -0,0 +1,160 @@
+"""
+In-process result cache for read-only queries.
+
+Entries are keyed by (role, normalized SQL), expire after a per-entry TTL and
+are evicted least-recently-used once the approximate memory footprint exceeds
+the byte budget. Each entry remembers the schemas it read from so a schema's
+entries can be dropped in one call.
+
+Config:
+  RESULT_CACHE_ENABLED    set to 0 to disable caching (default 1)
+  RESULT_CACHE_MAX_BYTES  approximate memory budget (default 64 MiB)
+  RESULT_CACHE_TTL        default entry lifetime in seconds (default 30)
+  RESULT_CACHE_MAX_TTL    upper bound for per-request TTLs (default 3600)
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Canonical form used for cache keys: whitespace runs outside quoted literals
+    and identifiers collapse to one space; a trailing semicolon is dropped.
+    Keyword case is left alone (it can't be changed without parsing).
+    """
+    out: List[str] = []
+    quote: Optional[str] = None
+    pending_space = False
+    for ch in sql.strip().rstrip(";").strip():
+        if quote:
+            out.append(ch)
+            if ch == quote:
+                quote = None
+            continue
+        if ch.isspace():
+            pending_space = True
+            continue
+        if pending_space:
+            out.append(" ")
+            pending_space = False
+        if ch in ("'", '"'):
+            quote = ch
+        out.append(ch)
+    return "".join(out)
+
+
+def estimate_size(rows: Sequence[Sequence[Any]]) -> int:
+    """Cheap approximation of the heap footprint of a list of row tuples (sampled from the first row)."""
+    if not rows:
+        return sys.getsizeof(rows)
+    sample = rows[0]
+    per_row = sys.getsizeof(sample) + sum(sys.getsizeof(v) for v in sample)
+    return sys.getsizeof(rows) + per_row * len(rows)
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "schemas", "created_at")
+
+    def __init__(self, value: Any, size: int, expires_at: float, schemas: Tuple[str, ...]):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.schemas = schemas
+        self.created_at = time.monotonic()
+
+
+class ResultCache:
+    """Thread-safe, memory-bounded LRU with per-entry TTL and schema tags."""
+
+    def __init__(self, max_bytes: int, default_ttl: float, max_ttl: float = 3600.0):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= now:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(
+        self,
+        key: Hashable,
+        value: Any,
+        size: int,
+        schemas: Iterable[str] = (),
+        ttl: Optional[float] = None,
+    ) -> bool:
+        """Store a value; returns False if it is too large to cache at all."""
+        if size > self.max_bytes:
+            return False
+        ttl = self.default_ttl if ttl is None else min(max(ttl, 0.0), self.max_ttl)
+        if ttl <= 0:
+            return False
+        entry = _Entry(value, size, time.monotonic() + ttl, tuple(schemas))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return True
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def invalidate_schema(self, schema: str) -> int:
+        """Drop every entry that read from `schema`; returns how many were dropped."""
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if schema in e.schemas]
+            for k in keys:
+                self._remove(k)
+            return len(keys)
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            return count
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") not in ("0", "false", "False", "")
+
+result_cache = ResultCache(
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    default_ttl=float(os.getenv("RESULT_CACHE_TTL", "30")),
+    max_ttl=float(os.getenv("RESULT_CACHE_MAX_TTL", "3600")),
+)
@@ -0,0 +1,228 @@
+"""
+Slow-query log with sampled EXPLAIN capture.
+
+Queries slower than SLOW_QUERY_THRESHOLD_MS are logged (fingerprint, role,
+per-stage durations, row count). A random SLOW_QUERY_EXPLAIN_SAMPLE_RATE of
+them is then re-planned with `EXPLAIN (FORMAT JSON)` in the background, on a
+separate pooled connection taken only if one is free, and the plan is stored
+in a bounded on-disk ring buffer that all workers on the host share.
+
+Ring file layout: a header (magic, total records written) followed by
+SLOW_QUERY_RING_SLOTS fixed-size slots, each a 4-byte length plus a JSON
+record. Writers serialize with an fcntl record lock, so gunicorn workers can
+append concurrently; the oldest slot is overwritten once the ring is full.
+
+Config:
+  SLOW_QUERY_THRESHOLD_MS         log queries at or above this duration (default 1000; 0 disables)
+  SLOW_QUERY_EXPLAIN_SAMPLE_RATE  fraction of slow queries to EXPLAIN (default 0.1)
+  SLOW_QUERY_LOG_PATH             ring buffer file (default: slow_queries.ring in the temp dir)
+  SLOW_QUERY_RING_SLOTS           plans kept (default 256)
+  SLOW_QUERY_SLOT_BYTES           max encoded size of one record (default 65536)
+"""
+import fcntl
+import json
+import logging
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "1000"))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "0.1"))
+
+_HEADER = struct.Struct("<8sQ")  # magic, records written
+_LENGTH = struct.Struct("<I")
+_MAGIC = b"SLOWQ001"
+
+
+class PlanRing:
+    """Fixed-size ring of JSON records in one file, safe across processes and threads."""
+
+    def __init__(self, path: str, slots: int, slot_bytes: int):
+        self.path = path
+        self.slots = max(1, slots)
+        self.slot_bytes = max(_LENGTH.size + 64, slot_bytes)
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def _size(self) -> int:
+        return _HEADER.size + self.slots * self.slot_bytes
+
+    def _offset(self, slot: int) -> int:
+        return _HEADER.size + slot * self.slot_bytes
+
+    def _open(self) -> int:
+        # fcntl record locks belong to the process: reopen after a fork.
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._pid = os.getpid()
+        return self._fd
+
+    def _header(self, fd: int) -> int:
+        """Records written so far; (re)initializes the file if it is new or was made with other sizes."""
+        raw = os.pread(fd, _HEADER.size, 0)
+        if len(raw) == _HEADER.size and os.fstat(fd).st_size == self._size:
+            magic, count = _HEADER.unpack(raw)
+            if magic == _MAGIC:
+                return count
+        os.ftruncate(fd, 0)
+        os.ftruncate(fd, self._size)
+        os.pwrite(fd, _HEADER.pack(_MAGIC, 0), 0)
+        return 0
+
+    def append(self, record: Dict[str, Any]) -> None:
+        payload = json.dumps(record, default=str, separators=(",", ":")).encode("utf-8")
+        if len(payload) > self.slot_bytes - _LENGTH.size:
+            record = dict(record, plan=None, plan_truncated=True)
+            payload = json.dumps(record, default=str, separators=(",", ":")).encode("utf-8")
+            payload = payload[:self.slot_bytes - _LENGTH.size]
+        with self._lock:
+            fd = self._open()
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                count = self._header(fd)
+                os.pwrite(fd, _LENGTH.pack(len(payload)) + payload, self._offset(count % self.slots))
+                os.pwrite(fd, _HEADER.pack(_MAGIC, count + 1), 0)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+
+    def read(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Stored records, newest first."""
+        with self._lock:
+            fd = self._open()
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                count = self._header(fd)
+                n = min(count, self.slots, limit if limit is not None else self.slots)
+                raw = [os.pread(fd, self.slot_bytes, self._offset((count - 1 - i) % self.slots)) for i in range(n)]
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+        records = []
+        for chunk in raw:
+            (length,) = _LENGTH.unpack_from(chunk)
+            try:
+                records.append(json.loads(chunk[_LENGTH.size:_LENGTH.size + length]))
+            except ValueError:
+                continue
+        return records
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                os.close(self._fd)
+            self._fd = None
+
+
+plan_ring = PlanRing(
+    path=os.getenv("SLOW_QUERY_LOG_PATH", os.path.join(tempfile.gettempdir(), "slow_queries.ring")),
+    slots=int(os.getenv("SLOW_QUERY_RING_SLOTS", "256")),
+    slot_bytes=int(os.getenv("SLOW_QUERY_SLOT_BYTES", "65536")),
+)
+
+# One background thread; pending EXPLAINs beyond this are dropped rather than queued.
+_MAX_PENDING = 8
+_explain_executor: Optional[ThreadPoolExecutor] = None
+_pending = 0
+_state_lock = threading.Lock()
+
+
+def _explain(role: str, fingerprint: str, text: str, args: List[Any], record: Dict[str, Any]) -> None:
+    global _pending
+    import psycopg2
+
+    from db.connection import PoolTimeout, get_pool
+    from db.prepared import run_plain
+
+    try:
+        try:
+            conn = get_pool(role).getconn(timeout=0)
+        except PoolTimeout:
+            logger.info("Slow query %s: no free connection for EXPLAIN, skipped", fingerprint)
+            return
+        try:
+            with conn.cursor() as cur:
+                run_plain(cur, "EXPLAIN (FORMAT JSON) " + text, args)
+                record["plan"] = cur.fetchone()[0]
+            conn.rollback()
+        except psycopg2.Error as e:
+            conn.rollback()
+            record["plan"] = None
+            record["explain_error"] = str(e).splitlines()[0][:200]
+        finally:
+            conn.close()
+        plan_ring.append(record)
+    except Exception:
+        logger.exception("Capturing EXPLAIN for slow query %s failed", fingerprint)
+    finally:
+        with _state_lock:
+            _pending -= 1
+
+
+def _submit_explain(*job: Any) -> None:
+    global _explain_executor, _pending
+    with _state_lock:
+        if _pending >= _MAX_PENDING:
+            return
+        if _explain_executor is None:
+            _explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-explain")
+        _pending += 1
+        executor = _explain_executor
+    executor.submit(_explain, *job)
+
+
+def record_query(
+    role: str,
+    fingerprint: str,
+    text: str,
+    args: List[Any],
+    durations: Dict[str, float],
+    rows: int,
+) -> None:
+    """
+    Report one executed query. `text`/`args` are the statement as run (bind_params
+    form); `durations` maps stage name to seconds and must include "total".
+    """
+    total_ms = durations["total"] * 1000.0
+    if SLOW_QUERY_THRESHOLD_MS <= 0 or total_ms < SLOW_QUERY_THRESHOLD_MS:
+        return
+    breakdown = {name: round(seconds * 1000.0, 2) for name, seconds in durations.items()}
+    logger.warning(
+        "Slow query fingerprint=%s role=%s rows=%d total_ms=%.1f stages_ms=%s",
+        fingerprint, role, rows, total_ms, breakdown,
+    )
+    if random.random() >= SLOW_QUERY_EXPLAIN_SAMPLE_RATE:
+        return
+    record = {
+        "ts": time.time(),
+        "pid": os.getpid(),
+        "role": role,
+        "fingerprint": fingerprint,
+        "sql": text.replace("%%", "%") if not args else text,
+        "params": len(args),
+        "rows": rows,
+        "durations_ms": breakdown,
+    }
+    _submit_explain(role, fingerprint, text, args, record)
+
+
+def recent_plans(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Captured slow-query plans, newest first."""
+    return plan_ring.read(limit)
+
+
+def stop_slow_log() -> None:
+    """Stop the EXPLAIN thread and close the ring file (e.g. on application shutdown)."""
+    global _explain_executor
+    with _state_lock:
+        executor, _explain_executor = _explain_executor, None
+    if executor is not None:
+        executor.shutdown(wait=False)
+    plan_ring.close()
@@ -0,0 +1,673 @@
+"""
+Tokenizer-based SQL validator for the read-only query endpoints.
+
+One linear pass over the text produces tokens that know about string
+literals, quoted identifiers, dollar quoting, comments and parentheses, so
+checks are not fooled by `company.` inside a string or a `WITH` prefix. From
+the tokens we derive:
+
+- the statement type (the main statement after any WITH ... AS (...) list)
+- every relation referenced after FROM/JOIN (schema-qualified or a CTE name)
+- whether the text contains more than one statement or any data-modifying
+  keyword anywhere (including inside CTEs)
+
+Verdicts (analysis or rejection) are cached by the query text, so repeated
+queries skip re-tokenizing.
+
+The same tokenizer binds psycopg2-style params (bind_params), converts them
+for PREPARE (to_dollar_params) and lifts literal values out into bind
+parameters so queries differing only in literals share one shape
+(parameterize).
+"""
+import decimal
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+from db.result_cache import normalize_sql
+
+
+class SqlValidationError(ValueError):
+    """The query was rejected by the validator (bad syntax, not SELECT, wrong schema)."""
+
+
+class Token(NamedTuple):
+    kind: str   # word, qident, string, number, param, placeholder, op, punct
+    value: str  # words are lower-cased; quoted identifiers are unquoted
+    start: int
+    end: int
+
+
+_OP_CHARS = set("+-*/<>=~!@#%^&|`?")
+_PUNCT = set("(),;.[]:")
+
+
+def _is_ident_start(ch: str) -> bool:
+    return ch.isalpha() or ch == "_" or ord(ch) > 127
+
+
+def _is_ident_char(ch: str) -> bool:
+    return ch.isalnum() or ch in "_$" or ord(ch) > 127
+
+
+def tokenize(sql: str) -> List[Token]:
+    """Split SQL into tokens, dropping whitespace and comments."""
+    tokens: List[Token] = []
+    i = 0
+    n = len(sql)
+    while i < n:
+        ch = sql[i]
+        start = i
+        if ch.isspace():
+            i += 1
+            continue
+        nxt = sql[i + 1] if i + 1 < n else ""
+        if ch == "-" and nxt == "-":
+            end = sql.find("\n", i)
+            i = n if end < 0 else end + 1
+            continue
+        if ch == "/" and nxt == "*":
+            depth = 1
+            i += 2
+            while i < n and depth:
+                if sql.startswith("/*", i):
+                    depth += 1
+                    i += 2
+                elif sql.startswith("*/", i):
+                    depth -= 1
+                    i += 2
+                else:
+                    i += 1
+            if depth:
+                raise SqlValidationError("Unterminated comment in SQL query.")
+            continue
+        if ch == "'" or (ch in "eEbBxXnN" and nxt == "'"):
+            backslash = ch in "eE"
+            i = i + 1 if ch == "'" else i + 2
+            while True:
+                if i >= n:
+                    raise SqlValidationError("Unterminated string literal in SQL query.")
+                c = sql[i]
+                if backslash and c == "\\":
+                    i += 2
+                    continue
+                if c == "'":
+                    if i + 1 < n and sql[i + 1] == "'":
+                        i += 2
+                        continue
+                    i += 1
+                    break
+                i += 1
+            tokens.append(Token("string", sql[start:i], start, i))
+            continue
+        if ch == '"':
+            i += 1
+            parts: List[str] = []
+            while True:
+                end = sql.find('"', i)
+                if end < 0:
+                    raise SqlValidationError("Unterminated quoted identifier in SQL query.")
+                parts.append(sql[i:end])
+                if end + 1 < n and sql[end + 1] == '"':
+                    parts.append('"')
+                    i = end + 2
+                    continue
+                i = end + 1
+                break
+            tokens.append(Token("qident", "".join(parts), start, i))
+            continue
+        if ch == "$":
+            if nxt.isdigit():
+                i += 1
+                while i < n and sql[i].isdigit():
+                    i += 1
+                tokens.append(Token("param", sql[start:i], start, i))
+                continue
+            j = i + 1
+            while j < n and _is_ident_char(sql[j]) and sql[j] != "$":
+                j += 1
+            if j < n and sql[j] == "$":
+                tag = sql[i:j + 1]
+                end = sql.find(tag, j + 1)
+                if end < 0:
+                    raise SqlValidationError("Unterminated dollar-quoted string in SQL query.")
+                i = end + len(tag)
+                tokens.append(Token("string", sql[start:i], start, i))
+                continue
+        if ch == "%" and nxt in ("s", "("):
+            if nxt == "s":
+                i += 2
+                tokens.append(Token("placeholder", "%s", start, i))
+                continue
+            end = sql.find(")s", i)
+            if end > 0:
+                i = end + 2
+                tokens.append(Token("placeholder", sql[start:i], start, i))
+                continue
+        if ch.isdigit() or (ch == "." and nxt.isdigit()):
+            i += 1
+            while i < n and (sql[i].isdigit() or sql[i] == "."):
+                if sql[i] == "." and sql.startswith("..", i):
+                    break
+                i += 1
+            if i < n and sql[i] in "eE":
+                j = i + 1
+                if j < n and sql[j] in "+-":
+                    j += 1
+                if j < n and sql[j].isdigit():
+                    i = j
+                    while i < n and sql[i].isdigit():
+                        i += 1
+            tokens.append(Token("number", sql[start:i], start, i))
+            continue
+        if _is_ident_start(ch):
+            i += 1
+            while i < n and _is_ident_char(sql[i]):
+                i += 1
+            tokens.append(Token("word", sql[start:i].lower(), start, i))
+            continue
+        if ch == ":" and nxt == ":":
+            i += 2
+            tokens.append(Token("op", "::", start, i))
+            continue
+        if ch in _PUNCT:
+            i += 1
+            tokens.append(Token("punct", ch, start, i))
+            continue
+        if ch in _OP_CHARS:
+            # '%%' is psycopg2's escaped '%': keep the pair together so '%%s' is
+            # never mistaken for a placeholder.
+            i += 2 if sql.startswith("%%", i) else 1
+            while (
+                i < n and sql[i] in _OP_CHARS
+                and not sql.startswith("--", i) and not sql.startswith("/*", i)
+                and not (sql[i] == "%" and sql[i + 1:i + 2] in ("s", "("))
+            ):
+                i += 2 if sql.startswith("%%", i) else 1
+            tokens.append(Token("op", sql[start:i], start, i))
+            continue
+        raise SqlValidationError(f"Unexpected character {ch!r} in SQL query.")
+    return tokens
+
+
+# Keywords that may never appear as bare words in a read-only query. Non-SELECT
+# statement types are already rejected by the statement-type check; these catch
+# data-modifying CTEs, SELECT ... INTO and row-locking clauses.
+_FORBIDDEN = frozenset({"insert", "update", "delete", "merge", "truncate", "into"})
+
+# Functions whose argument syntax uses FROM (EXTRACT(field FROM x),
+# SUBSTRING(s FROM n FOR m), TRIM(BOTH c FROM s), OVERLAY(s PLACING t FROM n)).
+# POSITION(a IN b) is listed for completeness. Inside their parentheses FROM
+# does not start a relation list, unless a SELECT appears there first.
+_FROM_SYNTAX_FUNCTIONS = frozenset({"extract", "substring", "trim", "position", "overlay"})
+
+# Words that end a FROM clause at the current nesting level.
+_FROM_TERMINATORS = frozenset({
+    "where", "group", "having", "order", "limit", "offset", "window", "union",
+    "intersect", "except", "fetch", "for", "returning",
+})
+
+
+class SqlAnalysis(NamedTuple):
+    sql: str                                   # cleaned text (trailing ';' removed)
+    statement_type: str                        # e.g. "select"
+    relations: Tuple[Tuple[Optional[str], str], ...]  # (schema or None, name)
+    ctes: FrozenSet[str]
+    schemas: FrozenSet[str]                    # schemas of qualified relations
+
+
+def _ident(tok: Token) -> Optional[str]:
+    if tok.kind == "word":
+        return tok.value
+    if tok.kind == "qident":
+        return tok.value
+    return None
+
+
+def _strip_statement(tokens: List[Token]) -> List[Token]:
+    """Drop trailing semicolons; reject anything after an inner one."""
+    while tokens and tokens[-1].kind == "punct" and tokens[-1].value == ";":
+        tokens = tokens[:-1]
+    for tok in tokens:
+        if tok.kind == "punct" and tok.value == ";":
+            raise SqlValidationError("Only a single SQL statement is allowed.")
+    return tokens
+
+
+def _main_statement_type(tokens: List[Token]) -> Tuple[str, FrozenSet[str]]:
+    """Return the main statement keyword (skipping WITH ... AS (...), ...) and the CTE names."""
+    i = 0
+    n = len(tokens)
+    while i < n and tokens[i].kind == "punct" and tokens[i].value == "(":
+        i += 1
+    if i >= n:
+        raise SqlValidationError("Empty SQL query.")
+    ctes = set()
+    if tokens[i].kind == "word" and tokens[i].value == "with":
+        i += 1
+        if i < n and tokens[i].kind == "word" and tokens[i].value == "recursive":
+            i += 1
+        while True:
+            name = _ident(tokens[i]) if i < n else None
+            if name is None:
+                raise SqlValidationError("Malformed WITH clause.")
+            ctes.add(name)
+            i += 1
+            # Skip an optional column list and AS [NOT] MATERIALIZED, then the body.
+            while i < n and not (tokens[i].kind == "punct" and tokens[i].value == "(" and
+                                 tokens[i - 1].kind == "word" and tokens[i - 1].value in ("as", "materialized")):
+                i += 1
+            if i >= n:
+                raise SqlValidationError("Malformed WITH clause.")
+            depth = 0
+            while i < n:
+                tok = tokens[i]
+                if tok.kind == "punct" and tok.value == "(":
+                    depth += 1
+                elif tok.kind == "punct" and tok.value == ")":
+                    depth -= 1
+                    if depth == 0:
+                        i += 1
+                        break
+                i += 1
+            if depth:
+                raise SqlValidationError("Unbalanced parentheses in SQL query.")
+            if i < n and tokens[i].kind == "punct" and tokens[i].value == ",":
+                i += 1
+                continue
+            break
+        while i < n and tokens[i].kind == "punct" and tokens[i].value == "(":
+            i += 1
+    if i >= n or tokens[i].kind != "word":
+        raise SqlValidationError("Only SELECT statements are allowed.")
+    return tokens[i].value, frozenset(ctes)
+
+
+def _relations(tokens: List[Token]) -> List[Tuple[Optional[str], str]]:
+    """
+    Collect relation references that follow FROM/JOIN (and commas in a FROM
+    list) or TABLE. Schema-qualified functions called in FROM are included
+    too; unqualified ones (unnest, generate_series, ...) are not.
+    """
+    found: List[Tuple[Optional[str], str]] = []
+    # Per paren level: (FROM is function-argument syntax, in_from_clause)
+    frames: List[List[bool]] = [[False, False]]
+    expect = False
+    n = len(tokens)
+    i = 0
+    while i < n:
+        tok = tokens[i]
+        frame = frames[-1]
+        if tok.kind == "punct" and tok.value == "(":
+            prev = tokens[i - 1] if i else None
+            from_syntax = bool(prev and prev.kind == "word" and prev.value in _FROM_SYNTAX_FUNCTIONS)
+            # FROM (a JOIN b ...) / CROSS JOIN (x): the relation list goes on inside.
+            frames.append([from_syntax, expect])
+            i += 1
+            continue
+        if tok.kind == "punct" and tok.value == ")":
+            if len(frames) == 1:
+                raise SqlValidationError("Unbalanced parentheses in SQL query.")
+            frames.pop()
+            expect = False
+            i += 1
+            continue
+        if frame[0]:
+            # FROM here is EXTRACT/SUBSTRING/TRIM/OVERLAY syntax, but a SELECT
+            # (e.g. a subquery written without its own parentheses) ends that.
+            if tok.kind == "word" and tok.value == "select":
+                frame[0] = False
+            else:
+                i += 1
+                continue
+        if tok.kind == "word":
+            if tok.value == "table":
+                # TABLE x is SELECT * FROM x (a UNION branch, IN (TABLE x), ...).
+                expect = True
+                i += 1
+                continue
+            if tok.value in ("from", "join"):
+                frame[1] = True
+                expect = True
+                i += 1
+                continue
+            if tok.value in _FROM_TERMINATORS or tok.value == "select":
+                frame[1] = False
+                expect = False
+                i += 1
+                continue
+            if expect and tok.value in ("only", "lateral"):
+                i += 1
+                continue
+            if expect and tok.value == "values":
+                expect = False
+                i += 1
+                continue
+        if tok.kind == "punct" and tok.value == "," and frame[1]:
+            expect = True
+            i += 1
+            continue
+        if expect:
+            expect = False
+            name = _ident(tok)
+            if name is not None:
+                parts = [name]
+                j = i + 1
+                while j + 1 < n and tokens[j].kind == "punct" and tokens[j].value == "." and _ident(tokens[j + 1]) is not None:
+                    parts.append(_ident(tokens[j + 1]))
+                    j += 2
+                schema = parts[-2] if len(parts) >= 2 else None
+                if j < n and tokens[j].kind == "punct" and tokens[j].value == "(":
+                    # Set-returning function in FROM: only its schema matters.
+                    if schema is not None:
+                        found.append((schema, parts[-1]))
+                    i = j
+                    continue
+                found.append((schema, parts[-1]))
+                i = j
+                continue
+        i += 1
+    if len(frames) != 1:
+        raise SqlValidationError("Unbalanced parentheses in SQL query.")
+    return found
+
+
+def _follows(tokens: List[Token], index: int, *sequences: Tuple[str, ...]) -> bool:
+    """Whether the words right before tokens[index] are one of `sequences`."""
+    for words in sequences:
+        if index >= len(words) and all(
+            tok.kind == "word" and tok.value == word
+            for tok, word in zip(tokens[index - len(words):index], words)
+        ):
+            return True
+    return False
+
+
+def analyze(sql_query: str) -> SqlAnalysis:
+    """Tokenize and analyze one statement. Raises SqlValidationError on rejection."""
+    if not isinstance(sql_query, str):
+        raise SqlValidationError("SQL query must be a string.")
+    sql_clean = sql_query.strip().rstrip(";").rstrip()
+    tokens = _strip_statement(tokenize(sql_clean))
+    statement_type, ctes = _main_statement_type(tokens)
+    for index, tok in enumerate(tokens):
+        if tok.kind == "word" and tok.value in _FORBIDDEN:
+            raise SqlValidationError("Only read-only SELECT statements are allowed.")
+        if tok.kind == "word" and tok.value == "share" and _follows(tokens, index, ("for",), ("for", "key")):
+            # FOR SHARE / FOR KEY SHARE (FOR [NO KEY] UPDATE is caught by "update").
+            raise SqlValidationError("Only read-only SELECT statements are allowed.")
+    relations = tuple(_relations(tokens))
+    schemas = frozenset(schema for schema, _ in relations if schema is not None)
+    return SqlAnalysis(sql_clean, statement_type, relations, ctes, schemas)
+
+
+_VERDICT_CACHE_SIZE = 4096
+_verdicts: "OrderedDict[str, object]" = OrderedDict()
+_verdicts_lock = threading.Lock()
+
+
+def _lru_get(cache: "OrderedDict[Any, Any]", key: Any) -> Any:
+    """Cached value or None; caller holds the cache's lock."""
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _lru_put(cache: "OrderedDict[Any, Any]", key: Any, value: Any) -> None:
+    """Store a value, evicting the least recently used; caller holds the cache's lock."""
+    cache[key] = value
+    if len(cache) > _VERDICT_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def analyze_cached(sql_query: str) -> SqlAnalysis:
+    """analyze() with an LRU of verdicts keyed by the query text."""
+    if not isinstance(sql_query, str):
+        raise SqlValidationError("SQL query must be a string.")
+    with _verdicts_lock:
+        verdict = _lru_get(_verdicts, sql_query)
+    if verdict is None:
+        try:
+            verdict = analyze(sql_query)
+        except SqlValidationError as e:
+            verdict = e
+        with _verdicts_lock:
+            _lru_put(_verdicts, sql_query, verdict)
+    if isinstance(verdict, SqlValidationError):
+        raise SqlValidationError(*verdict.args)
+    return verdict  # type: ignore[return-value]
+
+
+def validate_select(sql_query: str, allowed_schemas: Iterable[str], schema_error: str) -> SqlAnalysis:
+    """
+    Accept only a single read-only SELECT (optionally WITH-prefixed) whose every
+    relation is a CTE or lives in one of `allowed_schemas`, and which references
+    at least one such schema. `schema_error` is the message used on rejection.
+    """
+    analysis = analyze_cached(sql_query)
+    if analysis.statement_type != "select":
+        raise SqlValidationError("Only SELECT statements are allowed.")
+    allowed = frozenset(allowed_schemas)
+    for schema, name in analysis.relations:
+        if schema is None:
+            if name in analysis.ctes:
+                continue
+            raise SqlValidationError(schema_error)
+        if schema not in allowed:
+            raise SqlValidationError(schema_error)
+    if not analysis.schemas:
+        raise SqlValidationError(schema_error)
+    return analysis
+
+
+def bind_params(sql_query: str, params: Any = None) -> Tuple[str, List[Any]]:
+    """
+    Normalize a query and its params to psycopg2's positional form.
+
+    Returns (text, args) where every bind is `%s`, args is the matching list,
+    and every literal '%' in the text is doubled, so wrappers can splice the
+    text into larger statements and append their own `%s` args. Accepts
+    `%s` placeholders with a list/tuple, or `%(name)s` with a dict.
+    """
+    if params is None:
+        return sql_query.replace("%", "%%"), []
+    if isinstance(params, dict):
+        named = True
+    elif isinstance(params, (list, tuple)):
+        named = False
+    else:
+        raise SqlValidationError("params must be a list (for %s) or an object (for %(name)s).")
+
+    out: List[str] = []
+    args: List[Any] = []
+    pos = 0
+
+    def literal(segment: str) -> None:
+        if "%" in segment.replace("%%", ""):
+            raise SqlValidationError("Escape literal '%' as '%%' in queries with params.")
+        out.append(segment)
+
+    for tok in tokenize(sql_query):
+        if tok.kind != "placeholder":
+            continue
+        literal(sql_query[pos:tok.start])
+        pos = tok.end
+        if tok.value == "%s":
+            if named:
+                raise SqlValidationError("Use %(name)s placeholders with object params.")
+            if len(args) >= len(params):
+                raise SqlValidationError("Not enough params for the %s placeholders in the query.")
+            args.append(params[len(args)])
+        else:
+            if not named:
+                raise SqlValidationError("Use %s placeholders with list params.")
+            name = tok.value[2:-2]
+            if name not in params:
+                raise SqlValidationError(f"Missing param {name!r}.")
+            args.append(params[name])
+        out.append("%s")
+    literal(sql_query[pos:])
+    if not named and len(args) != len(params):
+        raise SqlValidationError("Too many params for the %s placeholders in the query.")
+    return "".join(out), args
+
+
+def to_dollar_params(text: str) -> str:
+    """
+    Turn a bind_params() text into server-side form for PREPARE: the n-th `%s`
+    becomes `$n` and '%%' becomes '%'.
+    """
+    out: List[str] = []
+    n = 0
+    i = 0
+    while True:
+        j = text.find("%", i)
+        if j < 0:
+            out.append(text[i:])
+            return "".join(out)
+        out.append(text[i:j])
+        nxt = text[j + 1:j + 2]
+        if nxt == "s":
+            n += 1
+            out.append(f"${n}")
+        elif nxt == "%":
+            out.append("%")
+        else:
+            raise SqlValidationError("Unescaped '%' in parameterized query text.")
+        i = j + 2
+
+
+# --- literal parameterization ----------------------------------------------
+
+_COMPARISON_OPS = frozenset({"=", "<>", "!=", "<", ">", "<=", ">="})
+# Tokens that may follow a lifted literal: the literal must be a complete operand.
+_LITERAL_END_WORDS = frozenset({
+    "and", "or", "then", "else", "end", "when", "order", "group", "having",
+    "limit", "offset", "union", "intersect", "except", "window",
+})
+_INT4_MAX = 2 ** 31 - 1
+_INT8_MAX = 2 ** 63 - 1
+
+
+# Queries with these words have Postgres match expressions textually across
+# clauses (GROUP BY against the select list/HAVING/ORDER BY, DISTINCT against
+# ORDER BY). Two copies of `x = 1` would become different parameters and no
+# longer match ("must appear in the GROUP BY clause"), so in such queries
+# only LIMIT/OFFSET values, which are never matched, are lifted.
+_EXPRESSION_MATCHING_WORDS = frozenset({"group", "distinct"})
+
+
+def _lift_literal(tokens: List[Token], i: int, matching: bool = False) -> Optional[Tuple[Any, str]]:
+    """
+    (value, cast) if tokens[i] is a literal that can become a bind parameter
+    without changing the query's meaning, else None.
+
+    Only literals that are a whole operand of a comparison, LIKE/ILIKE, or
+    LIMIT/OFFSET qualify (never ORDER BY/GROUP BY ordinals or function args),
+    and numbers keep the type Postgres gives the literal through an explicit
+    cast. Plain '...' strings are untyped literals in Postgres and untyped
+    parameters resolve the same way, so they stay uncast. With `matching`
+    (see _EXPRESSION_MATCHING_WORDS) only LIMIT/OFFSET qualify.
+    """
+    tok = tokens[i]
+    if tok.kind == "number":
+        if tok.value.isdigit():
+            value: Any = int(tok.value)
+            cast = "::int4" if value <= _INT4_MAX else "::int8" if value <= _INT8_MAX else "::numeric"
+        else:
+            value, cast = decimal.Decimal(tok.value), "::numeric"
+    elif tok.kind == "string" and tok.value.startswith("'"):
+        # Text is in bind_params() form, so '%' inside the literal is doubled.
+        value, cast = tok.value[1:-1].replace("''", "'").replace("%%", "%"), ""
+    else:
+        return None
+
+    prev = tokens[i - 1] if i else None
+    if prev is None:
+        return None
+    if prev.kind == "op" and prev.value in _COMPARISON_OPS and not matching:
+        pass
+    elif prev.kind == "word" and prev.value in ("like", "ilike") and not matching:
+        pass
+    elif prev.kind == "word" and prev.value in ("limit", "offset") and tok.kind == "number":
+        pass
+    else:
+        return None
+
+    nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+    if nxt is None or (nxt.kind == "punct" and nxt.value in (")", ",", ";")):
+        return value, cast
+    if nxt.kind == "word" and nxt.value in _LITERAL_END_WORDS:
+        return value, cast
+    return None
+
+
+def query_fingerprint(text: str) -> str:
+    """Stable 16-hex-digit id of a query shape (whitespace-insensitive)."""
+    return hashlib.sha256(normalize_sql(text).encode("utf-8")).hexdigest()[:16]
+
+
+class _Rewrite(NamedTuple):
+    text: str
+    # Per placeholder of `text`: None for the next caller-supplied arg, else
+    # a 1-tuple holding the lifted literal's value.
+    layout: Tuple[Optional[Tuple[Any]], ...]
+    fingerprint: str
+
+
+_rewrites: "OrderedDict[Tuple[str, int], _Rewrite]" = OrderedDict()
+_rewrites_lock = threading.Lock()
+
+
+def _rewrite(text: str, arg_count: int) -> _Rewrite:
+    try:
+        tokens = tokenize(text)
+    except SqlValidationError:
+        return _Rewrite(text, (None,) * arg_count, query_fingerprint(text))
+    if sum(1 for t in tokens if t.kind == "placeholder") != arg_count:
+        return _Rewrite(text, (None,) * arg_count, query_fingerprint(text))
+
+    matching = any(t.kind == "word" and t.value in _EXPRESSION_MATCHING_WORDS for t in tokens)
+    out: List[str] = []
+    layout: List[Optional[Tuple[Any]]] = []
+    pos = 0
+    for i, tok in enumerate(tokens):
+        if tok.kind == "placeholder":
+            layout.append(None)
+            continue
+        lifted = _lift_literal(tokens, i, matching)
+        if lifted is None:
+            continue
+        value, cast = lifted
+        out.append(text[pos:tok.start])
+        out.append("%s" + cast)
+        pos = tok.end
+        layout.append((value,))
+    out.append(text[pos:])
+    lifted_text = "".join(out)
+    return _Rewrite(lifted_text, tuple(layout), query_fingerprint(lifted_text))
+
+
+def parameterize(text: str, args: List[Any]) -> Tuple[str, List[Any], str]:
+    """
+    Lift safe literals out of a bind_params() text into bind parameters.
+
+    `WHERE id = 17` and `WHERE id = 42` both become `WHERE id = %s::int4`,
+    so they share one prepared statement and one fingerprint. Returns
+    (text, args, fingerprint); the text is returned unchanged whenever it
+    cannot be rewritten with certainty. Rewrites are kept in an LRU keyed by
+    the text, like analyze_cached's verdicts, so a repeated query is not
+    tokenized again; only its args are laid out afresh.
+    """
+    key = (text, len(args))
+    with _rewrites_lock:
+        rewrite = _lru_get(_rewrites, key)
+    if rewrite is None:
+        rewrite = _rewrite(text, len(args))
+        with _rewrites_lock:
+            _lru_put(_rewrites, key, rewrite)
+    given = iter(args)
+    new_args = [next(given) if slot is None else slot[0] for slot in rewrite.layout]
+    return rewrite.text, new_args, rewrite.fingerprint
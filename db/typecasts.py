@@ -0,0 +1,66 @@
+"""
+Per-role result typecasting profiles.
+
+By default psycopg2 builds a Decimal for every NUMERIC and a datetime/date/time
+for every temporal value, only for the JSON encoder to turn them back into
+numbers and strings. A profile (mcp_config.yaml `permissions[].typecasts`)
+replaces those conversions on a role's pooled connections:
+
+  numeric:  decimal (default, exact) | float | text (wire form, e.g. "1234.50")
+            float is opt-in and lossy: integral values come out as N.0 and
+            anything beyond 2^53 (e.g. numeric(20,0) keys) is rounded
+  temporal: native (default) | text (wire form, e.g. "2024-01-31 12:00:00+00")
+  uuid:     text (psycopg2's default) | native (uuid.UUID objects)
+
+The replacement casters are psycopg2's own C typecasters (FLOAT, UNICODE)
+registered for the extra OIDs, so no Python code runs per value. Array
+columns of those types are covered too. Registration happens once per
+physical connection, from the pool's configure hook.
+"""
+from typing import Any, Callable, List, Optional
+
+from psycopg2 import extensions, extras
+
+from db.config import RoleTypecasts
+
+NUMERIC_OIDS = (1700,)
+NUMERIC_ARRAY_OIDS = (1231,)
+# date, time, timestamp, timestamptz, interval, timetz
+TEMPORAL_OIDS = (1082, 1083, 1114, 1184, 1186, 1266)
+TEMPORAL_ARRAY_OIDS = (1182, 1183, 1115, 1185, 1187, 1270)
+
+NUMERIC_AS_FLOAT = extensions.new_type(NUMERIC_OIDS, "NUMERIC_AS_FLOAT", extensions.FLOAT)
+NUMERIC_AS_TEXT = extensions.new_type(NUMERIC_OIDS, "NUMERIC_AS_TEXT", extensions.UNICODE)
+TEMPORAL_AS_TEXT = extensions.new_type(TEMPORAL_OIDS, "TEMPORAL_AS_TEXT", extensions.UNICODE)
+
+NUMERIC_ARRAY_AS_FLOAT = extensions.new_array_type(NUMERIC_ARRAY_OIDS, "NUMERIC_ARRAY_AS_FLOAT", NUMERIC_AS_FLOAT)
+NUMERIC_ARRAY_AS_TEXT = extensions.new_array_type(NUMERIC_ARRAY_OIDS, "NUMERIC_ARRAY_AS_TEXT", NUMERIC_AS_TEXT)
+TEMPORAL_ARRAY_AS_TEXT = extensions.new_array_type(TEMPORAL_ARRAY_OIDS, "TEMPORAL_ARRAY_AS_TEXT", TEMPORAL_AS_TEXT)
+
+
+def casters_for(profile: RoleTypecasts) -> List[Any]:
+    """Typecasters to register for a profile (empty for the defaults)."""
+    casters: List[Any] = []
+    if profile.numeric == "float":
+        casters += [NUMERIC_AS_FLOAT, NUMERIC_ARRAY_AS_FLOAT]
+    elif profile.numeric == "text":
+        casters += [NUMERIC_AS_TEXT, NUMERIC_ARRAY_AS_TEXT]
+    if profile.temporal == "text":
+        casters += [TEMPORAL_AS_TEXT, TEMPORAL_ARRAY_AS_TEXT]
+    return casters
+
+
+def typecast_setup(profile: RoleTypecasts) -> Optional[Callable[[Any], None]]:
+    """A per-connection registration hook for `profile`, or None if it changes nothing."""
+    casters = casters_for(profile)
+    native_uuid = profile.uuid == "native"
+    if not casters and not native_uuid:
+        return None
+
+    def register(raw: Any) -> None:
+        for caster in casters:
+            extensions.register_type(caster, raw)
+        if native_uuid:
+            extras.register_uuid(conn_or_curs=raw)
+
+    return register
@@ -1,12 +1,17 @@
-import re
+import asyncio
 import os
 import logging
-from typing import Any, Dict
-from fastapi import FastAPI, Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
+import signal
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+from fastapi import FastAPI, Request, HTTPException, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 import uvicorn
 
+from db import metrics
+from middleware import RequestPipelineMiddleware
+
 # load local .env for development; on Heroku/Prod use Config Vars instead
 load_dotenv()
 
@@ -21,40 +26,96 @@ if not logger.handlers:
     handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
     logger.addHandler(handler)
 
-# keys from environment (set these in Heroku Config Vars or your environment)
-ADMIN_KEY = os.getenv("ADMIN_API_KEY")
-USER_KEY = os.getenv("USER_API_KEY")
-
-
 def mask_key(value: str) -> str:
     if not value:
         return "<missing>"
     return f"****{value[-4:]}"
 
 
-def check_auth(request: Request, required_key: str, role_name: str):
-    auth_header = request.headers.get("Authorization")
-    if auth_header != f"Bearer {required_key}":
+def _authenticate(role_name: str, authorization: Optional[bytes]) -> Any:
+    """Auth pre-check run by the request pipeline, before routing: the ApiKey, or None."""
+    from db.api_keys import lookup
+
+    key = lookup(authorization)
+    if key is None or key.role != role_name:
+        return None
+    return key
+
+
+def check_auth(request: Request, role_name: str):
+    # Normally already verified by RequestPipelineMiddleware.
+    key = request.scope.get("state", {}).get("principal")
+    if key is None:
+        auth_header = request.headers.get("Authorization")
+        key = _authenticate(role_name, auth_header.encode("latin-1") if auth_header else None)
+    if key is None or key.role != role_name:
         raise HTTPException(status_code=403, detail=f"Invalid {role_name} API key")
     return role_name
 
 
-class NormalizePathMiddleware(BaseHTTPMiddleware):
-    """
-    Collapse multiple consecutive slashes in the request path into a single slash.
-    Example: //admin/query -> /admin/query
-    """
-    async def dispatch(self, request: Request, call_next):
-        path = request.scope.get("path", "")
-        normalized = re.sub(r"/{2,}", "/", path)
-        if normalized != path:
-            client = request.client.host if request.client else "<unknown>"
-            logger.info("Normalized path: %s -> %s from %s", path, normalized, client)
-            request.scope["path"] = normalized
-        return await call_next(request)
+def _check_key_scope(request: Request, sql: str) -> None:
+    """Reject queries touching schemas outside the API key's `schemas` scope (unscoped keys skip this)."""
+    key = request.scope.get("state", {}).get("principal")
+    if key is None or key.schemas is None:
+        return
+    from db.sql_validator import SqlValidationError, analyze_cached
+
+    try:
+        analysis = analyze_cached(sql)
+    except SqlValidationError:
+        return  # rejected by the regular validation
+    outside = sorted({schema for schema, _ in analysis.relations if schema} - set(key.schemas))
+    if outside:
+        raise HTTPException(
+            status_code=403,
+            detail=f"API key '{key.name}' may not query schema(s): {', '.join(outside)}",
+        )
+
+
+def _admit(key: Any) -> Any:
+    from db.admission import admit
+    return admit(key)
 
 
-app.add_middleware(NormalizePathMiddleware)
+app.add_middleware(
+    RequestPipelineMiddleware,
+    authenticate=_authenticate,
+    protected=(("/user/", "user"), ("/admin/", "admin")),
+    admit=_admit,
+    admitted=("/user/query", "/admin/query", "/user/batch", "/admin/batch"),
+)
+
+
+@app.on_event("startup")
+async def startup():
+    from db.admission import open_admission
+    from db.api_keys import reload_api_keys
+    from db.health import get_prober
+    reload_api_keys()
+    get_prober()
+    try:
+        open_admission()
+    except OSError:
+        logger.exception("Admission state file unavailable; retrying on first admitted request")
+    try:
+        # Rotate keys with `kill -HUP <worker pid>`; without a handler SIGHUP would kill the worker.
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_api_keys)
+    except (NotImplementedError, RuntimeError):
+        logger.warning("SIGHUP key reload unavailable on this platform")
+
+
+@app.on_event("shutdown")
+def shutdown():
+    from db.async_engine import shutdown_executor
+    from db.catalog import stop_catalogs
+    from db.connection import close_pools
+    from db.health import stop_prober
+    from db.slow_log import stop_slow_log
+    stop_prober()
+    stop_catalogs()
+    stop_slow_log()
+    shutdown_executor(wait=False)
+    close_pools()
 
 
 @app.get("/")
@@ -65,24 +126,31 @@ async def root():
 @app.get("/health")
 async def health():
     """
-    Lightweight health check. Attempts a minimal DB connection check if db.connection.get_connection exists.
-    The DB check is best-effort: errors are included in the response but do not raise a server exception.
+    Liveness check. Answers from the background prober's cached state (see
+    db/health.py) and never touches the database itself, so it stays cheap no
+    matter how often the load balancer calls it. Always 200 while the process
+    serves requests; DB problems are reported in the body.
     """
-    db_status: Dict[str, Any] = {"connected": False}
-    try:
-        # import lazily to avoid import-time DB work when not needed
-        from db.connection import get_connection  # type: ignore
-        conn = get_connection()
-        with conn.cursor() as cur:
-            cur.execute("SELECT 1;")
-            cur.fetchone()
-        conn.close()
-        db_status["connected"] = True
-    except Exception as e:
-        logger.exception("Database health check failed")
-        # include a short error message for debugging, avoid leaking credentials
-        db_status["error"] = str(e).splitlines()[0][:200]
-    return {"status": "ok", "db": db_status}
+    from db.health import get_prober
+    prober = get_prober()
+    return {"status": "ok", "db": prober.state(), "prober_alive": prober.alive()}
+
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness check: 200 when the last DB probe is recent, succeeded and the
+    connection pools have headroom, 503 otherwise.
+    """
+    from db.encoding import encode
+    from db.health import get_prober
+    prober = get_prober()
+    is_ready, reason = prober.readiness()
+    return Response(
+        content=encode({"status": "ready" if is_ready else "unavailable", "reason": reason, "db": prober.state()}),
+        status_code=200 if is_ready else 503,
+        media_type="application/json",
+    )
 
 
 async def _parse_json_body(request: Request) -> Dict[str, Any]:
@@ -98,55 +166,491 @@ async def _parse_json_body(request: Request) -> Dict[str, Any]:
 
 
 def _log_request_for_debug(request: Request, data: Dict[str, Any]):
-    auth = request.headers.get("Authorization", "")
-    masked = mask_key(auth.replace("Bearer ", ""))
+    key = request.scope.get("state", {}).get("principal")
+    if key is not None:
+        auth = key.name
+    else:
+        auth = mask_key(request.headers.get("Authorization", "").replace("Bearer ", ""))
     client = request.client.host if request.client else "<unknown>"
-    logger.info("Request %s %s from %s auth=%s has_sql=%s",
-                request.method, request.url.path, client, masked, "sql" in data)
+    logger.info("Request %s %s from %s key=%s has_sql=%s",
+                request.method, request.url.path, client, auth, "sql" in data)
 
 
-# Routes
-@app.post("/user/query")
-async def user_query(request: Request):
-    role = check_auth(request, USER_KEY, "user")
-    data = await _parse_json_body(request)
-    _log_request_for_debug(request, data)
+def _optional_int(data: Dict[str, Any], name: str) -> Any:
+    value = data.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise HTTPException(status_code=400, detail=f"'{name}' must be a positive integer")
+    return value
+
+
+_FORMATS = {
+    "json": "json", "columnar": "columnar", "compact": "columnar",
+    "arrow": "arrow", "parquet": "parquet", "csv": "csv",
+}
+# Binary columnar formats; always streamed from a server-side cursor.
+_ARROW_FORMATS = ("arrow", "parquet")
+_ARROW_BATCH_SIZE = 10000
+
+
+def _result_format(data: Dict[str, Any]) -> str:
+    """
+    Response layout: "json" (row objects, default), "columnar" (alias "compact"),
+    the binary "arrow" (IPC stream) / "parquet" formats, or "csv" (COPY export).
+    """
+    fmt = data.get("format", "json")
+    if fmt not in _FORMATS:
+        raise HTTPException(status_code=400, detail="'format' must be one of: " + ", ".join(_FORMATS))
+    return _FORMATS[fmt]
+
+
+def _wants_stream(request: Request, data: Dict[str, Any]) -> bool:
+    return bool(data.get("stream")) or "application/x-ndjson" in request.headers.get("Accept", "")
+
+
+# Clients that list this media type in Accept get Postgres-rendered JSON: the
+# database builds the results array (json_agg) and it is passed through as-is.
+PG_JSON_MEDIA_TYPE = "application/vnd.pgjson+json"
+
+
+def _wants_pg_json(request: Request) -> bool:
+    return PG_JSON_MEDIA_TYPE in request.headers.get("Accept", "")
+
+
+def _stream_response(request: Request, stream, role: str, fmt: str = "json") -> StreamingResponse:
+    """
+    Stream an open QueryStream to the client batch by batch.
+
+    NDJSON (one row object per line) when the client accepts application/x-ndjson,
+    otherwise the usual {"status", "results", "rows", "role"} document written as
+    chunked JSON (with "columns" and array rows for the columnar format). Each batch
+    is fetched on the DB executor, so the event loop never blocks and only one batch
+    is held in memory at a time.
+    """
+    from db.async_engine import run_sync
+    from db.encoding import dumps, json_array_items, json_array_rows, ndjson_lines
+
+    ndjson = "application/x-ndjson" in request.headers.get("Accept", "")
+    columns = stream.columns
+
+    def encode(batch, first: bool) -> bytes:
+        if ndjson:
+            return ndjson_lines(columns, batch)
+        if fmt == "columnar":
+            return json_array_rows(batch, first)
+        return json_array_items(columns, batch, first)
+
+    async def body() -> AsyncIterator[bytes]:
+        sent = 0
+        try:
+            if not ndjson:
+                head = '{"status":"success","role":' + dumps(role)
+                if fmt == "columnar":
+                    head += ',"columns":' + dumps(columns)
+                chunk = (head + ',"results":[').encode("utf-8")
+                sent += len(chunk)
+                yield chunk
+            first = True
+            while True:
+                batch = await run_sync(stream.fetch_batch)
+                if not batch:
+                    break
+                with metrics.stage("serialize", role):
+                    chunk = encode(batch, first)
+                sent += len(chunk)
+                yield chunk
+                first = False
+            if not ndjson:
+                tail = '],"rows":' + str(stream.row_count)
+                if stream.truncated:
+                    tail += ',"truncated":true'
+                chunk = (tail + "}").encode("utf-8")
+            elif stream.truncated:
+                # NDJSON has no envelope: a final marker line tells the client it was cut off.
+                chunk = b'{"truncated":true}\n'
+            else:
+                chunk = b""
+            if chunk:
+                sent += len(chunk)
+                yield chunk
+        except Exception as e:
+            # Headers are already sent; all we can do is log and cut the stream short.
+            metrics.ERRORS.inc(role, type(e).__name__)
+            logger.exception("streaming %s query failed", role)
+        finally:
+            metrics.RESULT_ROWS.observe(stream.row_count, role)
+            metrics.RESPONSE_BYTES.observe(sent, role)
+            # Shielded so a client disconnect (cancellation) still returns the connection.
+            await asyncio.shield(run_sync(stream.close))
 
-    sql = data.get("sql")
-    if not sql:
-        raise HTTPException(status_code=400, detail="Missing 'sql' in request JSON")
+    media_type = "application/x-ndjson" if ndjson else "application/json"
+    return StreamingResponse(body(), media_type=media_type)
 
+
+def _arrow_response(stream, role: str, fmt: str) -> StreamingResponse:
+    """
+    Stream an open QueryStream as an Arrow IPC stream or a Parquet file, one
+    record batch / row group per cursor batch. Fetching and columnar encoding
+    both run on the DB executor.
+    """
+    from db.arrow_export import MEDIA_TYPES, ArrowEncoder
+    from db.async_engine import run_sync
+    from db.config import role_typecasts
+
+    async def body() -> AsyncIterator[bytes]:
+        sent = 0
+        try:
+            encoder = ArrowEncoder(fmt, stream.columns, stream.type_codes, role_typecasts(role))
+            while True:
+                batch = await run_sync(stream.fetch_batch)
+                with metrics.stage("serialize", role):
+                    chunk = await run_sync(encoder.encode, batch) if batch else await run_sync(encoder.finish)
+                if chunk:
+                    sent += len(chunk)
+                    yield chunk
+                if not batch:
+                    break
+        except Exception as e:
+            metrics.ERRORS.inc(role, type(e).__name__)
+            logger.exception("streaming %s %s export failed", role, fmt)
+        finally:
+            metrics.RESULT_ROWS.observe(stream.row_count, role)
+            metrics.RESPONSE_BYTES.observe(sent, role)
+            await asyncio.shield(run_sync(stream.close))
+
+    headers = {"Content-Disposition": f'attachment; filename="result.{fmt}"'}
+    if stream.limits.max_rows is not None:
+        # No envelope to flag truncation in: tell the client where the cut-off is.
+        headers["X-Max-Rows"] = str(stream.limits.max_rows)
+    return StreamingResponse(body(), media_type=MEDIA_TYPES[fmt], headers=headers)
+
+
+# CSV chunks (~64 KiB each) allowed to wait between the COPY thread and the client.
+_CSV_QUEUE_CHUNKS = 8
+
+
+async def _csv_response(role: str, sql: str, params: Any) -> StreamingResponse:
+    """
+    Stream `COPY (<query>) TO STDOUT WITH CSV` straight to the client. The COPY
+    runs on its own thread and blocks once _CSV_QUEUE_CHUNKS chunks are waiting,
+    so a slow client slows Postgres down rather than filling memory. The first
+    chunk is awaited before responding so SQL errors still get a proper status.
+    """
+    from db.async_engine import iterate_in_thread, run_sync
+    from db.query_tool import export_csv
+
+    produce = await run_sync(export_csv, role, sql, params)
+    chunks = iterate_in_thread(produce, maxsize=_CSV_QUEUE_CHUNKS)
     try:
-        from db.query_tool import query_company_db  # local import to fail fast if missing
-        results = query_company_db(sql)
-        return {"status": "success", "rows": len(results), "results": results, "role": role}
-    except HTTPException:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
+
+    async def body() -> AsyncIterator[bytes]:
+        sent = len(first)
+        try:
+            yield first
+            async for chunk in chunks:
+                sent += len(chunk)
+                yield chunk
+        except Exception as e:
+            metrics.ERRORS.inc(role, type(e).__name__)
+            logger.exception("streaming %s csv export failed", role)
+        finally:
+            await chunks.aclose()
+            metrics.RESPONSE_BYTES.observe(sent, role)
+
+    return StreamingResponse(body(), media_type="text/csv; charset=utf-8",
+                             headers={"Content-Disposition": 'attachment; filename="result.csv"'})
+
+
+def _use_cache(request: Request, data: Dict[str, Any]) -> bool:
+    """Clients bypass the result cache with "cache": false or Cache-Control: no-cache/no-store."""
+    if data.get("cache") is False:
+        return False
+    cache_control = request.headers.get("Cache-Control", "").lower()
+    return "no-cache" not in cache_control and "no-store" not in cache_control
+
+
+def _cache_ttl(data: Dict[str, Any]) -> Any:
+    value = data.get("cache_ttl")
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise HTTPException(status_code=400, detail="'cache_ttl' must be a non-negative number of seconds")
+    return float(value)
+
+
+def _params(value: Any) -> Any:
+    """Bind params for %s (list) or %(name)s (object) placeholders; None when absent."""
+    if value is not None and not isinstance(value, (list, dict)):
+        raise HTTPException(status_code=400, detail="'params' must be a list or an object")
+    return value
+
+
+def _json_response(body: Dict[str, Any], role: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Encode the response body straight to bytes (row tuples, Decimal, dates, UUID,
+    bytea and arrays included) instead of walking it through jsonable_encoder;
+    done here so its cost and size are measured.
+    """
+    from db.encoding import encode
+
+    with metrics.stage("serialize", role):
+        content = encode(body)
+    metrics.RESPONSE_BYTES.observe(len(content), role)
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+def _pg_json_response(result, role: str, headers: Dict[str, str]) -> Response:
+    """Splice the Postgres-built results array into the usual envelope without re-encoding it."""
+    from db.encoding import encode
+
+    with metrics.stage("serialize", role):
+        content = b"".join((
+            b'{"status":"success","rows":', str(result.rows).encode("ascii"),
+            b',"results":', result.text.encode("utf-8"),
+            b',"truncated":', b"true" if result.truncated else b"false",
+            b',"role":', encode(role), b"}",
+        ))
+    metrics.RESPONSE_BYTES.observe(len(content), role)
+    return Response(content=content, media_type=PG_JSON_MEDIA_TYPE, headers=headers)
+
+
+async def _page_response(role: str, sql: str, data: Dict[str, Any], fmt: str) -> Response:
+    """One keyset page of the query plus an opaque next_page_token (null on the last page)."""
+    from db.query_tool import MAX_PAGE_SIZE, PaginationError, execute_page_async
+
+    limit = _optional_int(data, "limit")
+    page_token = data.get("page_token")
+    order_by = data.get("order_by")
+    if order_by is not None and not (
+        isinstance(order_by, list) and order_by and all(isinstance(c, str) for c in order_by)
+    ):
+        raise HTTPException(status_code=400, detail="'order_by' must be a non-empty list of column names")
+    if page_token is not None and not isinstance(page_token, str):
+        raise HTTPException(status_code=400, detail="'page_token' must be a string")
+
+    try:
+        page, next_token = await execute_page_async(
+            role, sql, limit or MAX_PAGE_SIZE, page_token, order_by, _params(data.get("params"))
+        )
+    except PaginationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    metrics.RESULT_ROWS.observe(len(page), role)
+    body: Dict[str, Any] = {"status": "success", "rows": len(page)}
+    if fmt == "columnar":
+        body.update(columns=page.columns, results=page.rows)
+    else:
+        body["results"] = page.as_dicts()
+    body.update(next_page_token=next_token, role=role)
+    return _json_response(body, role)
+
+
+async def _run_query(request: Request, role: str, data: Dict[str, Any]) -> Response:
+    """Shared body of /user/query and /admin/query once auth and body parsing are done."""
+    try:
+        sql = data.get("sql")
+        if not sql:
+            raise HTTPException(status_code=400, detail="Missing 'sql' in request JSON")
+        _check_key_scope(request, sql)
+
+        from db.async_engine import run_sync
+        from db.query_tool import execute_query_async, stream_admin_db, stream_company_db
+
+        fmt = _result_format(data)
+        params = _params(data.get("params"))
+        if fmt == "csv":
+            if data.get("limit") is not None or data.get("page_token"):
+                raise HTTPException(status_code=400, detail="'limit'/'page_token' cannot be combined with format 'csv'")
+            return await _csv_response(role, sql, params)
+
+        if fmt in _ARROW_FORMATS:
+            from db.arrow_export import ARROW_AVAILABLE
+
+            if not ARROW_AVAILABLE:
+                raise HTTPException(status_code=501, detail=f"format '{fmt}' requires pyarrow on the server")
+            if data.get("limit") is not None or data.get("page_token"):
+                raise HTTPException(status_code=400, detail=f"'limit'/'page_token' cannot be combined with format '{fmt}'")
+            open_stream = stream_company_db if role == "user" else stream_admin_db
+            stream = await run_sync(open_stream, sql, _optional_int(data, "batch_size") or _ARROW_BATCH_SIZE, params)
+            return _arrow_response(stream, role, fmt)
+
+        if data.get("limit") is not None or data.get("page_token"):
+            if _wants_stream(request, data):
+                raise HTTPException(status_code=400, detail="'limit'/'page_token' cannot be combined with streaming")
+            return await _page_response(role, sql, data, fmt)
+
+        if _wants_stream(request, data):
+            open_stream = stream_company_db if role == "user" else stream_admin_db
+            stream = await run_sync(open_stream, sql, _optional_int(data, "batch_size"), params)
+            return _stream_response(request, stream, role, fmt)
+
+        if fmt == "json" and _wants_pg_json(request):
+            from db.query_tool import execute_json_async
+
+            pg_result, cache_status = await execute_json_async(
+                role, sql, params, use_cache=_use_cache(request, data), cache_ttl=_cache_ttl(data)
+            )
+            if pg_result is not None:
+                metrics.RESULT_ROWS.observe(len(pg_result), role)
+                return _pg_json_response(pg_result, role, {"X-Cache": cache_status})
+            # Too large to pass through within the role's byte limit: use the truncating path.
+
+        result, cache_status = await execute_query_async(
+            role, sql, params, use_cache=_use_cache(request, data), cache_ttl=_cache_ttl(data)
+        )
+        metrics.RESULT_ROWS.observe(len(result), role)
+        headers = {"X-Cache": cache_status}
+        if fmt == "columnar":
+            # Column names once, rows straight from the cursor tuples (no per-row dicts).
+            return _json_response({"status": "success", "rows": len(result), "columns": result.columns,
+                                   "results": result.rows, "truncated": result.truncated, "role": role}, role, headers)
+        return _json_response({"status": "success", "rows": len(result), "results": result.as_dicts(),
+                               "truncated": result.truncated, "role": role}, role, headers)
+    except HTTPException as e:
+        metrics.ERRORS.inc(role, f"http_{e.status_code}")
         raise
-    except Exception:
-        logger.exception("user_query failed")
+    except Exception as e:
+        metrics.ERRORS.inc(role, type(e).__name__)
+        logger.exception("%s_query failed", role)
         # Do not leak DB internals to clients
         raise HTTPException(status_code=500, detail="Database error")
 
 
+async def _query_endpoint(request: Request, role_name: str) -> Response:
+    start = time.perf_counter()
+    try:
+        try:
+            with metrics.stage("auth", role_name):
+                role = check_auth(request, role_name)
+            with metrics.stage("parse", role):
+                data = await _parse_json_body(request)
+        except HTTPException as e:
+            metrics.ERRORS.inc(role_name, f"http_{e.status_code}")
+            raise
+        _log_request_for_debug(request, data)
+        return await _run_query(request, role, data)
+    finally:
+        metrics.observe_stage("total", role_name, time.perf_counter() - start)
+
+
+# Routes
+@app.post("/user/query")
+async def user_query(request: Request):
+    return await _query_endpoint(request, "user")
+
+
 @app.post("/admin/query")
 async def admin_query(request: Request):
-    role = check_auth(request, ADMIN_KEY, "admin")
-    data = await _parse_json_body(request)
-    _log_request_for_debug(request, data)
+    return await _query_endpoint(request, "admin")
+
+
+def _batch_item(value: Any) -> Dict[str, Any]:
+    """Per-statement batch outcome; validation/missing-table/limit messages are shown, DB internals are not."""
+    from db.query_tool import BatchLimitError
+    from db.sql_validator import SqlValidationError
 
-    sql = data.get("sql")
-    if not sql:
-        raise HTTPException(status_code=400, detail="Missing 'sql' in request JSON")
+    if isinstance(value, Exception):
+        detail = value.args[0] if value.args else str(value)
+        if not (isinstance(value, (SqlValidationError, BatchLimitError)) or isinstance(detail, dict)):
+            detail = "Database error"
+        return {"status": "error", "error": detail}
+    return {"status": "success", "rows": len(value), "columns": value.columns,
+            "results": value.rows, "truncated": value.truncated}
 
+
+async def _batch_endpoint(request: Request, role_name: str) -> Response:
+    """
+    Run {"queries": ["SELECT ...", {"sql": ..., "params": [...]}, ...], "parallel": false}
+    in one read-only snapshot.
+    Each entry in "results" reports its own success or error; rows are columnar.
+    """
+    start = time.perf_counter()
     try:
-        from db.query_tool import query_admin_db  # local import to fail fast if missing
-        results = query_admin_db(sql)
-        return {"status": "success", "rows": len(results), "results": results, "role": role}
-    except HTTPException:
-        raise
-    except Exception:
-        logger.exception("admin_query failed")
-        raise HTTPException(status_code=500, detail="Database error")
+        try:
+            role = check_auth(request, role_name)
+            data = await _parse_json_body(request)
+            queries = data.get("queries")
+            if not isinstance(queries, list) or not queries:
+                raise HTTPException(status_code=400, detail="'queries' must be a non-empty list")
+            sqls = [q.get("sql") if isinstance(q, dict) else q for q in queries]
+            if not all(isinstance(q, str) and q for q in sqls):
+                raise HTTPException(status_code=400, detail="Each query must be a SQL string or {\"sql\": ...}")
+            params = [_params(q.get("params")) if isinstance(q, dict) else None for q in queries]
+            for sql in sqls:
+                _check_key_scope(request, sql)
+        except HTTPException as e:
+            metrics.ERRORS.inc(role_name, f"http_{e.status_code}")
+            raise
+        _log_request_for_debug(request, data)
+
+        from db.query_tool import execute_batch_async
+        try:
+            outcomes = await execute_batch_async(role, sqls, parallel=bool(data.get("parallel")), params=params)
+        except Exception as e:
+            metrics.ERRORS.inc(role, type(e).__name__)
+            logger.exception("%s_batch failed", role)
+            raise HTTPException(status_code=500, detail="Database error")
+        for v in outcomes:
+            if isinstance(v, Exception):
+                metrics.ERRORS.inc(role, type(v).__name__)
+            else:
+                metrics.RESULT_ROWS.observe(len(v), role)
+        items = [_batch_item(v) for v in outcomes]
+        return _json_response({"status": "success", "count": len(items), "results": items, "role": role}, role)
+    finally:
+        metrics.observe_stage("batch_total", role_name, time.perf_counter() - start)
+
+
+@app.post("/user/batch")
+async def user_batch(request: Request):
+    return await _batch_endpoint(request, "user")
+
+
+@app.post("/admin/batch")
+async def admin_batch(request: Request):
+    return await _batch_endpoint(request, "admin")
+
+
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    """Prometheus scrape endpoint. If METRICS_TOKEN is set, requires Authorization: Bearer <token>."""
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        raise HTTPException(status_code=403, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/admin/cache/invalidate")
+async def admin_cache_invalidate(request: Request):
+    """Drop cached results for one schema ({"schema": "finance"}) or everything (empty body)."""
+    check_auth(request, "admin")
+    body = await request.body()
+    data = await _parse_json_body(request) if body.strip() else {}
+    from db.result_cache import result_cache
+    schema = data.get("schema")
+    if schema is None:
+        dropped = result_cache.clear()
+    elif schema in ("company", "finance"):
+        dropped = result_cache.invalidate_schema(schema)
+    else:
+        raise HTTPException(status_code=400, detail="'schema' must be 'company' or 'finance'")
+    return {"status": "success", "invalidated": dropped, "cache": result_cache.stats()}
+
+
+@app.get("/admin/slow-queries")
+async def admin_slow_queries(request: Request, limit: int = 50):
+    """Most recent captured slow-query plans (EXPLAIN FORMAT JSON), newest first."""
+    check_auth(request, "admin")
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="'limit' must be a positive integer")
+    from db.async_engine import run_sync
+    from db.slow_log import SLOW_QUERY_EXPLAIN_SAMPLE_RATE, SLOW_QUERY_THRESHOLD_MS, recent_plans
+    plans = await run_sync(recent_plans, limit)
+    return {"status": "success", "threshold_ms": SLOW_QUERY_THRESHOLD_MS,
+            "sample_rate": SLOW_QUERY_EXPLAIN_SAMPLE_RATE, "count": len(plans), "results": plans}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+"""
+Request pipeline as one pure ASGI middleware.
+
+A single pass over the ASGI scope, before the app sees the request:
+
+  1. path normalization: `//admin//query` -> `/admin/query`
+  2. request id: reuse a sane incoming X-Request-ID or generate one; stored
+     in scope["state"]["request_id"] and echoed as a response header
+  3. auth pre-check for protected prefixes (/user/, /admin/): a request
+     without valid credentials is answered 403 here, before routing, body
+     parsing or any handler runs; the accepted principal is stored in
+     scope["state"]["principal"] for check_auth to pick up
+  4. admission control on query paths (db/admission.py): a key over its
+     rate or in-flight limit is answered 429 with Retry-After; the in-flight
+     lease is held (and renewed as body chunks go out) until the response,
+     streamed or not, is fully sent
+  5. timing: the "request" stage of api_stage_duration_seconds covers the
+     whole exchange, up to the last body chunk of streamed responses
+
+Unlike BaseHTTPMiddleware there is no extra task, no body-stream proxy and no
+Request/Response object per request: `receive` is passed through untouched
+and `send` is only wrapped to stamp the request-id header, so
+streaming responses keep their backpressure.
+
+Config:
+  REQUEST_ID_HEADER   header read and echoed for the request id (default x-request-id)
+"""
+import logging
+import math
+import os
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from db import metrics
+from db.admission import Rejection
+
+logger = logging.getLogger("main")
+
+REQUEST_ID_HEADER = os.getenv("REQUEST_ID_HEADER", "x-request-id").lower().encode("latin-1")
+
+_SLASHES = re.compile(r"/{2,}")
+_VALID_REQUEST_ID = re.compile(rb"[A-Za-z0-9._:-]{1,128}")
+
+# (role, Authorization header value or None) -> principal, or None to reject.
+Authenticator = Callable[[str, Optional[bytes]], Any]
+# principal -> object with release() and renew(), or a db.admission.Rejection.
+Admitter = Callable[[Any], Any]
+
+
+async def _reject(send: Callable, status: int, detail: str, headers: List[Tuple[bytes, bytes]]) -> None:
+    body = b'{"detail":"' + detail.encode("latin-1") + b'"}'
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + headers,
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class RequestPipelineMiddleware:
+    """
+    `protected` maps path prefixes to the role whose credentials they need,
+    e.g. (("/user/", "user"), ("/admin/", "admin")); `admitted` lists the
+    exact paths that go through `admit`.
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        authenticate: Authenticator,
+        protected: Sequence[Tuple[str, str]],
+        admit: Optional[Admitter] = None,
+        admitted: Sequence[str] = (),
+    ):
+        self.app = app
+        self.authenticate = authenticate
+        self.protected = tuple(protected)
+        self.admit = admit
+        self.admitted = frozenset(admitted)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+
+        path = scope["path"]
+        if "//" in path:
+            normalized = _SLASHES.sub("/", path)
+            client = scope.get("client")
+            logger.info("Normalized path: %s -> %s from %s", path, normalized, client[0] if client else "<unknown>")
+            scope["path"] = path = normalized
+
+        request_id = None
+        authorization = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                request_id = value
+            elif name == b"authorization":
+                authorization = value
+        if request_id is None or not _VALID_REQUEST_ID.fullmatch(request_id):
+            request_id = os.urandom(8).hex().encode("ascii")
+        state = scope.setdefault("state", {})
+        state["request_id"] = request_id.decode("ascii")
+
+        role = "public"
+        lease = None
+        for prefix, required in self.protected:
+            if path.startswith(prefix):
+                role = required
+                principal = self.authenticate(required, authorization)
+                if principal is None:
+                    metrics.ERRORS.inc(role, "http_403")
+                    await _reject(send, 403, f"Invalid {role} API key", [(REQUEST_ID_HEADER, request_id)])
+                    metrics.observe_stage("request", role, time.perf_counter() - start)
+                    return
+                state["principal"] = principal
+                if self.admit is not None and path in self.admitted:
+                    lease = self.admit(principal)
+                    if isinstance(lease, Rejection):
+                        metrics.ERRORS.inc(role, "http_429")
+                        metrics.ADMISSION_REJECTIONS.inc(getattr(principal, "name", role), lease.reason)
+                        retry_after = str(max(1, math.ceil(lease.retry_after))).encode("ascii")
+                        await _reject(send, 429, f"Too many requests ({lease.reason} limit)",
+                                      [(b"retry-after", retry_after), (REQUEST_ID_HEADER, request_id)])
+                        metrics.observe_stage("request", role, time.perf_counter() - start)
+                        return
+                break
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", ())) + [(REQUEST_ID_HEADER, request_id)]
+            elif lease is not None:
+                lease.renew()  # cheap until half the lease timeout has passed
+            await send(message)
+
+        try:
+            # Streaming responses return only after their last chunk is sent.
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if lease is not None:
+                lease.release()
+            metrics.observe_stage("request", role, time.perf_counter() - start)
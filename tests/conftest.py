@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from db import connection
+
+# DB-backed tests run against TEST_DATABASE_URL (any throwaway Postgres the
+# connecting user may create schemas in) and are skipped without it.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """A psycopg2 connection to the test database; get_connection() uses it too."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    monkeypatch.setattr(connection, "_dsn_for_role", lambda role=None: TEST_DATABASE_URL)
+    monkeypatch.setattr(connection, "_pools", {})
+    monkeypatch.setenv("DB_POOL_MIN_SIZE", "0")
+    conn = connection.psycopg2.connect(TEST_DATABASE_URL)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("DROP SCHEMA IF EXISTS company CASCADE; CREATE SCHEMA company")
+    yield conn
+    connection.close_pools()
+    with conn.cursor() as cur:
+        cur.execute("DROP SCHEMA company CASCADE")
+    conn.close()
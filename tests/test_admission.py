@@ -0,0 +1,149 @@
+import subprocess
+import sys
+
+import pytest
+
+from db import admission, metrics
+from db.admission import AdmissionTable, Lease, Rejection, _Busy
+from db.api_keys import ApiKey, KeyLimits
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def table(tmp_path):
+    table = AdmissionTable(str(tmp_path / "admission.state"), slots=4)
+    table.open()
+    yield table
+    table.close()
+
+
+def key_id(n):
+    return n.to_bytes(16, "little")
+
+
+def test_token_bucket(table, clock):
+    leases = [table.acquire(key_id(1), rate=2.0, burst=3, max_in_flight=0) for _ in range(3)]
+    assert all(isinstance(lease, Lease) for lease in leases)
+    rejection = table.acquire(key_id(1), rate=2.0, burst=3, max_in_flight=0)
+    assert rejection == Rejection("rate", 0.5)
+    clock.now += 0.5
+    assert isinstance(table.acquire(key_id(1), rate=2.0, burst=3, max_in_flight=0), Lease)
+    # Other keys have their own bucket.
+    assert isinstance(table.acquire(key_id(2), rate=2.0, burst=3, max_in_flight=0), Lease)
+
+
+def test_concurrency_limit_and_release(table, clock):
+    first = table.acquire(key_id(1), rate=0, burst=1, max_in_flight=2)
+    second = table.acquire(key_id(1), rate=0, burst=1, max_in_flight=2)
+    assert table.acquire(key_id(1), rate=0, burst=1, max_in_flight=2).reason == "concurrency"
+    first.release()
+    first.release()  # idempotent
+    third = table.acquire(key_id(1), rate=0, burst=1, max_in_flight=2)
+    assert isinstance(third, Lease)
+    assert table.acquire(key_id(1), rate=0, burst=1, max_in_flight=2).reason == "concurrency"
+    second.release()
+    third.release()
+
+
+def test_unreleased_lease_expires(table, clock):
+    table.acquire(key_id(1), rate=0, burst=1, max_in_flight=1, timeout=60)
+    assert table.acquire(key_id(1), rate=0, burst=1, max_in_flight=1, timeout=60).reason == "concurrency"
+    clock.now += 61
+    assert isinstance(table.acquire(key_id(1), rate=0, burst=1, max_in_flight=1, timeout=60), Lease)
+
+
+def test_renewed_lease_keeps_counting(table, clock):
+    lease = table.acquire(key_id(1), rate=0, burst=1, max_in_flight=1, timeout=60)
+    for _ in range(4):
+        clock.now += 40
+        lease.renew()
+    assert table.acquire(key_id(1), rate=0, burst=1, max_in_flight=1, timeout=60).reason == "concurrency"
+    lease.release()
+    assert isinstance(table.acquire(key_id(1), rate=0, burst=1, max_in_flight=1, timeout=60), Lease)
+
+
+def test_slot_takeover_when_full(table, clock):
+    # Four slots, all owned; only idle ones may be taken over, least recently refilled first.
+    busy = table.acquire(key_id(1), rate=0, burst=1, max_in_flight=1)
+    for n in (2, 3, 4):
+        clock.now += 1
+        table.acquire(key_id(n), rate=1.0, burst=1, max_in_flight=0)
+    clock.now += 1
+    assert isinstance(table.acquire(key_id(5), rate=1.0, burst=1, max_in_flight=0), Lease)
+    owners = {table._map[table._offset(s):table._offset(s) + 16] for s in range(4)}
+    assert key_id(5) in owners and key_id(1) in owners and key_id(2) not in owners
+    busy.release()
+
+
+def test_full_table_without_idle_slots_rejects(table, clock):
+    for n in range(1, 5):
+        table.acquire(key_id(n), rate=0, burst=1, max_in_flight=1)
+    assert table.acquire(key_id(5), rate=0, burst=1, max_in_flight=1).reason == "capacity"
+
+
+def test_state_survives_reopen(table, clock):
+    table.acquire(key_id(1), rate=0, burst=1, max_in_flight=1)
+    other = AdmissionTable(table.path, slots=4)
+    assert other.acquire(key_id(1), rate=0, burst=1, max_in_flight=1).reason == "concurrency"
+    other.close()
+
+
+def hold_lock(path):
+    """Another process locking the whole state file until its stdin closes."""
+    holder = subprocess.Popen([sys.executable, "-c", (
+        "import fcntl, os, sys; fd = os.open(sys.argv[1], os.O_RDWR); "
+        "fcntl.lockf(fd, fcntl.LOCK_EX, 0, 0); print('locked', flush=True); sys.stdin.read()"
+    ), path], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    assert holder.stdout.readline().strip() == "locked"
+    return holder
+
+
+def test_contended_slot_fails_open(table, monkeypatch):
+    holder = hold_lock(table.path)
+    try:
+        with pytest.raises(_Busy):
+            table.acquire(key_id(1), rate=1.0, burst=1, max_in_flight=1)
+        monkeypatch.setattr(admission, "admission_table", table)
+        key = ApiKey("contended", "user", key_id(1) * 2, limits=KeyLimits(rate_per_second=1.0))
+        before = metrics.ADMISSION_CONTENDED.value("contended")
+        assert admission.admit(key) is admission._UNTRACKED
+        assert metrics.ADMISSION_CONTENDED.value("contended") == before + 1
+    finally:
+        holder.communicate("")
+
+
+def test_release_of_contended_slot_completes_later(table):
+    lease = table.acquire(key_id(1), rate=0, burst=1, max_in_flight=1)
+    holder = hold_lock(table.path)
+    lease.release()
+    assert table._releaser is not None  # handed to the background thread
+    holder.communicate("")
+    table._releaser.shutdown(wait=True)
+    assert isinstance(table.acquire(key_id(1), rate=0, burst=1, max_in_flight=1), Lease)
+
+
+def test_lease_timeout_covers_statement_timeout(monkeypatch):
+    from db.config import RoleLimits
+
+    key = ApiKey("k", "user", bytes(32))
+    monkeypatch.setattr(admission, "role_limits", lambda role: RoleLimits(statement_timeout_ms=900_000))
+    assert admission.lease_timeout(key) == 960.0
+    monkeypatch.setattr(admission, "role_limits", lambda role: RoleLimits())
+    assert admission.lease_timeout(key) == admission.LEASE_TIMEOUT
@@ -0,0 +1,87 @@
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from db import api_keys, config
+from main import _check_key_scope
+
+KEY = b"scoped-key"
+CONFIG = f"""
+permissions:
+  - role: company_user
+    limits:
+      max_rows: 10
+api_keys:
+  - name: scoped
+    role: admin
+    sha256: {hashlib.sha256(KEY).hexdigest()}
+    schemas: [company]
+"""
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    path = tmp_path / "mcp_config.yaml"
+    path.write_text(CONFIG)
+    monkeypatch.setenv("MCP_CONFIG_PATH", str(path))
+    monkeypatch.delenv("USER_API_KEY", raising=False)
+    monkeypatch.delenv("ADMIN_API_KEY", raising=False)
+    monkeypatch.setattr(config, "_config", None)
+    monkeypatch.setattr(api_keys, "_registry", None)
+    return path
+
+
+def test_lookup(config_file):
+    key = api_keys.lookup(b"Bearer " + KEY)
+    assert key.name == "scoped" and key.schemas == ("company",)
+    assert api_keys.lookup(b"Bearer other") is None
+    assert api_keys.lookup(KEY) is None
+
+
+def test_reload_swaps_config_and_keys(config_file):
+    assert api_keys.lookup(b"Bearer " + KEY) is not None
+    config_file.write_text(CONFIG.replace("max_rows: 10", "max_rows: 20").replace("scoped-key", "x")
+                           .replace(hashlib.sha256(KEY).hexdigest(), hashlib.sha256(b"new").hexdigest()))
+    assert api_keys.reload_api_keys()
+    assert api_keys.lookup(b"Bearer " + KEY) is None
+    assert api_keys.lookup(b"Bearer new") is not None
+    assert config.role_limits("user").max_rows == 20
+
+
+@pytest.mark.parametrize("broken", [
+    "permissions: [\n",                                              # YAML syntax error
+    CONFIG.replace("max_rows: 10", "max_rows: -1"),                  # invalid limits
+    CONFIG.replace("schemas: [company]", "schemas: [elsewhere]"),    # invalid key
+])
+def test_failed_reload_keeps_config_and_keys(config_file, broken):
+    assert api_keys.lookup(b"Bearer " + KEY) is not None
+    config_file.write_text(broken)
+    assert not api_keys.reload_api_keys()
+    assert api_keys.lookup(b"Bearer " + KEY) is not None
+    assert config.role_limits("user").max_rows == 10
+
+
+def scope_check(sql):
+    key = api_keys.ApiKey("scoped", "admin", b"", ("company",))
+    _check_key_scope(SimpleNamespace(scope={"state": {"principal": key}}), sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM finance.payroll",
+    "SELECT to_json(ARRAY(SELECT amount FROM finance.payroll)) FROM company.employees",
+    "SELECT * FROM company.employees UNION ALL TABLE finance.payroll",
+    "SELECT * FROM company.employees WHERE id IN (TABLE finance.ids)",
+    "SELECT * FROM company.employees CROSS JOIN (finance.payroll)",
+    "SELECT * FROM company.employees, finance.get_salaries()",
+    "SELECT * FROM company.employees e JOIN LATERAL finance.fn(e.id) f ON true",
+])
+def test_key_scope_rejects_other_schemas(sql):
+    with pytest.raises(HTTPException) as info:
+        scope_check(sql)
+    assert info.value.status_code == 403
+
+
+def test_key_scope_allows_its_schemas():
+    scope_check("SELECT * FROM company.employees UNION ALL TABLE company.former")
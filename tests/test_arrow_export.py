@@ -0,0 +1,38 @@
+from decimal import Decimal
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from db import arrow_export
+from db.config import RoleTypecasts
+
+
+def test_numeric_text_keeps_exact_digits():
+    pa = pytest.importorskip("pyarrow")
+    encoder = arrow_export.ArrowEncoder("arrow", ["amount"], [1700], RoleTypecasts())
+    data = encoder.encode([(Decimal("1234.50"),), (Decimal("12345678901234567890.123456789"),), (None,)])
+    data += encoder.finish()
+    table = pa.ipc.open_stream(data).read_all()
+    assert table.column("amount").to_pylist() == ["1234.50", "12345678901234567890.123456789", None]
+
+
+def test_numeric_float_profile_is_float64():
+    pa = pytest.importorskip("pyarrow")
+    encoder = arrow_export.ArrowEncoder("arrow", ["amount"], [1700], RoleTypecasts(numeric="float"))
+    data = encoder.encode([(1234.5,)]) + encoder.finish()
+    assert pa.ipc.open_stream(data).read_all().schema.field("amount").type == pa.float64()
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_without_pyarrow_the_api_answers_501(monkeypatch, fmt):
+    monkeypatch.setenv("USER_API_KEY", "test-user-key")
+    monkeypatch.setattr("db.api_keys._registry", None)
+    monkeypatch.setattr(arrow_export, "ARROW_AVAILABLE", False)
+    response = TestClient(main.app).post(
+        "/user/query",
+        json={"sql": "SELECT * FROM company.employees", "format": fmt},
+        headers={"Authorization": "Bearer test-user-key"},
+    )
+    assert response.status_code == 501
+    assert "pyarrow" in response.json()["detail"]
@@ -0,0 +1,60 @@
+import pytest
+
+from db import query_tool
+from db.config import RoleLimits
+from db.query_tool import BatchLimitError, QueryResult, execute_batch
+from db.sql_validator import SqlValidationError
+
+NUMBERS = "SELECT n FROM company.numbers WHERE n <= %s ORDER BY n"
+
+
+@pytest.fixture
+def numbers(database):
+    with database.cursor() as cur:
+        cur.execute("CREATE TABLE company.numbers AS SELECT generate_series(1, 100) AS n")
+    return database
+
+
+def limit(monkeypatch, **limits):
+    monkeypatch.setattr(query_tool, "role_limits", lambda role: RoleLimits(**limits))
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_rows_budget_is_shared_by_the_batch(numbers, monkeypatch, parallel):
+    limit(monkeypatch, max_rows=25)
+    results = execute_batch("user", [NUMBERS] * 4, parallel=parallel, params=[[10]] * 4)
+    rows = [len(r) for r in results if isinstance(r, QueryResult)]
+    assert sum(rows) == 25
+    # Sequentially exactly one statement is cut; in parallel, several may be cut at once.
+    assert sum(isinstance(r, QueryResult) and r.truncated for r in results) >= 1
+    assert all(isinstance(r, BatchLimitError) for r in results if not isinstance(r, QueryResult))
+
+
+def test_bytes_budget_is_shared_by_the_batch(numbers, monkeypatch):
+    limit(monkeypatch, max_response_bytes=200)
+    results = execute_batch("user", [NUMBERS] * 3, params=[[100]] * 3)
+    assert results[0].truncated and 0 < len(results[0]) < 100
+    assert isinstance(results[1], BatchLimitError) and isinstance(results[2], BatchLimitError)
+
+
+def test_within_budget_nothing_is_cut(numbers, monkeypatch):
+    limit(monkeypatch, max_rows=100)
+    results = execute_batch("user", [NUMBERS] * 2, params=[[50], [50]])
+    assert [len(r) for r in results] == [50, 50]
+    assert not any(r.truncated for r in results)
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_partial_failure(numbers, parallel):
+    results = execute_batch("user", [
+        "SELECT count(*) FROM company.numbers",
+        "SELECT 1 / (n - n) FROM company.numbers",   # division by zero
+        "SELECT * FROM finance.payroll",             # rejected by validation
+        "SELECT * FROM company.missing",
+        "SELECT max(n) FROM company.numbers",
+    ], parallel=parallel)
+    assert results[0].rows == [(100,)]
+    assert isinstance(results[1], ValueError) and "division by zero" in str(results[1])
+    assert isinstance(results[2], SqlValidationError)
+    assert isinstance(results[3], ValueError)
+    assert results[4].rows == [(100,)]
@@ -0,0 +1,216 @@
+import threading
+import time
+
+import pytest
+
+from db import query_tool
+from db.query_tool import _open_stream, _single_flight
+
+
+class FakeStream:
+    """Stands in for QueryStream: `batches` batches of one row each."""
+
+    instances = []
+    batches = 4
+    opening = None        # threading.Event the constructor waits for, if set
+    open_error = None     # raised by the constructor
+    fetch_error = None    # raised by fetch_batch after the first batch
+
+    def __init__(self, role, text, args, schemas, batch_size):
+        if FakeStream.opening is not None:
+            FakeStream.opening.wait(5)
+        if FakeStream.open_error is not None:
+            raise FakeStream.open_error
+        self.role = role
+        self.batch_size = batch_size or 1
+        self.columns = ["n"]
+        self.type_codes = [23]
+        self.limits = None
+        self.truncated = False
+        self.closed = False
+        self.fetched = 0
+        FakeStream.instances.append(self)
+
+    def fetch_batch(self):
+        if self.fetched and FakeStream.fetch_error is not None:
+            raise FakeStream.fetch_error
+        if self.fetched >= FakeStream.batches:
+            return []
+        self.fetched += 1
+        return [(self.fetched,)]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fake_stream(monkeypatch):
+    monkeypatch.setattr(query_tool, "QueryStream", FakeStream)
+    monkeypatch.setattr(query_tool, "COALESCE_ENABLED", True)
+    monkeypatch.setattr(query_tool, "_streams", {})
+    monkeypatch.setattr(FakeStream, "instances", [])
+    monkeypatch.setattr(FakeStream, "opening", None)
+    monkeypatch.setattr(FakeStream, "open_error", None)
+    monkeypatch.setattr(FakeStream, "fetch_error", None)
+
+
+def open_stream():
+    return _open_stream("user", "SELECT n FROM company.t", [], ["company"], None)
+
+
+def drain(stream):
+    rows = []
+    while True:
+        batch = stream.fetch_batch()
+        if not batch:
+            return rows
+        rows.extend(batch)
+
+
+def wait_until(predicate):
+    deadline = time.monotonic() + 5
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def in_thread(fn):
+    """Run fn in a thread; returns a function that joins it and returns (result, error)."""
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = fn()
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+
+    def join():
+        thread.join(5)
+        return outcome.get("result"), outcome.get("error")
+    return join
+
+
+def test_joiners_share_one_stream_until_the_first_batch():
+    first = open_stream()
+    second = open_stream()
+    assert len(FakeStream.instances) == 1
+    assert drain(first) == [(1,), (2,), (3,), (4,)]
+    # The first batch has been handed out: a new caller gets its own stream.
+    third = open_stream()
+    assert len(FakeStream.instances) == 2
+    assert drain(second) == [(1,), (2,), (3,), (4,)]
+    assert drain(third) == [(1,), (2,), (3,), (4,)]
+    for stream in (first, second, third):
+        stream.close()
+
+
+def test_joiner_waits_for_a_stream_that_is_still_opening():
+    FakeStream.opening = threading.Event()
+    leader = in_thread(open_stream)
+    wait_until(lambda: query_tool._streams)
+    joiner = in_thread(open_stream)
+    shared = next(iter(query_tool._streams.values()))
+    wait_until(lambda: len(shared.positions) == 2)
+    FakeStream.opening.set()
+    (first, _), (second, _) = leader(), joiner()
+    assert len(FakeStream.instances) == 1
+    assert drain(first) == drain(second) == [(1,), (2,), (3,), (4,)]
+
+
+def test_open_error_reaches_every_subscriber():
+    FakeStream.opening = threading.Event()
+    FakeStream.open_error = ValueError("Database error: boom")
+    leader = in_thread(open_stream)
+    wait_until(lambda: query_tool._streams)
+    joiner = in_thread(open_stream)
+    shared = next(iter(query_tool._streams.values()))
+    wait_until(lambda: len(shared.positions) == 2)
+    FakeStream.opening.set()
+    assert leader()[1] is FakeStream.open_error
+    assert joiner()[1] is FakeStream.open_error
+    assert not query_tool._streams
+
+
+def test_fetch_error_reaches_every_subscriber():
+    FakeStream.fetch_error = ValueError("Database error: connection lost")
+    first, second = open_stream(), open_stream()
+    assert first.fetch_batch() == [(1,)]
+    with pytest.raises(ValueError):
+        first.fetch_batch()
+    assert second.fetch_batch() == [(1,)]
+    with pytest.raises(ValueError):
+        second.fetch_batch()
+
+
+def test_slow_subscriber_is_dropped_at_the_cap(monkeypatch):
+    monkeypatch.setattr(query_tool, "COALESCE_MAX_BATCHES", 2)
+    monkeypatch.setattr(query_tool, "COALESCE_LAG_TIMEOUT", 0.05)
+    monkeypatch.setattr(FakeStream, "batches", 6)
+    fast, slow = open_stream(), open_stream()
+    assert slow.fetch_batch() == [(1,)]
+    assert drain(fast) == [(n,) for n in range(1, 7)]
+    shared = fast._shared
+    assert len(shared.batches) <= 2  # never held more than the cap
+    with pytest.raises(ValueError, match="too slowly"):
+        slow.fetch_batch()
+    fast.close()
+    slow.close()
+    assert FakeStream.instances[0].closed
+
+
+def test_subscriber_within_the_cap_keeps_up(monkeypatch):
+    monkeypatch.setattr(query_tool, "COALESCE_MAX_BATCHES", 2)
+    monkeypatch.setattr(query_tool, "COALESCE_LAG_TIMEOUT", 5)
+    fast, slow = open_stream(), open_stream()
+    fast_rows = in_thread(lambda: drain(fast))
+    # The fast reader waits at the cap until the slow one catches up.
+    assert drain(slow) == [(1,), (2,), (3,), (4,)]
+    assert fast_rows() == ([(1,), (2,), (3,), (4,)], None)
+
+
+def test_stream_closes_when_the_last_subscriber_leaves():
+    first, second = open_stream(), open_stream()
+    stream = FakeStream.instances[0]
+    first.close()
+    first.close()  # idempotent
+    assert not stream.closed
+    assert drain(second) == [(1,), (2,), (3,), (4,)]
+    second.close()
+    assert stream.closed
+    assert not query_tool._streams
+
+
+def test_single_flight_shares_one_execution_and_its_error(monkeypatch):
+    monkeypatch.setattr(query_tool, "COALESCE_ENABLED", True)
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    leader = in_thread(lambda: _single_flight(("user", "q"), slow))
+    wait_until(lambda: ("user", "q") in query_tool._flights)
+    joiner = in_thread(lambda: _single_flight(("user", "q"), slow))
+    wait_until(lambda: query_tool._flights[("user", "q")].waiters == 1)
+    release.set()
+    assert leader() == (("result", False), None)
+    assert joiner() == (("result", True), None)
+    assert len(calls) == 1
+
+    def fail():
+        release.wait(5)
+        raise ValueError("Database error: boom")
+
+    release.clear()
+    leader = in_thread(lambda: _single_flight(("user", "q"), fail))
+    wait_until(lambda: ("user", "q") in query_tool._flights)
+    joiner = in_thread(lambda: _single_flight(("user", "q"), fail))
+    wait_until(lambda: query_tool._flights[("user", "q")].waiters == 1)
+    release.set()
+    assert isinstance(leader()[1], ValueError)
+    assert joiner()[1] is leader()[1]
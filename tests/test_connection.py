@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from db import connection
+
+
+class FakeRaw:
+    closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def env(monkeypatch):
+    for name, value in (("SUPABASE_DB_HOST", "db"), ("SUPABASE_DB_NAME", "app"),
+                        ("SUPABASE_DB_USER", "u"), ("SUPABASE_DB_PASSWORD", "p")):
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(connection, "_pools", {})
+    monkeypatch.setattr(connection, "_session_setup", lambda role: None)
+
+
+def test_connect_timeout_is_passed(env, monkeypatch):
+    calls = []
+    monkeypatch.setattr(connection.psycopg2, "connect", lambda dsn, **kw: calls.append(kw) or FakeRaw())
+    connection.get_pool("user")
+    assert calls == [{"connect_timeout": 10}]
+
+
+def test_slow_pool_build_does_not_block_stats(env, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def slow_connect(dsn, **kw):
+        started.set()
+        release.wait(5)
+        return FakeRaw()
+
+    monkeypatch.setattr(connection.psycopg2, "connect", slow_connect)
+    builder = threading.Thread(target=connection.get_pool, args=("user",))
+    builder.start()
+    try:
+        assert started.wait(5)
+        assert connection._pools_lock.acquire(timeout=1)
+        connection._pools_lock.release()
+        assert connection.pool_stats() == {}
+    finally:
+        release.set()
+        builder.join(5)
+    assert connection.pool_stats()["user"]["size"] == 1
+
+
+def test_racing_builders_share_one_pool(env, monkeypatch):
+    opened = []
+    gate = threading.Barrier(2)
+
+    def connect(dsn, **kw):
+        gate.wait(5)
+        opened.append(FakeRaw())
+        return opened[-1]
+
+    monkeypatch.setattr(connection.psycopg2, "connect", connect)
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(connection.get_pool("user"))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert pools[0] is pools[1]
+    assert sum(raw.closed for raw in opened) == 1  # the losing pool was closed
+
+
+def test_failed_build_is_not_cached(env, monkeypatch):
+    def refuse(dsn, **kw):
+        raise connection.psycopg2.OperationalError("timeout expired")
+
+    monkeypatch.setattr(connection.psycopg2, "connect", refuse)
+    with pytest.raises(connection.psycopg2.OperationalError):
+        connection.get_pool("user")
+    assert connection.pool_stats() == {}
@@ -0,0 +1,16 @@
+import decimal
+
+from db.encoding import dumps, encode
+
+
+def test_integral_decimals_stay_exact_integers():
+    assert dumps([decimal.Decimal("5"), decimal.Decimal("12345678901234567890")]) == "[5,12345678901234567890]"
+    assert encode({"n": decimal.Decimal("1E+2")}) == b'{"n":100}'
+
+
+def test_fractional_decimals_become_floats():
+    assert dumps([decimal.Decimal("1.50"), decimal.Decimal("5.0")]) == "[1.5,5.0]"
+
+
+def test_special_decimals_do_not_crash():
+    assert dumps([decimal.Decimal("NaN")]) == "[NaN]"
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from db import query_tool
+from db.config import RoleLimits
+from db.query_tool import execute_json
+
+SQL = "SELECT n, repeat('x', 10) AS pad FROM company.numbers ORDER BY n"
+
+
+@pytest.fixture
+def numbers(database):
+    with database.cursor() as cur:
+        cur.execute("CREATE TABLE company.numbers AS SELECT generate_series(1, 100) AS n")
+    return database
+
+
+def limit(monkeypatch, **limits):
+    monkeypatch.setattr(query_tool, "role_limits", lambda role: RoleLimits(**limits))
+
+
+def test_rows_limit_truncates_in_sql(numbers, monkeypatch):
+    limit(monkeypatch, max_rows=10)
+    result, status = execute_json("user", SQL, use_cache=False)
+    assert status == "BYPASS" and result.truncated and result.rows == 10
+    assert [row["n"] for row in json.loads(result.text)] == list(range(1, 11))
+
+
+def test_oversized_array_stays_in_the_database(numbers, monkeypatch):
+    limit(monkeypatch, max_rows=1000, max_response_bytes=500)
+    assert execute_json("user", SQL, use_cache=False) == (None, "BYPASS")
+    limit(monkeypatch, max_rows=1000, max_response_bytes=10_000)
+    result, _ = execute_json("user", SQL, use_cache=False)
+    assert result.rows == 100 and len(result.text.encode()) <= 10_000
+
+
+def test_bytes_limit_alone_is_enough(numbers, monkeypatch):
+    limit(monkeypatch, max_response_bytes=10_000)
+    result, _ = execute_json("user", SQL, use_cache=False)
+    assert result.rows == 100 and not result.truncated
+
+
+def test_roles_without_limits_fall_back(monkeypatch):
+    limit(monkeypatch)
+    assert execute_json("user", SQL, use_cache=False) == (None, "BYPASS")
@@ -0,0 +1,76 @@
+import pytest
+
+from db import query_tool
+from db.config import RoleLimits
+from db.query_tool import PaginationError, execute_page
+
+
+@pytest.fixture
+def items(database):
+    with database.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE company.items (id int, name text, tags text[], doc jsonb, blob bytea, note json);
+            INSERT INTO company.items VALUES
+              (1, 'a', '{x,"y z"}', '{"k": [1, 2]}', '\\x00ff', '{}'),
+              (2, NULL, NULL, NULL, NULL, '{}'),
+              (3, 'c', '{}', '{"k": null}', '\\x', '{}'),
+              (NULL, 'd', '{q}', '"s"', '\\x01', '{}'),
+              (NULL, NULL, NULL, NULL, NULL, '{}')
+        """)
+    return database
+
+
+def all_pages(sql, limit, **kwargs):
+    rows, token, pages = [], None, 0
+    while True:
+        page, token = execute_page("user", sql, limit, token, **kwargs)
+        rows.extend(page.rows)
+        pages += 1
+        if token is None:
+            return rows, pages
+
+
+@pytest.mark.parametrize("limit", [1, 2, 4])
+def test_token_round_trips_every_key_type(items, limit):
+    # Default keyset: every orderable column, including arrays, jsonb, bytea and NULLs.
+    rows, _ = all_pages("SELECT id, name, tags, doc, blob FROM company.items", limit)
+    assert len(rows) == 5
+    assert sorted(row[0] or 0 for row in rows) == [0, 0, 1, 2, 3]
+
+
+def test_null_keys_do_not_skip_rows(items):
+    rows, pages = all_pages("SELECT id, name FROM company.items", 1, order_by=["id", "name"])
+    assert rows == [(1, "a"), (2, None), (3, "c"), (None, "d"), (None, None)]
+    assert pages == 5
+
+
+def test_unordered_columns_are_left_out_of_the_default_keyset(items):
+    rows, _ = all_pages("SELECT id, name, note FROM company.items", 2)
+    assert len(rows) == 5
+    with pytest.raises(PaginationError):
+        execute_page("user", "SELECT id, note FROM company.items", 2, order_by=["note"])
+
+
+@pytest.mark.parametrize("token", ["garbage", "eyJmIjoieCIsImsiOlsiaWQiXSwidiI6WzFdfQ"])
+def test_bad_token(items, token):
+    with pytest.raises(PaginationError):
+        execute_page("user", "SELECT id FROM company.items", 2, token)
+
+
+def test_token_is_bound_to_its_query(items):
+    _, token = execute_page("user", "SELECT id FROM company.items", 2)
+    with pytest.raises(PaginationError):
+        execute_page("user", "SELECT id, name FROM company.items", 2, token)
+
+
+def test_unknown_order_by_column(items):
+    with pytest.raises(PaginationError):
+        execute_page("user", "SELECT id FROM company.items", 2, order_by=["nope"])
+
+
+def test_pages_stop_at_max_response_bytes(items, monkeypatch):
+    monkeypatch.setattr(query_tool, "role_limits", lambda role: RoleLimits(max_response_bytes=40))
+    page, token = execute_page("user", "SELECT id, name FROM company.items", 4)
+    assert 0 < len(page) < 4 and token is not None
+    rows, _ = all_pages("SELECT id, name FROM company.items", 4)
+    assert len(rows) == 5
@@ -0,0 +1,166 @@
+import pytest
+
+from db.sql_validator import SqlValidationError, analyze, parameterize, query_fingerprint, validate_select
+
+COMPANY = ("company",)
+ERROR = "Only queries on the 'company' schema are permitted."
+
+
+def accepted(sql, allowed=COMPANY):
+    return validate_select(sql, allowed, ERROR)
+
+
+def rejected(sql, allowed=COMPANY):
+    with pytest.raises(SqlValidationError):
+        validate_select(sql, allowed, ERROR)
+
+
+def test_plain_select():
+    assert accepted("SELECT id FROM company.employees").schemas == {"company"}
+
+
+def test_other_schema_rejected():
+    rejected("SELECT * FROM finance.payroll")
+    rejected("SELECT * FROM company.employees e JOIN finance.payroll p ON p.id = e.id")
+    rejected("SELECT * FROM company.employees, finance.payroll")
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT array(SELECT usename FROM pg_user) FROM company.employees",
+    "SELECT to_json(ARRAY(SELECT passwd FROM pg_shadow)) FROM company.e",
+    "SELECT coalesce((SELECT max(amount) FROM finance.payroll), 0) FROM company.employees",
+    "SELECT count(*) FILTER (WHERE id IN (SELECT id FROM finance.payroll)) FROM company.employees",
+    "SELECT extract(year FROM (SELECT min(paid_at) FROM finance.payroll)) FROM company.employees",
+    "SELECT substring(name FROM 1 FOR 2), array(SELECT 1 FROM finance.x) FROM company.employees",
+])
+def test_subqueries_inside_function_calls_are_checked(sql):
+    rejected(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT extract(year FROM hired_at) FROM company.employees",
+    "SELECT substring(name FROM 1 FOR 3) FROM company.employees",
+    "SELECT trim(BOTH ' ' FROM name) FROM company.employees",
+    "SELECT overlay(name PLACING 'x' FROM 2 FOR 1) FROM company.employees",
+    "SELECT position('a' IN name) FROM company.employees",
+    "SELECT array(SELECT e2.id FROM company.employees e2) FROM company.employees",
+])
+def test_from_inside_function_syntax_is_not_a_relation(sql):
+    assert accepted(sql).relations[-1] == ("company", "employees")
+
+
+def test_ctes():
+    analysis = accepted("WITH recent AS (SELECT * FROM company.employees) SELECT * FROM recent")
+    assert analysis.ctes == {"recent"}
+    rejected("WITH p AS (SELECT * FROM finance.payroll) SELECT * FROM p JOIN company.employees e ON true")
+    rejected("WITH x AS (DELETE FROM company.employees RETURNING *) SELECT * FROM x")
+
+
+def test_unknown_unqualified_relation_rejected():
+    rejected("SELECT * FROM employees")
+
+
+def test_literals_do_not_count_as_schemas():
+    rejected("SELECT 'company.employees' FROM finance.payroll")
+    rejected("SELECT $$ FROM company.employees $$ FROM finance.payroll")
+    analysis = accepted("SELECT * FROM company.employees WHERE note = 'see finance.payroll'")
+    assert analysis.schemas == {"company"}
+
+
+def test_comments_are_ignored():
+    rejected("SELECT * FROM /* company.employees */ finance.payroll")
+    rejected("SELECT * FROM finance.payroll -- company.employees")
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM company.employees FOR SHARE",
+    "SELECT * FROM company.employees FOR KEY SHARE",
+    "SELECT * FROM company.employees FOR UPDATE",
+    "SELECT * FROM company.employees FOR NO KEY UPDATE",
+    "SELECT * INTO company.copy FROM company.employees",
+])
+def test_locking_and_writing_clauses_rejected(sql):
+    rejected(sql)
+
+
+def test_share_as_an_identifier_is_fine():
+    accepted("SELECT key share FROM company.employees")
+
+
+def test_single_statement_only():
+    rejected("SELECT 1 FROM company.employees; SELECT 1 FROM company.employees")
+    assert analyze("SELECT id FROM company.employees;").sql == "SELECT id FROM company.employees"
+
+
+def test_non_select_rejected():
+    rejected("UPDATE company.employees SET id = 1")
+    rejected("VALUES (1)")
+
+
+def test_parameterize_lifts_comparison_literals():
+    text, args, fingerprint = parameterize("SELECT * FROM company.t WHERE id = 17 LIMIT 5", [])
+    assert text == "SELECT * FROM company.t WHERE id = %s::int4 LIMIT %s::int4"
+    assert args == [17, 5]
+    assert parameterize("SELECT * FROM company.t WHERE id = 42 LIMIT 9", [])[2] == fingerprint
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT CASE WHEN x = 1 THEN 'a' END, count(*) FROM company.t GROUP BY CASE WHEN x = 1 THEN 'a' END",
+    "SELECT x = 1 AS flag, count(*) FROM company.t GROUP BY x = 1",
+    "SELECT count(*) FROM company.t GROUP BY x > 1 HAVING x > 1",
+    "SELECT DISTINCT x = 'a' FROM company.t ORDER BY x = 'a'",
+])
+def test_parameterize_keeps_literals_when_expressions_are_matched(sql):
+    assert parameterize(sql, []) == (sql, [], query_fingerprint(sql))
+
+
+def test_parameterize_still_lifts_limit_with_group_by():
+    text, args, _ = parameterize("SELECT x = 1, count(*) FROM company.t GROUP BY x = 1 LIMIT 10", [])
+    assert text == "SELECT x = 1, count(*) FROM company.t GROUP BY x = 1 LIMIT %s::int4"
+    assert args == [10]
+
+
+def test_relations_include_subqueries_inside_calls():
+    # API key scopes (main._check_key_scope) are checked against these relations.
+    analysis = analyze("SELECT to_json(ARRAY(SELECT amount FROM finance.payroll)) FROM company.employees")
+    assert {schema for schema, _ in analysis.relations} == {"company", "finance"}
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM company.employees UNION ALL TABLE finance.payroll",
+    "SELECT * FROM company.employees WHERE id IN (TABLE finance.ids)",
+    "SELECT * FROM company.employees WHERE x = (TABLE finance.y LIMIT 1)",
+    "SELECT * FROM company.employees CROSS JOIN (finance.payroll)",
+    "SELECT * FROM (company.employees e JOIN finance.payroll p ON p.id = e.id)",
+    "SELECT * FROM company.employees, finance.get_salaries()",
+    "SELECT * FROM company.employees e JOIN LATERAL finance.fn(e.id) f ON true",
+    "SELECT * FROM company.employees, ROWS FROM (finance.fn())",
+])
+def test_table_parenthesized_and_function_relations_are_checked(sql):
+    rejected(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM company.employees UNION ALL TABLE company.former",
+    "SELECT * FROM (company.employees e JOIN company.teams t ON t.id = e.team)",
+    "SELECT * FROM company.employees, company.team_members(1)",
+    "SELECT * FROM company.employees e, unnest(e.tags) t",
+    "SELECT * FROM company.employees e, (VALUES (1), (2)) v(n)",
+])
+def test_table_parenthesized_and_function_relations_in_schema(sql):
+    assert accepted(sql).schemas == {"company"}
+
+
+def test_parameterize_reuses_the_rewrite(monkeypatch):
+    from db import sql_validator
+
+    text = "SELECT * FROM company.t WHERE a = %s AND b = 'x' AND c = %s LIMIT 3"
+    first = parameterize(text, [1, 2])
+    calls = []
+    monkeypatch.setattr(sql_validator, "tokenize", lambda sql: calls.append(sql) or [])
+    assert parameterize(text, [1, 2]) == first
+    again = parameterize(text, [7, 8])
+    assert calls == []
+    assert again[0] == first[0] == "SELECT * FROM company.t WHERE a = %s AND b = %s AND c = %s LIMIT %s::int4"
+    assert again[1] == [7, "x", 8, 3]
+    assert again[2] == first[2]